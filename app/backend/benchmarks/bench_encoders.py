@@ -0,0 +1,129 @@
+"""Latency and throughput of the query encoders on CPU.
+
+Run from the backend directory; with --random-init a randomly initialized model of
+the same shape as BAAI/bge-small-en-v1.5 is used instead of the pretrained one, so
+that the timings can be measured without downloading the model (the parity figures
+are then meaningless):
+
+    python -m benchmarks.bench_encoders [--random-init] [--threads 4]
+"""
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+from FlagEmbedding import FlagModel  # type: ignore
+from transformers import BertConfig, BertModel, BertTokenizerFast  # type: ignore
+
+from encoders import PARITY_QUERIES, QuantizedEncoder, check_parity
+
+
+class TorchEncoder:
+    """Full-precision encoder pooling the same way as FlagModel for BGE models."""
+
+    def __init__(self, model, tokenizer):
+        self.model = model.eval()
+        self.tokenizer = tokenizer
+
+    def encode(self, sentences):
+        batch = [sentences] if isinstance(sentences, str) else sentences
+        inputs = self.tokenizer(batch, padding=True, return_tensors="pt")
+        with torch.inference_mode():
+            hidden = self.model(**inputs).last_hidden_state[:, 0]
+        embeddings = torch.nn.functional.normalize(hidden, dim=-1).numpy()
+        return embeddings[0] if isinstance(sentences, str) else embeddings
+
+
+def make_random_encoders(tmp_dir: Path) -> dict:
+    """Make encoders of a randomly initialized model shaped like bge-small-en-v1.5."""
+    words = sorted({w for q in PARITY_QUERIES for w in q.lower().split()})
+    vocab_path = tmp_dir / "vocab.txt"
+    vocab_path.write_text(
+        "\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]", *words])
+    )
+    tokenizer = BertTokenizerFast(vocab_file=str(vocab_path))
+    torch.manual_seed(0)
+    config = BertConfig(
+        vocab_size=tokenizer.vocab_size,
+        hidden_size=384,
+        num_hidden_layers=12,
+        num_attention_heads=12,
+        intermediate_size=1536,
+    )
+    model = BertModel(config)
+    return {
+        "fp32": TorchEncoder(model, tokenizer),
+        "int8": QuantizedEncoder(model, tokenizer),
+    }
+
+
+def measure_latency(encoder, queries, repeat):
+    """Measure the latencies of encoding single queries in milliseconds."""
+    latencies = []
+    for _ in range(repeat):
+        for query in queries:
+            started_at = time.perf_counter()
+            encoder.encode(query)
+            latencies.append((time.perf_counter() - started_at) * 1000)
+    return np.array(latencies)
+
+
+def measure_throughput(encoder, queries, batch_size, repeat):
+    """Measure the throughput of encoding batches of queries per second."""
+    batch = [queries[i % len(queries)] for i in range(batch_size)]
+    started_at = time.perf_counter()
+    for _ in range(repeat):
+        encoder.encode(batch)
+    return batch_size * repeat / (time.perf_counter() - started_at)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", default="BAAI/bge-small-en-v1.5")
+    parser.add_argument("--random-init", action="store_true")
+    parser.add_argument("--threads", type=int, help="Number of torch threads")
+    parser.add_argument("-r", "--repeat", type=int, default=5)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32])
+    args = parser.parse_args()
+
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if args.random_init:
+            encoders = make_random_encoders(Path(tmp_dir))
+        else:
+            encoders = {
+                "flag": FlagModel(args.model, use_fp16=True),
+                "int8": QuantizedEncoder.from_pretrained(args.model),
+            }
+        reference_name, reference = next(iter(encoders.items()))
+
+        print(
+            f"{len(PARITY_QUERIES)} queries, {torch.get_num_threads()} thread(s), "
+            f"parity against {reference_name!r}"
+        )
+        header = f"{'encoder':<10}{'min cos':>10}{'p50':>10}{'p99':>10}"
+        header += "".join(f"{f'bs={bs} q/s':>14}" for bs in args.batch_sizes)
+        print(header)
+        for name, encoder in encoders.items():
+            report = check_parity(encoder, reference)
+            measure_latency(encoder, PARITY_QUERIES[:2], 1)  # Warm up
+            latencies = measure_latency(encoder, PARITY_QUERIES, args.repeat)
+            throughputs = [
+                measure_throughput(encoder, PARITY_QUERIES, bs, args.repeat)
+                for bs in args.batch_sizes
+            ]
+            print(
+                f"{name:<10}{report.min_similarity:>10.4f}"
+                f"{np.percentile(latencies, 50):>8.2f}ms"
+                f"{np.percentile(latencies, 99):>8.2f}ms"
+                + "".join(f"{throughput:>14.1f}" for throughput in throughputs)
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+"""HTTP load test of the backend APIs with stand-ins for the external services.
+
+Run from the backend directory. The app is served in-process through an ASGI transport
+with stand-ins of configurable latencies for the embedding model, ChromaDB and the
+Vertex AI model, or a running backend is targeted with --url instead. Each endpoint is
+driven by concurrent clients in turn, and the throughput and latency percentiles of
+each are written as JSON; with --baseline they are compared against a previous run,
+exiting with status 1 on regressions beyond the tolerance:
+
+    python -m benchmarks.bench_load [-c 16] [-d 10] [-o run.json] [--baseline base.json]
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import random
+import sys
+import time
+import zlib
+
+import httpx
+import numpy as np
+
+import main as backend
+from cache import AnswerCache, LRUCache, QueryEmbeddingCache
+from conftest import MockChatSession, MockChromadbCollection, MockGenerativeModel
+
+ENDPOINTS = ["retrieve", "meta", "chat"]
+
+FILTERS = [
+    {},
+    {"studyType": "interventional", "eligibleSex": "female"},
+    {"studyPhases": ["PHASE2", "PHASE3"]},
+    {"lastUpdateDatePosted": [1262304000000, 1577836800000]},
+]
+
+
+class StandInEncoder:
+    """Embedding model stand-in taking a fixed time per call like a forward pass.
+
+    The embeddings are random unit vectors seeded by the sentences, so that distinct
+    queries miss the caches as they would with the real model.
+    """
+
+    def __init__(self, latency: float, dim: int = 384):
+        self.latency = latency
+        self.dim = dim
+
+    def _embed(self, sentence: str) -> np.ndarray:
+        rng = np.random.default_rng(zlib.crc32(sentence.encode("utf-8")))
+        embedding = rng.normal(size=self.dim)
+        return embedding / np.linalg.norm(embedding)
+
+    def encode(self, sentences):
+        time.sleep(self.latency)
+        if isinstance(sentences, str):
+            return self._embed(sentences)
+        return np.stack([self._embed(sentence) for sentence in sentences])
+
+
+class StandInCollection(MockChromadbCollection):
+    """ChromaDB collection stand-in taking a fixed time per call.
+
+    The calls block like those of the synchronous ChromaDB HTTP client.
+    """
+
+    def __init__(self, latency: float, filter_pushdown: bool = False):
+        super().__init__(filter_pushdown=filter_pushdown)
+        self.latency = latency
+
+    def query(self, **kwargs):
+        time.sleep(self.latency)
+        return super().query(**kwargs)
+
+    def get(self, **kwargs):
+        time.sleep(self.latency)
+        return super().get(**kwargs)
+
+
+class StandInChromadbClient:
+    """ChromaDB client stand-in without the collection of trial sections."""
+
+    def __init__(self, latency: float, filter_pushdown: bool = False):
+        self.collection = StandInCollection(latency, filter_pushdown)
+
+    def get_collection(self, name):
+        if name == backend.CHROMADB_SECTIONS_COLLECTION_NAME:
+            raise ValueError(f"Collection {name} does not exist.")
+        return self.collection
+
+
+def setup_stand_ins(args: argparse.Namespace) -> None:
+    """Point the app to the stand-ins, with empty caches."""
+    import vertexai.generative_models  # type: ignore
+
+    MockChatSession.CHUNKS = [f"Chunk {i} of the response. " for i in range(8)]
+    MockChatSession.DELAY = args.llm_latency / 1000 / len(MockChatSession.CHUNKS)
+    vertexai.generative_models.GenerativeModel = MockGenerativeModel
+    vertexai.generative_models.ChatSession = MockChatSession
+
+    backend.EMBEDDING_MODEL = StandInEncoder(args.embedding_latency / 1000)
+    backend.EMBEDDING_CACHE = QueryEmbeddingCache("stand-in")
+    backend.CHROMADB_CLIENT = StandInChromadbClient(  # type: ignore
+        args.chroma_latency / 1000, filter_pushdown=args.filter_pushdown
+    )
+    for name in [
+        "RESULT_CACHE",
+        "METADATA_CACHE",
+        "META_RESPONSE_CACHE",
+        "TRIAL_SECTIONS_CACHE",
+        "SECTION_VECTORS_CACHE",
+    ]:
+        setattr(backend, name, LRUCache(getattr(backend, name).max_entries))
+    backend.ANSWER_CACHE = AnswerCache(backend.ANSWER_CACHE.max_entries)
+
+    # Chats warn on each request that the stand-in has no trial sections
+    backend.logger.setLevel(logging.ERROR)
+
+
+def make_request(endpoint: str, i: int) -> tuple[str, str, dict]:
+    """Make the i-th request to an endpoint as (method, URL, keyword arguments).
+
+    Queries are distinct so that they miss the query caches, while trials are drawn
+    from the few of the stand-in collection so that the metadata caches are hot.
+    """
+    rng = random.Random(i)
+    item_id = f"id{rng.randrange(len(MockChromadbCollection.RECORDS))}"
+    if endpoint == "retrieve":
+        params = {
+            "query": f"Query {i} about clinical trials",
+            "top_k": 10,
+            "filters_serialized": json.dumps(FILTERS[i % len(FILTERS)]),
+        }
+        return "GET", "/retrieve", {"params": params}
+    if endpoint == "meta":
+        return "GET", f"/meta/{item_id}", {}
+    payload = {"query": f"Question {i} about the trial"}
+    return "POST", f"/chat/gemini-1.5-flash-001/{item_id}", {"json": payload}
+
+
+async def drive(
+    client: httpx.AsyncClient, endpoint: str, concurrency: int, duration: float
+) -> dict:
+    """Drive an endpoint with concurrent clients for a duration in seconds."""
+    latencies: list[float] = []
+    errors = 0
+    counter = iter(range(sys.maxsize))
+    deadline = time.perf_counter() + duration
+
+    async def _client() -> None:
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            method, url, kwargs = make_request(endpoint, next(counter))
+            started_at = time.perf_counter()
+            try:
+                response = await client.request(method, url, **kwargs)
+                ok = response.status_code == 200
+            except httpx.HTTPError:
+                ok = False
+            if ok:
+                latencies.append((time.perf_counter() - started_at) * 1000)
+            else:
+                errors += 1
+
+    started_at = time.perf_counter()
+    await asyncio.gather(*(_client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started_at
+
+    result = {"requests": len(latencies), "errors": errors, "rps": 0.0}
+    if len(latencies) > 0:
+        result["rps"] = len(latencies) / elapsed
+        for p in [50, 95, 99]:
+            result[f"p{p}Ms"] = float(np.percentile(latencies, p))
+        result["meanMs"] = float(np.mean(latencies))
+    return result
+
+
+def compare(
+    run: dict, baseline: dict, tolerance: float, min_latency_ms: float = 1
+) -> list[str]:
+    """Compare a run against a baseline, returning the regressions found.
+
+    Latencies are only compared beyond an absolute floor of `min_latency_ms`, since
+    scheduler jitter alone easily exceeds the relative tolerance of sub-millisecond
+    latencies.
+    """
+    regressions = []
+    for endpoint, result in run["endpoints"].items():
+        if endpoint not in baseline["endpoints"]:
+            continue
+        base = baseline["endpoints"][endpoint]
+        if result["rps"] < base["rps"] * (1 - tolerance):
+            regressions.append(
+                f"{endpoint}: {result['rps']:.1f} rps < baseline {base['rps']:.1f}"
+            )
+        for key in ["p50Ms", "p95Ms", "p99Ms"]:
+            if (
+                key in result
+                and key in base
+                and result[key] > base[key] * (1 + tolerance)
+                and result[key] - base[key] >= min_latency_ms
+            ):
+                regressions.append(
+                    f"{endpoint}: {key} {result[key]:.1f} > baseline {base[key]:.1f}"
+                )
+        if result["errors"] > base["errors"]:
+            regressions.append(
+                f"{endpoint}: {result['errors']} errors > baseline {base['errors']}"
+            )
+    return regressions
+
+
+async def run(args: argparse.Namespace) -> dict:
+    """Run the load test of all selected endpoints."""
+    if args.url is not None:
+        transport = None
+        base_url = args.url
+    else:
+        setup_stand_ins(args)
+        transport = httpx.ASGITransport(app=backend.app)
+        base_url = "http://backend"
+
+    endpoints = {}
+    async with httpx.AsyncClient(
+        transport=transport, base_url=base_url, timeout=args.timeout
+    ) as client:
+        for endpoint in args.endpoints:
+            await drive(client, endpoint, args.concurrency, args.warmup)
+            endpoints[endpoint] = await drive(
+                client, endpoint, args.concurrency, args.duration
+            )
+
+    config = {
+        "url": args.url,
+        "concurrency": args.concurrency,
+        "durationS": args.duration,
+        "filterPushdown": args.filter_pushdown,
+    }
+    if args.url is None:
+        config["embeddingLatencyMs"] = args.embedding_latency
+        config["chromaLatencyMs"] = args.chroma_latency
+        config["llmLatencyMs"] = args.llm_latency
+    return {"config": config, "endpoints": endpoints}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="Backend URL; in-process stand-ins if not given")
+    parser.add_argument("-e", "--endpoints", nargs="+", default=ENDPOINTS)
+    parser.add_argument("-c", "--concurrency", type=int, default=16)
+    parser.add_argument("-d", "--duration", type=float, default=10)
+    parser.add_argument("-w", "--warmup", type=float, default=1)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--embedding-latency", type=float, default=10)
+    parser.add_argument("--chroma-latency", type=float, default=5)
+    parser.add_argument("--llm-latency", type=float, default=500)
+    parser.add_argument("--filter-pushdown", action="store_true")
+    parser.add_argument("-o", "--output", help="Path to write the results as JSON")
+    parser.add_argument("--baseline", help="Path to the results of a baseline run")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    parser.add_argument("--min-latency-ms", type=float, default=1)
+    args = parser.parse_args()
+    for endpoint in args.endpoints:
+        if endpoint not in ENDPOINTS:
+            parser.error(f"Unknown endpoint {endpoint!r}, choose from {ENDPOINTS}")
+
+    results = asyncio.run(run(args))
+    print(f"{'endpoint':<10}{'rps':>10}{'p50':>10}{'p95':>10}{'p99':>10}{'errors':>8}")
+    for endpoint, result in results["endpoints"].items():
+        print(
+            f"{endpoint:<10}{result['rps']:>10.1f}"
+            + "".join(
+                f"{result.get(key, np.nan):>8.1f}ms"
+                for key in ["p50Ms", "p95Ms", "p99Ms"]
+            )
+            + f"{result['errors']:>8}"
+        )
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline["config"] != results["config"]:
+            print(f"Baseline configured differently: {baseline['config']}")
+        regressions = compare(
+            results, baseline, args.tolerance, min_latency_ms=args.min_latency_ms
+        )
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print(
+            f"No regressions beyond {args.tolerance:.0%} of the baseline "
+            f"(latencies within {args.min_latency_ms:g}ms ignored)"
+        )
+
+
+if __name__ == "__main__":
+    main()
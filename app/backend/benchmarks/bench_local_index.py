@@ -0,0 +1,145 @@
+"""Query latency of the local vector index against the ChromaDB HTTP path.
+
+Run from the backend directory, either against a running ChromaDB server with the
+trial collection (the collection is snapshotted into a local index first), or on a
+synthetic corpus with the local index only:
+
+    python -m benchmarks.bench_local_index [--host localhost] [-n 50000]
+"""
+
+import argparse
+import tempfile
+import time
+
+import chromadb
+import chromadb.api
+import numpy as np
+
+from conftest import SAMPLE_METADATA
+from index import LocalVectorIndex
+from retrieval import SelectivityTracker, overfetch_query
+from utils import construct_filters, supports_filter_pushdown
+
+STUDY_PHASES = ["NA", "PHASE1", "PHASE1, PHASE2", "PHASE2", "PHASE3", "PHASE4"]
+
+FILTERS = {
+    "none": {},
+    "type+sex": {"studyType": "interventional", "eligibleSex": "female"},
+    "phases": {"studyPhases": ["PHASE2", "PHASE3"]},
+    "phases+dates": {
+        "studyPhases": ["PHASE1"],
+        "lastUpdateDatePosted": (1262304000000, 1577836800000),
+    },
+}
+
+
+def make_index(n_records: int, dim: int, seed: int) -> LocalVectorIndex:
+    """Make a local index over synthetic records derived from SAMPLE_METADATA."""
+    rng = np.random.default_rng(seed)
+    epoch_days = rng.integers(10957, 20089, size=(n_records, 2))  # 2000 ~ 2025
+    dates = np.datetime_as_string(epoch_days.astype("datetime64[D]"))
+    metadatas = []
+    for i in range(n_records):
+        metadata = SAMPLE_METADATA.copy()
+        metadata["study_type"] = ["INTERVENTIONAL", "OBSERVATIONAL"][i % 2]
+        metadata["eligible_sex"] = ["ALL", "FEMALE", "MALE"][i % 3]
+        metadata["study_phases"] = STUDY_PHASES[rng.integers(len(STUDY_PHASES))]
+        metadata["last_update_date_posted"] = str(dates[i, 0])
+        metadata["results_date_posted"] = str(dates[i, 1])
+        metadatas.append(metadata)
+    return LocalVectorIndex.from_records(
+        [f"NCT{i:08d}" for i in range(n_records)],
+        [f"Trial {i}" for i in range(n_records)],
+        rng.normal(size=(n_records, dim)).astype(np.float32),
+        metadatas,
+    )
+
+
+def query_chromadb(collection, query_embedding, top_k, filters, tracker):
+    """Query the collection the same way as the /retrieve endpoint does."""
+    needs_post_filter, where = construct_filters(
+        filters, pushdown=supports_filter_pushdown(collection)
+    )
+    if needs_post_filter:
+        return overfetch_query(
+            collection, query_embedding, top_k, filters, where, tracker
+        )[0]
+    results = collection.query(
+        query_embeddings=[query_embedding],
+        n_results=top_k,
+        include=[chromadb.api.types.IncludeEnum("documents")],
+        where=where,
+    )
+    return {"ids": results["ids"][0], "documents": results["documents"][0]}
+
+
+def measure(func, queries):
+    """Measure the latencies of a function over queries in milliseconds."""
+    latencies = []
+    for query in queries:
+        started_at = time.perf_counter()
+        func(query)
+        latencies.append((time.perf_counter() - started_at) * 1000)
+    return np.array(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", help="ChromaDB host; synthetic corpus if not given")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("-n", "--n-records", type=int, default=50000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("-q", "--n-queries", type=int, default=200)
+    parser.add_argument("-k", "--top-k", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    collection = None
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if args.host is not None:
+            client = chromadb.HttpClient(host=args.host, port=args.port)
+            collection = client.get_collection("veritas-trial-embeddings")
+            started_at = time.perf_counter()
+            index = LocalVectorIndex.from_collection(collection)
+            print(f"Snapshotted in {time.perf_counter() - started_at:.1f}s")
+        else:
+            index = make_index(args.n_records, args.dim, args.seed)
+
+        # Query from the memory-mapped snapshot as the backend does
+        index.save(tmp_dir)
+        index = LocalVectorIndex.load(tmp_dir)
+
+        # Perturbed trial embeddings make realistic queries without the model
+        rng = np.random.default_rng(args.seed)
+        rows = rng.choice(len(index), size=args.n_queries)
+        queries = np.asarray(index.embeddings[rows]) + rng.normal(
+            scale=0.02, size=(args.n_queries, index.embeddings.shape[1])
+        ).astype(np.float32)
+
+        print(
+            f"{len(index)} trials x {index.embeddings.shape[1]} dims, "
+            f"{args.n_queries} queries, top_k={args.top_k}"
+        )
+        print(f"{'filters':<14}{'backend':<10}{'p50':>10}{'p99':>10}{'mean':>10}")
+        for name, filters in FILTERS.items():
+            backends = {
+                "local": lambda q: index.query(q, args.top_k, filters),
+            }
+            if collection is not None:
+                tracker = SelectivityTracker()
+                backends["chromadb"] = lambda q: query_chromadb(
+                    collection, q.tolist(), args.top_k, filters, tracker
+                )
+            for backend, func in backends.items():
+                measure(func, queries[:5])  # Warm up
+                latencies = measure(func, queries)
+                print(
+                    f"{name:<14}{backend:<10}"
+                    f"{np.percentile(latencies, 50):>8.2f}ms"
+                    f"{np.percentile(latencies, 99):>8.2f}ms"
+                    f"{latencies.mean():>8.2f}ms"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Overhead of the stage metrics on the request paths they instrument.
+
+Run from the backend directory. The instrumented functions are timed against the
+same functions with the stage timers replaced by no-ops, on the mock ChromaDB
+collection; it answers in microseconds rather than the milliseconds of a round-trip
+to the ChromaDB server, so the relative overheads are upper bounds:
+
+    python -m benchmarks.bench_metrics [-n 20000]
+"""
+
+import argparse
+import timeit
+from contextlib import nullcontext
+
+import numpy as np
+
+import retrieval
+import utils
+from conftest import MockChromadbCollection
+from metrics import REGISTRY, STAGE_DURATION, time_stage
+from retrieval import SelectivityTracker, overfetch_query
+
+NULL_TIMER = nullcontext()
+STAGES = ["chromadb_query", "post_filter", "metadata_fetch", "clean_metadata"]
+
+
+def no_timer(stage):
+    return NULL_TIMER
+
+
+def per_call_ns(func, number, repeat=5):
+    """Measure the best time per call of a function in nanoseconds."""
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number * 1e9
+
+
+def compare_ns(untimed, timed, number, repeat=20):
+    """Measure the best times per call without and with the stage timers.
+
+    The two variants are measured alternately so that both see the same noise.
+    """
+    best_untimed, best_timed = np.inf, np.inf
+    for _ in range(repeat):
+        retrieval.time_stage = utils.time_stage = no_timer
+        best_untimed = min(best_untimed, per_call_ns(untimed, number, repeat=1))
+        retrieval.time_stage = utils.time_stage = time_stage
+        best_timed = min(best_timed, per_call_ns(timed, number, repeat=1))
+    return best_untimed, best_timed
+
+
+def timed_block():
+    with time_stage("bench"):
+        pass
+
+
+def untimed_block():
+    with no_timer("bench"):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--number", type=int, default=20000)
+    args = parser.parse_args()
+
+    collection = MockChromadbCollection()
+    query_embedding = np.array([0.1, 0.2, 0.3, 0.4, 0.5])
+    filters = {"studyPhases": ["PHASE1"]}
+    workloads = {
+        "overfetch_query": lambda: overfetch_query(
+            collection, query_embedding, 10, filters, None, SelectivityTracker()
+        ),
+        "get_metadata_from_id": lambda: utils.get_metadata_from_id(collection, "id0"),
+    }
+
+    untimed, timed = compare_ns(untimed_block, timed_block, args.number)
+    timer_ns = timed - untimed
+    print(f"{'stage timer':<24}{timer_ns:>10.0f}ns per stage")
+
+    # The estimated overhead is the number of stages timed per call times the cost
+    # of a stage timer, which is more stable than the difference of the timings
+    print(f"{'workload':<24}{'untimed':>12}{'timed':>12}{'stages':>8}{'estimated':>12}")
+    number = max(args.number // 100, 1)
+    for name, func in workloads.items():
+        num_stages = -sum(STAGE_DURATION.get_count(stage) for stage in STAGES)
+        func()
+        num_stages += sum(STAGE_DURATION.get_count(stage) for stage in STAGES)
+        untimed, timed = compare_ns(func, func, number)
+        print(
+            f"{name:<24}{untimed / 1000:>10.1f}us{timed / 1000:>10.1f}us"
+            f"{num_stages:>8}{num_stages * timer_ns / untimed * 100:>11.2f}%"
+        )
+
+    # Scrapes render all stages of the backend with all their buckets
+    for stage in ["a", "b", "c", "d", "e", "f", "g", "h", "i"]:
+        STAGE_DURATION.observe(0.01, stage)
+    render_ns = per_call_ns(REGISTRY.render, max(args.number // 100, 1))
+    print(f"{'render':<24}{render_ns / 1000:>10.1f}us per scrape")
+
+
+if __name__ == "__main__":
+    main()
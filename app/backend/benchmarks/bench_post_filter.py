@@ -0,0 +1,142 @@
+"""Microbenchmark of the compiled post-filter against the previous implementation.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_post_filter
+"""
+
+import argparse
+import timeit
+from datetime import datetime
+from functools import partial
+from typing import Any, Literal
+
+import numpy as np
+
+from conftest import SAMPLE_METADATA
+from utils import compile_post_filter, post_filter
+
+STUDY_PHASES = [
+    "NA",
+    "EARLY_PHASE1",
+    "PHASE1",
+    "PHASE1, PHASE2",
+    "PHASE2",
+    "PHASE2, PHASE3",
+    "PHASE3",
+    "PHASE4",
+]
+
+FILTERS = {
+    "phases": {"studyPhases": ["PHASE2", "PHASE3"]},
+    "date": {"lastUpdateDatePosted": (1262304000000, 1577836800000)},
+    "phases+dates": {
+        "studyPhases": ["PHASE1"],
+        "lastUpdateDatePosted": (1262304000000, 1577836800000),
+        "resultsDatePosted": (1262304000000, 1704067200000),
+    },
+}
+
+
+def reference_post_filter(results, filters):
+    """Post-filtering of query results as implemented before the compiled plans."""
+    filtered_ids, filtered_documents = [], []
+    ids = results["ids"][0]
+    documents = results["documents"][0]
+    metadatas = results["metadatas"][0]
+
+    def _accept_by_study_phases(metadata: Any, study_phases_filter: list[str]) -> bool:
+        study_phases = metadata["study_phases"].split(", ")
+        return any(phase in study_phases_filter for phase in study_phases)
+
+    def _accept_by_date(
+        metadata: Any,
+        key: Literal["last_update_date_posted", "results_date_posted"],
+        date_range_filter: tuple[int, int],
+    ) -> bool:
+        date_from_filter, date_to_filter = date_range_filter
+        date = datetime.strptime(metadata[key], "%Y-%m-%d").timestamp() * 1000
+        return date_from_filter <= date <= date_to_filter
+
+    post_filter_funcs = []
+    if (study_phase_filter := filters.get("studyPhases")) is not None:
+        post_filter_funcs.append(
+            partial(_accept_by_study_phases, study_phases_filter=study_phase_filter)
+        )
+    if (last_update_date_filter := filters.get("lastUpdateDatePosted")) is not None:
+        post_filter_funcs.append(
+            partial(
+                _accept_by_date,
+                key="last_update_date_posted",
+                date_range_filter=last_update_date_filter,
+            )
+        )
+    if (results_date_filter := filters.get("resultsDatePosted")) is not None:
+        post_filter_funcs.append(
+            partial(
+                _accept_by_date,
+                key="results_date_posted",
+                date_range_filter=results_date_filter,
+            )
+        )
+
+    for _id, document, metadata in zip(ids, documents, metadatas):
+        if all(func(metadata) for func in post_filter_funcs):
+            filtered_ids.append(_id)
+            filtered_documents.append(document)
+
+    return {"ids": filtered_ids, "documents": filtered_documents}
+
+
+def make_results(n_candidates, seed=42):
+    """Make synthetic query results with candidates derived from SAMPLE_METADATA."""
+    rng = np.random.default_rng(seed)
+    epoch_days = rng.integers(10957, 20089, size=(n_candidates, 2))  # 2000 ~ 2025
+    dates = np.datetime_as_string(epoch_days.astype("datetime64[D]"))
+    ids, documents, metadatas = [], [], []
+    for i in range(n_candidates):
+        metadata = SAMPLE_METADATA.copy()
+        metadata["study_phases"] = STUDY_PHASES[rng.integers(len(STUDY_PHASES))]
+        metadata["last_update_date_posted"] = str(dates[i, 0])
+        metadata["results_date_posted"] = str(dates[i, 1])
+        ids.append(f"NCT{i:08d}")
+        documents.append(f"Sample Metadata {i}")
+        metadatas.append(metadata)
+    return dict(ids=[ids], documents=[documents], metadatas=[metadatas])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--n-candidates", type=int, default=10000)
+    parser.add_argument("-r", "--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    results = make_results(args.n_candidates)
+    print(f"Post-filtering {args.n_candidates} candidates (best of {args.repeat})")
+    print(f"{'filters':<14}{'reference':>14}{'compiled':>14}{'speedup':>10}")
+    for name, filters in FILTERS.items():
+        # Both implementations must agree before their timings mean anything
+        expected = reference_post_filter(results, filters)
+        assert post_filter(results, filters) == expected, f"Mismatch on {name!r}"
+        compile_post_filter(filters)  # Exclude the one-off compilation
+
+        reference_time = min(
+            timeit.repeat(
+                lambda: reference_post_filter(results, filters),
+                number=1,
+                repeat=args.repeat,
+            )
+        )
+        compiled_time = min(
+            timeit.repeat(
+                lambda: post_filter(results, filters), number=1, repeat=args.repeat
+            )
+        )
+        print(
+            f"{name:<14}{reference_time * 1000:>12.2f}ms{compiled_time * 1000:>12.2f}ms"
+            f"{reference_time / compiled_time:>9.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
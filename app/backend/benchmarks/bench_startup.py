@@ -0,0 +1,128 @@
+"""Cold start time of the backend broken down by phase.
+
+Run from the backend directory. The import of the app is timed in fresh interpreters
+together with its heaviest imports; with --serve the app is also started with uvicorn
+and the times until /heartbeat answers and until /ready flips are measured, with the
+startup report of the background phases (this needs ChromaDB and the model):
+
+    python -m benchmarks.bench_startup [-r 5] [--serve] [--port 8765]
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+import numpy as np
+
+
+def time_import(module: str) -> float:
+    """Time importing a module in a fresh interpreter in seconds."""
+    code = (
+        "import time; started_at = time.perf_counter(); "
+        f"import {module}; print(time.perf_counter() - started_at)"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    return float(output.stdout.strip().splitlines()[-1])
+
+
+def heaviest_imports(module: str, top: int) -> list[tuple[str, float]]:
+    """Get the packages taking the longest to import, in seconds.
+
+    The self time of each imported module is attributed to its top-level package, so
+    that packages imported by other packages are not counted twice.
+    """
+    output = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    packages: dict[str, float] = {}
+    for line in output.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_time, _, name = line.removeprefix("import time:").split("|")
+        if not self_time.strip().isdigit():
+            continue  # Header
+        name = name.strip().split(".")[0]
+        packages[name] = packages.get(name, 0) + int(self_time) / 1e6
+    return sorted(packages.items(), key=lambda item: -item[1])[:top]
+
+
+def get_json(url: str) -> tuple[int, dict] | None:
+    """Get a JSON response, or None if the server is not answering."""
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as exc:
+        return exc.code, json.loads(exc.read())
+    except OSError:
+        return None
+
+
+def time_serve(port: int, timeout: float) -> None:
+    """Start the app with uvicorn and report the times until heartbeat and ready."""
+    started_at = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port)],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        heartbeat_at = None
+        while time.perf_counter() - started_at < timeout:
+            if process.poll() is not None:
+                print(f"Server exited with code {process.returncode}")
+                return
+            if heartbeat_at is None:
+                if get_json(f"http://localhost:{port}/heartbeat") is not None:
+                    heartbeat_at = time.perf_counter()
+            elif (result := get_json(f"http://localhost:{port}/ready")) is not None:
+                status, report = result
+                if status == 200 or report["error"] is not None:
+                    break
+            time.sleep(0.05)
+        else:
+            print(f"Timed out after {timeout:.0f}s")
+            return
+    finally:
+        process.terminate()
+        process.wait()
+
+    print(f"{'heartbeat':<16}{(heartbeat_at - started_at) * 1000:>10.0f}ms")
+    for name, elapsed in report["phasesMs"].items():
+        print(f"  {name:<14}{elapsed:>10.0f}ms")
+    print(f"{'ready':<16}{report['elapsedMs']:>10.0f}ms after app startup")
+    if report["error"] is not None:
+        print(f"Failed to start:\n{report['error']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-r", "--repeat", type=int, default=5)
+    parser.add_argument("-t", "--top", type=int, default=8)
+    parser.add_argument("--serve", action="store_true")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--timeout", type=float, default=300)
+    args = parser.parse_args()
+
+    timings = np.array([time_import("main") for _ in range(args.repeat)]) * 1000
+    print(
+        f"{'import main':<16}{np.median(timings):>10.0f}ms median "
+        f"({timings.min():.0f}ms ~ {timings.max():.0f}ms over {args.repeat} runs)"
+    )
+    for name, elapsed in heaviest_imports("main", args.top):
+        print(f"  {name:<14}{elapsed * 1000:>10.0f}ms")
+
+    if args.serve:
+        time_serve(args.port, args.timeout)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""Token savings of the compact trial context against pretty-printed JSON.
+
+Run from the backend directory, optionally on the cleaned data produced by the data
+pipeline (otherwise on synthetic studies derived from SAMPLE_METADATA):
+
+    python -m benchmarks.bench_trial_context [--data path/to/cleaned_data.jsonl]
+"""
+
+import argparse
+import json
+import timeit
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+
+from conftest import SAMPLE_METADATA
+from context import render_trial_context
+from history import estimate_tokens
+from localtyping import TrialMetadataType
+from utils import _clean_metadata
+
+
+def stringify_metadata(study: dict[str, Any]) -> dict[str, Any]:
+    """Convert a cleaned study into metadata as stored in ChromaDB."""
+    return {
+        k: "" if v is None else json.dumps(v) if isinstance(v, (list, dict)) else v
+        for k, v in study.items()
+    }
+
+
+def load_studies(path: Path, n_studies: int, seed: int) -> list[TrialMetadataType]:
+    """Load a random sample of cleaned studies from a JSONL file."""
+    with path.open("r", encoding="utf-8") as f:
+        lines = f.readlines()
+    rng = np.random.default_rng(seed)
+    indices = rng.choice(len(lines), size=min(n_studies, len(lines)), replace=False)
+    return [
+        _clean_metadata(stringify_metadata(json.loads(lines[i])))
+        for i in sorted(indices)
+    ]
+
+
+def make_studies(n_studies: int, seed: int) -> list[TrialMetadataType]:
+    """Make synthetic studies with varying list lengths and empty fields."""
+    rng = np.random.default_rng(seed)
+    studies = []
+    for _ in range(n_studies):
+        metadata = SAMPLE_METADATA.copy()
+        n_locations = int(rng.geometric(0.1))
+        metadata["locations"] = json.dumps(
+            [f"Hospital {i}, City {i}, , , Country" for i in range(n_locations)]
+        )
+        metadata["officials"] = json.dumps(
+            [f"Official {i}, PRINCIPAL_INVESTIGATOR, " for i in range(rng.integers(4))]
+        )
+        metadata["secondary_measure_outcomes"] = json.dumps(
+            [
+                {
+                    "measure": f"Measure {i}",
+                    "description": "Change from baseline. " * int(rng.integers(1, 8)),
+                    "time_frame": "12 weeks",
+                }
+                for i in range(rng.integers(15))
+            ]
+        )
+        metadata["summary"] = "Summary sentence of the study. " * int(
+            rng.integers(2, 15)
+        )
+        metadata["details"] = "" if rng.random() < 0.4 else "Details. " * 30
+        studies.append(_clean_metadata(metadata))
+    return studies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--data", type=Path, help="Path to cleaned_data.jsonl")
+    parser.add_argument("-n", "--n-studies", type=int, default=500)
+    parser.add_argument("--max-list-items", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    if args.data is not None:
+        studies = load_studies(args.data, args.n_studies, args.seed)
+        source = str(args.data)
+    else:
+        studies = make_studies(args.n_studies, args.seed)
+        source = "synthetic studies"
+
+    json_tokens = np.array(
+        [estimate_tokens(json.dumps(metadata, indent=2)) for metadata in studies]
+    )
+    compact_tokens = np.array(
+        [
+            estimate_tokens(render_trial_context(metadata, args.max_list_items))
+            for metadata in studies
+        ]
+    )
+    savings = 1 - compact_tokens / json_tokens
+
+    print(f"Estimated context tokens of {len(studies)} studies from {source}")
+    print(f"{'format':<10}{'mean':>10}{'p50':>10}{'p95':>10}{'max':>10}")
+    for name, tokens in [("json", json_tokens), ("compact", compact_tokens)]:
+        print(
+            f"{name:<10}{tokens.mean():>10.0f}{np.median(tokens):>10.0f}"
+            f"{np.percentile(tokens, 95):>10.0f}{tokens.max():>10.0f}"
+        )
+    print(
+        f"Savings: {1 - compact_tokens.sum() / json_tokens.sum():.1%} overall, "
+        f"{np.median(savings):.1%} median per study"
+    )
+
+    render_time = min(
+        timeit.repeat(
+            lambda: [render_trial_context(metadata) for metadata in studies],
+            number=1,
+            repeat=3,
+        )
+    )
+    print(f"Rendering: {render_time / len(studies) * 1e6:.1f}us per study (uncached)")
+
+
+if __name__ == "__main__":
+    main()
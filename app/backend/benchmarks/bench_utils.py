@@ -0,0 +1,255 @@
+"""Microbenchmarks of the utilities on the hot paths of the backend APIs.
+
+Run from the backend directory. Each case is run over synthetic data of realistic
+size derived from SAMPLE_METADATA, e.g., metadata with hundreds of locations and
+dozens of outcomes. The throughput is the best of several rounds, and allocations
+are traced for a single call: the peak of the memory allocated during the call, and
+the memory blocks still held by its result. The results are written as JSON with the
+commit they were measured on; with --baseline they are compared against a previous
+run, exiting with status 1 on regressions beyond the tolerance:
+
+    python -m benchmarks.bench_utils [-k clean] [-o run.json] [--baseline base.json]
+"""
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import timeit
+import tracemalloc
+from collections.abc import Callable
+
+import numpy as np
+
+from conftest import SAMPLE_METADATA
+from utils import _clean_metadata, construct_filters, format_exc_details, post_filter
+
+FILTERS = {
+    "none": {},
+    "categorical": {
+        "studyType": "interventional",
+        "acceptsHealthy": False,
+        "eligibleSex": "female",
+        "ageRange": (18, 65),
+    },
+    "all": {
+        "studyType": "interventional",
+        "eligibleSex": "female",
+        "ageRange": (18, 65),
+        "studyPhases": ["PHASE2", "PHASE3"],
+        "lastUpdateDatePosted": (1262304000000, 1577836800000),
+        "resultsDatePosted": (1262304000000, 1704067200000),
+    },
+}
+
+
+def make_metadata(n_locations: int = 300, n_outcomes: int = 40) -> dict:
+    """Make metadata of a large trial derived from SAMPLE_METADATA."""
+    metadata = SAMPLE_METADATA.copy()
+    metadata["summary"] = "Summary of the trial. " * 50
+    metadata["details"] = "Details of the trial. " * 200
+    metadata["inclusion_criteria"] = "Inclusion criterion. " * 100
+    metadata["exclusion_criteria"] = "Exclusion criterion. " * 100
+    metadata["conditions"] = json.dumps([f"Condition {i}" for i in range(10)])
+    metadata["locations"] = json.dumps(
+        [f"Hospital {i}, City {i}, State, Country" for i in range(n_locations)]
+    )
+    metadata["interventions"] = json.dumps(
+        [
+            {"type": "DRUG", "name": f"Drug {i}", "description": f"Dose {i}. " * 10}
+            for i in range(5)
+        ]
+    )
+    for key, n in [
+        ("primary_measure_outcomes", n_outcomes // 4),
+        ("secondary_measure_outcomes", n_outcomes - n_outcomes // 4),
+    ]:
+        metadata[key] = json.dumps(
+            [
+                {
+                    "measure": f"Measure {i}",
+                    "description": f"Description of measure {i}. " * 5,
+                    "time_frame": f"{i + 1} months",
+                }
+                for i in range(n)
+            ]
+        )
+    metadata["references"] = json.dumps(
+        [{"pmid": f"{i}", "citation": f"Citation {i}. " * 5} for i in range(20)]
+    )
+    return metadata
+
+
+def make_results(n_candidates: int, seed: int = 42) -> dict:
+    """Make query results with candidates of various study phases and dates."""
+    rng = np.random.default_rng(seed)
+    study_phases = ["NA", "PHASE1", "PHASE1, PHASE2", "PHASE2", "PHASE3", "PHASE4"]
+    epoch_days = rng.integers(10957, 20089, size=(n_candidates, 2))  # 2000 ~ 2025
+    dates = np.datetime_as_string(epoch_days.astype("datetime64[D]"))
+    metadatas = []
+    for i in range(n_candidates):
+        metadata = SAMPLE_METADATA.copy()
+        metadata["study_phases"] = study_phases[rng.integers(len(study_phases))]
+        metadata["last_update_date_posted"] = str(dates[i, 0])
+        metadata["results_date_posted"] = str(dates[i, 1])
+        metadatas.append(metadata)
+    return dict(
+        ids=[[f"NCT{i:08d}" for i in range(n_candidates)]],
+        documents=[[f"Sample Metadata {i}" for i in range(n_candidates)]],
+        metadatas=[metadatas],
+    )
+
+
+def make_exception(depth: int = 10) -> Exception:
+    """Make an exception raised through a number of frames."""
+
+    def _raise(n):
+        if n == 0:
+            raise ValueError("Dummy error")
+        _raise(n - 1)
+
+    try:
+        _raise(depth)
+    except ValueError as exc:
+        return exc
+    raise AssertionError("Unreachable")
+
+
+def make_cases(n_candidates: int) -> dict[str, Callable[[], object]]:
+    """Make the benchmark cases as named zero-argument callables."""
+    metadata = make_metadata()
+    results = make_results(n_candidates)
+    exc = make_exception()
+    cases: dict[str, Callable[[], object]] = {
+        "clean_metadata": lambda: _clean_metadata(metadata),
+        "clean_metadata[sample]": lambda: _clean_metadata(SAMPLE_METADATA),
+    }
+    for name, filters in FILTERS.items():
+        for pushdown in [False, True]:
+            cases[
+                f"construct_filters[{name},{'pushdown' if pushdown else 'post'}]"
+            ] = lambda filters=filters, pushdown=pushdown: construct_filters(
+                filters, pushdown  # type: ignore
+            )
+    for name, filters in FILTERS.items():
+        cases[f"post_filter[{name}]"] = lambda filters=filters: post_filter(
+            results, filters  # type: ignore
+        )
+    cases["format_exc_details"] = lambda: format_exc_details(exc)
+    return cases
+
+
+def measure(func: Callable[[], object], repeat: int, min_time: float) -> dict:
+    """Measure the throughput and allocations of a zero-argument callable."""
+    func()  # Warm up caches, e.g., the compiled post-filter plans
+
+    # Run enough calls per round to take at least the minimum time
+    timer = timeit.Timer(func)
+    number = 1
+    while (elapsed := timer.timeit(number)) < min_time:
+        number = max(number * 2, int(number * min_time / max(elapsed, 1e-9)))
+    per_call = min(elapsed, *timer.repeat(repeat=repeat - 1, number=number)) / number
+
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        blocks_before = sys.getallocatedblocks()
+        result = func()
+        blocks_after = sys.getallocatedblocks()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+
+    return {
+        "opsPerSec": 1 / per_call,
+        "usPerOp": per_call * 1e6,
+        "peakBytes": peak - before,
+        "retainedBlocks": blocks_after - blocks_before,
+    }
+
+
+def get_commit() -> str | None:
+    """Get the commit of the working tree, or None if not in a git repository."""
+    try:
+        output = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.stdout.strip()
+
+
+def compare(run: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Compare a run against a baseline, returning the regressions found."""
+    regressions = []
+    for name, result in run["cases"].items():
+        if name not in baseline["cases"]:
+            continue
+        base = baseline["cases"][name]
+        if result["opsPerSec"] < base["opsPerSec"] * (1 - tolerance):
+            regressions.append(
+                f"{name}: {result['opsPerSec']:.0f} ops/s "
+                f"< baseline {base['opsPerSec']:.0f}"
+            )
+        if result["peakBytes"] > base["peakBytes"] * (1 + tolerance):
+            regressions.append(
+                f"{name}: {result['peakBytes']} peak bytes "
+                f"> baseline {base['peakBytes']}"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-k", "--keyword", help="Only run cases containing this")
+    parser.add_argument("-n", "--n-candidates", type=int, default=100)
+    parser.add_argument("-r", "--repeat", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.1)
+    parser.add_argument("-o", "--output", help="Path to write the results as JSON")
+    parser.add_argument("--baseline", help="Path to the results of a baseline run")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    args = parser.parse_args()
+
+    results: dict = {
+        "commit": get_commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "nCandidates": args.n_candidates,
+        "cases": {},
+    }
+    print(f"{'case':<40}{'ops/s':>12}{'per op':>12}{'peak':>12}{'retained':>10}")
+    for name, func in make_cases(args.n_candidates).items():
+        if args.keyword is not None and args.keyword not in name:
+            continue
+        result = results["cases"][name] = measure(func, args.repeat, args.min_time)
+        print(
+            f"{name:<40}{result['opsPerSec']:>12.0f}{result['usPerOp']:>10.2f}us"
+            f"{result['peakBytes'] / 1024:>10.1f}KB{result['retainedBlocks']:>10}"
+        )
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print(
+            f"No regressions beyond {args.tolerance:.0%} of the baseline "
+            f"(commit {baseline['commit']})"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,508 @@
+"""In-process caches for the backend APIs."""
+
+import hashlib
+import os
+import re
+import time
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+from pathlib import Path
+from typing import Generic, TypeVar
+
+import numpy as np
+
+from localtyping import (
+    AnswerCacheStatsType,
+    LRUCacheStatsType,
+    QueryEmbeddingCacheStatsType,
+)
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+# Words that flip the meaning of otherwise near-identical questions, which embedding
+# models place close to each other; questions differing by any of these words never
+# share answers in AnswerCache
+CONTRASTING_WORDS = frozenset(
+    "inclusion exclusion include exclude included excluded eligible ineligible "
+    "primary secondary minimum maximum min max before after increase decrease "
+    "positive negative not no non without never male female".split()
+)
+
+
+def normalize_query(query: str) -> str:
+    """Normalize query text for use as a cache key."""
+    # NOTE: The BGE tokenizer is uncased and splits on whitespace, so neither the
+    # case nor the amount of whitespace affects the embedding
+    return " ".join(query.split()).lower()
+
+
+def hash_embedding(embedding: np.ndarray) -> str:
+    """Hash an embedding vector for use as a cache key."""
+    # Hash the float16 representation so that an embedding freshly encoded by the
+    # model and the same embedding read back from QueryEmbeddingCache agree
+    data = np.ascontiguousarray(embedding, dtype=np.float16).tobytes()
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+class LRUCache(Generic[K, V]):
+    """Bounded LRU cache with optional TTL, weight budget and version tag.
+
+    The cache holds at most `max_entries` entries. If `max_weight` is given, the
+    total weight of the entries as computed by `weigh` is kept within that budget
+    as well. Each entry expires `ttl` seconds after insertion if `ttl` is given.
+    The cache can be tagged with a version via `set_version`; a version change
+    invalidates all entries, which is how caches follow the collection version.
+    """
+
+    def __init__(
+        self,
+        max_entries: int,
+        ttl: float | None = None,
+        max_weight: int | None = None,
+        weigh: Callable[[V], int] | None = None,
+        on_evict: Callable[[K, V], None] | None = None,
+    ):
+        if max_entries <= 0:
+            raise ValueError("Required max_entries > 0")
+        if max_weight is not None and weigh is None:
+            raise ValueError("Required weigh when max_weight is given")
+
+        self.max_entries = max_entries
+        self.ttl = ttl if ttl is not None and ttl > 0 else None
+        self.max_weight = max_weight
+        self.weigh = weigh
+        self.on_evict = on_evict
+        self.version: str | None = None
+
+        # Mapping from key to (value, weight, expiration time)
+        self._entries: OrderedDict[K, tuple[V, int, float]] = OrderedDict()
+        self.weight = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: K) -> bool:
+        entry = self._entries.get(key)
+        return entry is not None and entry[2] >= time.time()
+
+    def get(self, key: K) -> V | None:
+        """Get the cached value of a key, or None if not cached."""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        value, _, expires_at = entry
+        if expires_at < time.time():
+            self._evict(key)
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: K, value: V) -> None:
+        """Cache the value of a key, evicting least recently used entries."""
+        if key in self._entries:
+            self._remove(key)
+
+        weight = self.weigh(value) if self.weigh is not None else 0
+        if self.max_weight is not None and weight > self.max_weight:
+            return  # Never fits, so do not evict everything else for nothing
+
+        expires_at = time.time() + self.ttl if self.ttl is not None else np.inf
+        self._entries[key] = (value, weight, expires_at)
+        self.weight += weight
+
+        while len(self._entries) > self.max_entries or (
+            self.max_weight is not None and self.weight > self.max_weight
+        ):
+            self._evict(next(iter(self._entries)))
+
+    def pop(self, key: K) -> V | None:
+        """Remove an entry and return its value, or None if not cached."""
+        if key not in self._entries:
+            return None
+        return self._remove(key)
+
+    def set_version(self, version: str | None) -> None:
+        """Set the version tag, invalidating the cache if it changes."""
+        if version != self.version:
+            self.clear()
+            self.version = version
+
+    def clear(self) -> None:
+        """Remove all entries from the cache."""
+        while len(self._entries) > 0:
+            self._evict(next(iter(self._entries)))
+
+    def expire(self) -> None:
+        """Evict all expired entries."""
+        now = time.time()
+        for key in [k for k, (_, _, exp) in self._entries.items() if exp < now]:
+            self._evict(key)
+
+    def stats(self) -> LRUCacheStatsType:
+        """Get the statistics of the cache."""
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "maxEntries": self.max_entries,
+            "weight": self.weight,
+            "maxWeight": self.max_weight,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hitRatio": self.hits / total if total > 0 else 0,
+        }
+
+    def _evict(self, key: K) -> None:
+        """Evict an entry from the cache."""
+        value = self._remove(key)
+        self.evictions += 1
+        if self.on_evict is not None:
+            self.on_evict(key, value)
+
+    def _remove(self, key: K) -> V:
+        """Remove an entry from the cache and return its value."""
+        value, weight, _ = self._entries.pop(key)
+        self.weight -= weight
+        return value
+
+
+class QueryEmbeddingCache:
+    """Bounded LRU/TTL cache of normalized query text to embedding vector.
+
+    Embeddings are stored as rows of a single preallocated float16 buffer so that
+    each entry costs only two bytes per dimension plus its key. The cache is tagged
+    with the name of the embedding model, and changing the model invalidates all
+    entries. If `path` is given, the cache can be saved to and loaded from disk so
+    that a restarted backend starts warm.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        max_entries: int = 4096,
+        ttl: float | None = None,
+        path: str | Path | None = None,
+    ):
+        if max_entries <= 0:
+            raise ValueError("Required max_entries > 0")
+
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.ttl = ttl if ttl is not None and ttl > 0 else None
+        self.path = Path(path) if path is not None else None
+
+        # Mapping from normalized query to (slot in the buffer, expiration time); the
+        # buffer is allocated on the first insertion when the dimension is known
+        self._entries: OrderedDict[str, tuple[int, float]] = OrderedDict()
+        self._buffer: np.ndarray | None = None
+        self._free_slots: list[int] = []
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, query: str) -> np.ndarray | None:
+        """Get the cached embedding of a query, or None if not cached."""
+        key = normalize_query(query)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        slot, expires_at = entry
+        if expires_at < time.time():
+            self._remove(key)
+            self.misses += 1
+            return None
+
+        assert self._buffer is not None, "Missing buffer for cached entries"
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return self._buffer[slot].astype(np.float32)
+
+    def put(self, query: str, embedding: np.ndarray) -> None:
+        """Cache the embedding of a query."""
+        key = normalize_query(query)
+        embedding = np.asarray(embedding)
+        if self._buffer is None or self._buffer.shape[1] != embedding.shape[0]:
+            # Either the first insertion or the dimension has changed, which can only
+            # happen with a different model, so it is safe to drop everything
+            self._allocate(embedding.shape[0])
+        assert self._buffer is not None, "Failed to allocate buffer"
+
+        if key in self._entries:
+            slot, _ = self._entries.pop(key)
+        else:
+            if len(self._free_slots) == 0:
+                _, (slot, _) = self._entries.popitem(last=False)
+                self._free_slots.append(slot)
+            slot = self._free_slots.pop()
+
+        self._buffer[slot] = embedding
+        expires_at = time.time() + self.ttl if self.ttl is not None else np.inf
+        self._entries[key] = (slot, expires_at)
+
+    def set_model(self, model_name: str) -> None:
+        """Set the embedding model name, invalidating the cache if it changes."""
+        if model_name != self.model_name:
+            self.clear()
+            self.model_name = model_name
+
+    def clear(self) -> None:
+        """Remove all entries from the cache."""
+        self._entries.clear()
+        self._free_slots = (
+            list(range(self.max_entries)) if self._buffer is not None else []
+        )
+
+    def stats(self) -> QueryEmbeddingCacheStatsType:
+        """Get the statistics of the cache."""
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "maxEntries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hitRatio": self.hits / total if total > 0 else 0,
+        }
+
+    def save(self) -> None:
+        """Save the unexpired entries to disk if a path is configured."""
+        if self.path is None or self._buffer is None:
+            return
+
+        now = time.time()
+        items = [(k, v) for k, v in self._entries.items() if v[1] >= now]
+        keys = np.array([k for k, _ in items], dtype=np.str_)
+        slots = np.array([slot for _, (slot, _) in items], dtype=np.int64)
+        expires_at = np.array([exp for _, (_, exp) in items], dtype=np.float64)
+
+        # Write to a temporary file first so that a crash midway does not leave a
+        # corrupted cache behind
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(f"{self.path.name}.tmp")
+        with tmp_path.open("wb") as f:
+            np.savez(
+                f,
+                model_name=np.array(self.model_name),
+                keys=keys,
+                vectors=self._buffer[slots],
+                expires_at=expires_at,
+            )
+        os.replace(tmp_path, self.path)
+
+    def load(self) -> None:
+        """Load entries from disk if a path is configured and the model matches."""
+        if self.path is None or not self.path.exists():
+            return
+
+        with np.load(self.path, allow_pickle=False) as data:
+            if str(data["model_name"]) != self.model_name:
+                return
+            keys, vectors = data["keys"], data["vectors"]
+            expires_at = data["expires_at"]
+
+        self._allocate(vectors.shape[1])
+        assert self._buffer is not None, "Failed to allocate buffer"
+        now = time.time()
+
+        # Keep the most recently used entries if the saved cache is larger than the
+        # current capacity; entries are saved in LRU order
+        start = max(len(keys) - self.max_entries, 0)
+        for key, vector, exp in zip(keys[start:], vectors[start:], expires_at[start:]):
+            if exp < now:
+                continue
+            slot = self._free_slots.pop()
+            self._buffer[slot] = vector
+            self._entries[str(key)] = (slot, float(exp))
+
+    def _allocate(self, dim: int) -> None:
+        """Allocate an empty buffer for the given embedding dimension."""
+        self._buffer = np.zeros((self.max_entries, dim), dtype=np.float16)
+        self._entries.clear()
+        self._free_slots = list(range(self.max_entries - 1, -1, -1))
+
+    def _remove(self, key: str) -> None:
+        """Remove an entry from the cache."""
+        slot, _ = self._entries.pop(key)
+        self._free_slots.append(slot)
+
+
+class AnswerCache:
+    """Bounded LRU/TTL cache of chat answers to first-turn questions about trials.
+
+    Answers are scoped by (model, item ID). A question is looked up by its normalized
+    text, and only if `threshold` is given, then by the cosine similarity of its
+    embedding to those of the cached questions in the same scope, which must be at
+    least `threshold`; questions that differ by any of `CONTRASTING_WORDS` never
+    match semantically, however similar their embeddings. The cache holds
+    at most `max_entries` answers in total, and each answer expires `ttl` seconds
+    after insertion if `ttl` is given. Like LRUCache, the cache can be tagged with a
+    version, so that answers derived from stale trial metadata are dropped.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl: float | None = None,
+        threshold: float | None = None,
+    ):
+        if max_entries <= 0:
+            raise ValueError("Required max_entries > 0")
+
+        self.max_entries = max_entries
+        self.ttl = ttl if ttl is not None and ttl > 0 else None
+        self.threshold = threshold
+        self.version: str | None = None
+
+        # Mapping from (model, item ID, normalized question) to (answer, normalized
+        # question embedding or None, expiration time), and from (model, item ID) to
+        # the normalized questions in that scope for semantic lookups
+        self._entries: OrderedDict[
+            tuple[str, str, str], tuple[str, np.ndarray | None, float]
+        ] = OrderedDict()
+        self._scopes: dict[tuple[str, str], set[str]] = {}
+
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(
+        self,
+        model: str,
+        item_id: str,
+        query: str,
+        embedding: np.ndarray | None = None,
+    ) -> str | None:
+        """Get the cached answer to a question, or None if not cached.
+
+        Semantic matches are only looked up if the similarity threshold and the
+        question embedding are given.
+        """
+        now = time.time()
+        key = (model, item_id, normalize_query(query))
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[2] >= now:
+                self._entries.move_to_end(key)
+                self.exact_hits += 1
+                return entry[0]
+            self._remove(key)
+            self.evictions += 1
+
+        if self.threshold is not None and embedding is not None:
+            match = self._find_similar(model, item_id, key[2], embedding, now)
+            if match is not None:
+                self._entries.move_to_end(match)
+                self.semantic_hits += 1
+                return self._entries[match][0]
+
+        self.misses += 1
+        return None
+
+    def put(
+        self,
+        model: str,
+        item_id: str,
+        query: str,
+        answer: str,
+        embedding: np.ndarray | None = None,
+    ) -> None:
+        """Cache the answer to a question, evicting least recently used answers."""
+        key = (model, item_id, normalize_query(query))
+        if key in self._entries:
+            self._remove(key)
+
+        if embedding is not None:
+            embedding = np.asarray(embedding, dtype=np.float32)
+            embedding = embedding / np.linalg.norm(embedding)
+        expires_at = time.time() + self.ttl if self.ttl is not None else np.inf
+        self._entries[key] = (answer, embedding, expires_at)
+        self._scopes.setdefault((model, item_id), set()).add(key[2])
+
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def set_version(self, version: str | None) -> None:
+        """Set the version tag, invalidating the cache if it changes."""
+        if version != self.version:
+            self.clear()
+            self.version = version
+
+    def clear(self) -> None:
+        """Remove all answers from the cache."""
+        self.evictions += len(self._entries)
+        self._entries.clear()
+        self._scopes.clear()
+
+    def stats(self) -> AnswerCacheStatsType:
+        """Get the statistics of the cache."""
+        hits = self.exact_hits + self.semantic_hits
+        total = hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "maxEntries": self.max_entries,
+            "exactHits": self.exact_hits,
+            "semanticHits": self.semantic_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hitRatio": hits / total if total > 0 else 0,
+        }
+
+    def _find_similar(
+        self,
+        model: str,
+        item_id: str,
+        query: str,
+        embedding: np.ndarray,
+        now: float,
+    ) -> tuple[str, str, str] | None:
+        """Find the most similar unexpired question in a scope above the threshold.
+
+        Questions that differ from the normalized query by contrasting words are
+        skipped.
+        """
+        assert self.threshold is not None, "Semantic lookups are disabled"
+        words = set(re.findall(r"\w+", query))
+        keys, vectors = [], []
+        for question in self._scopes.get((model, item_id), ()):
+            key = (model, item_id, question)
+            _, vector, expires_at = self._entries[key]
+            contrast = words.symmetric_difference(re.findall(r"\w+", question))
+            if len(contrast & CONTRASTING_WORDS) > 0:
+                continue
+            if vector is not None and expires_at >= now:
+                keys.append(key)
+                vectors.append(vector)
+        if len(keys) == 0:
+            return None
+
+        query_vector = np.asarray(embedding, dtype=np.float32)
+        similarities = np.stack(vectors) @ (query_vector / np.linalg.norm(query_vector))
+        best = int(np.argmax(similarities))
+        return keys[best] if similarities[best] >= self.threshold else None
+
+    def _remove(self, key: tuple[str, str, str]) -> None:
+        """Remove an answer from the cache."""
+        del self._entries[key]
+        scope = self._scopes[key[:2]]
+        scope.discard(key[2])
+        if len(scope) == 0:
+            del self._scopes[key[:2]]
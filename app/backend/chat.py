@@ -0,0 +1,193 @@
+"""Chat utilities for the backend APIs."""
+
+import asyncio
+import json
+import logging
+import time
+from collections.abc import AsyncIterator, Awaitable, Callable
+from typing import TYPE_CHECKING, Any
+
+from localtyping import ChatTimingStatsType
+from metrics import record_stage
+from utils import format_exc_details
+
+if TYPE_CHECKING:
+    from vertexai.generative_models import ChatSession  # type: ignore
+
+logger = logging.getLogger("uvicorn.error")
+
+
+def format_sse(data: Any, event: str | None = None) -> str:
+    """Format data as a Server-Sent Event."""
+    # NOTE: JSON-encoded data never contains raw newlines, so a single data line is
+    # always enough
+    prefix = f"event: {event}\n" if event is not None else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+
+class ChatTimingStats:
+    """Statistics of time-to-first-token and total generation time of chats."""
+
+    def __init__(self):
+        self._num_timeouts = 0
+        self._num_responses = 0
+        self._total_generation = 0.0
+        self._max_generation = 0.0
+        self._num_streamed = 0
+        self._total_first_token = 0.0
+        self._max_first_token = 0.0
+
+    def record(self, generation_time: float, first_token_time: float | None = None):
+        """Record the timings of a chat response in seconds.
+
+        The time to first token is only meaningful for streamed responses.
+        """
+        self._num_responses += 1
+        self._total_generation += generation_time
+        self._max_generation = max(self._max_generation, generation_time)
+        if first_token_time is not None:
+            self._num_streamed += 1
+            self._total_first_token += first_token_time
+            self._max_first_token = max(self._max_first_token, first_token_time)
+
+    def record_timeout(self) -> None:
+        """Record a chat response that timed out."""
+        self._num_timeouts += 1
+
+    def stats(self) -> ChatTimingStatsType:
+        """Get the timing statistics of chat responses."""
+        num_responses, num_streamed = self._num_responses, self._num_streamed
+        return {
+            "numResponses": num_responses,
+            "numStreamed": num_streamed,
+            "numTimeouts": self._num_timeouts,
+            "meanGenerationMs": (
+                self._total_generation / num_responses * 1000
+                if num_responses > 0
+                else 0
+            ),
+            "maxGenerationMs": self._max_generation * 1000,
+            "meanFirstTokenMs": (
+                self._total_first_token / num_streamed * 1000 if num_streamed > 0 else 0
+            ),
+            "maxFirstTokenMs": self._max_first_token * 1000,
+        }
+
+
+async def generate_chat_response(
+    chat_session: "ChatSession",
+    query: str,
+    timing_stats: ChatTimingStats,
+    semaphore: asyncio.Semaphore,
+    timeout: float | None = None,
+) -> str:
+    """Generate the response of a chat session without blocking the event loop.
+
+    The generation waits for a slot of `semaphore`, which bounds the number of
+    concurrent generations, and raises TimeoutError if the response, including the
+    wait for a slot, is not ready within `timeout` seconds.
+    """
+    try:
+        async with asyncio.timeout(timeout):
+            async with semaphore:
+                started_at = time.perf_counter()
+                response = await chat_session.send_message_async(query)
+    except TimeoutError:
+        timing_stats.record_timeout()
+        raise
+
+    generation_time = time.perf_counter() - started_at
+    timing_stats.record(generation_time)
+    record_stage("chat_generation", generation_time)
+    return response.text.strip()
+
+
+async def stream_chat_response(
+    chat_session: "ChatSession",
+    query: str,
+    timing_stats: ChatTimingStats,
+    semaphore: asyncio.Semaphore,
+    timeout: float | None = None,
+    session_id: str | None = None,
+    on_done: Callable[[str], Awaitable[None]] | None = None,
+) -> AsyncIterator[str]:
+    """Stream the response of a chat session as Server-Sent Events.
+
+    Each chunk of the model response is relayed as a data event with its text. Once
+    the model finishes, the chat session has added the query and the response to
+    its history; the full response is sent in a "done" event together with
+    `session_id` if given, and `on_done` is awaited with it if given. Errors midway,
+    including exceeding `timeout` seconds in total, are sent in an "error" event
+    since the response status cannot be changed after streaming has started.
+    Concurrent generations are bounded by `semaphore` as in `generate_chat_response`.
+    """
+    # NOTE: The deadline is only enforced while waiting on the model and never across
+    # a yield, since a timeout firing while the consumer is sending a chunk would
+    # cancel the consumer rather than the generation
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout if timeout is not None else None
+    first_token_time: float | None = None
+    texts: list[str] = []
+
+    try:
+        async with asyncio.timeout_at(deadline):
+            await semaphore.acquire()
+        try:
+            started_at = time.perf_counter()
+            async with asyncio.timeout_at(deadline):
+                stream = await chat_session.send_message_async(query, stream=True)
+            while True:
+                async with asyncio.timeout_at(deadline):
+                    chunk = await anext(stream, None)
+                if chunk is None:
+                    break
+                if first_token_time is None:
+                    first_token_time = time.perf_counter() - started_at
+                text = chunk.text
+                texts.append(text)
+                yield format_sse({"text": text})
+        finally:
+            semaphore.release()
+    except TimeoutError:
+        timing_stats.record_timeout()
+        logger.warning(f"Chat response timed out after {timeout}s")
+        details = f"TimeoutError: Chat response timed out after {timeout}s"
+        yield format_sse({"details": details}, event="error")
+        return
+    except Exception as exc:
+        logger.exception("Failed to stream chat response")
+        yield format_sse({"details": format_exc_details(exc)}, event="error")
+        return
+
+    generation_time = time.perf_counter() - started_at
+    timing_stats.record(generation_time, first_token_time or generation_time)
+    record_stage("chat_generation", generation_time)
+    logger.info(
+        f"Streamed chat response: first token in {first_token_time or 0:.3f}s, "
+        f"total {generation_time:.3f}s"
+    )
+
+    response_text = "".join(texts).strip()
+    if on_done is not None:
+        await on_done(response_text)
+    yield _format_done_sse(response_text, session_id)
+
+
+async def stream_cached_response(
+    response_text: str, session_id: str | None = None
+) -> AsyncIterator[str]:
+    """Stream a cached response as Server-Sent Events.
+
+    The events are the same as those of `stream_chat_response`, with the whole
+    response in a single data event.
+    """
+    yield format_sse({"text": response_text})
+    yield _format_done_sse(response_text, session_id)
+
+
+def _format_done_sse(response_text: str, session_id: str | None) -> str:
+    """Format the "done" event of a streamed chat response."""
+    done_data = {"response": response_text}
+    if session_id is not None:
+        done_data["sessionId"] = session_id
+    return format_sse(done_data, event="done")
@@ -1,9 +1,18 @@
 """Pytest global configurations."""
 
+import asyncio
 import json
+import time
 
 import numpy as np
 import pytest
+from vertexai.generative_models import Content, Part  # type: ignore
+
+from cache import AnswerCache, LRUCache, QueryEmbeddingCache
+from chat import ChatTimingStats
+from history import ChatPromptStats
+from retrieval import SelectivityTracker
+from sessions import InMemoryChatSessionStore
 
 SAMPLE_METADATA = dict(
     short_title="Sample Metadata",
@@ -70,27 +79,114 @@ SAMPLE_METADATA = dict(
 
 
 class MockEmbeddingModel:
-    """Mock embedding model."""
+    """Mock embedding model.
+
+    Each call to `encode` sleeps for `delay` seconds regardless of the number of
+    sentences, mimicking the fixed per-call overhead of a forward pass.
+    """
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+
+    def encode(self, sentences):
+        if self.delay > 0:
+            time.sleep(self.delay)
+        embedding = np.array([0.1, 0.2, 0.3, 0.4, 0.5])
+        if isinstance(sentences, str):
+            return embedding
+        return np.tile(embedding, (len(sentences), 1))
+
+
+class MockGenerationResponse:
+    """Mock response or response chunk of a generative model."""
+
+    def __init__(self, text):
+        self.text = text
+
+
+class MockGenerativeModel:
+    """Mock generative model."""
+
+    def __init__(self, model_name, generation_config=None, system_instruction=None):
+        self.model_name = model_name
+        self.generation_config = generation_config
+        self.system_instruction = system_instruction
+
+
+class MockChatSession:
+    """Mock chat session.
+
+    The response consists of `CHUNKS`, each generated after sleeping for `DELAY`
+    seconds; a chunk that is an exception instance is raised instead. As with the
+    real chat session, the query and the response are added to the history only
+    once the response is complete.
+    """
+
+    CHUNKS = ["Dummy ", "response ", "text."]
+    DELAY = 0.0
+
+    def __init__(self, model, history=None):
+        self.model = model
+        self.history = history if history is not None else []
+
+    async def send_message_async(self, content, stream=False):
+        if stream:
+            return self._stream(content)
+        texts = [text async for text in self._stream_texts()]
+        self._add_to_history(content, texts)
+        return MockGenerationResponse("".join(texts))
 
-    def encode(self, query):
-        return np.array([0.1, 0.2, 0.3, 0.4, 0.5])
+    async def _stream(self, content):
+        texts = []
+        async for text in self._stream_texts():
+            texts.append(text)
+            yield MockGenerationResponse(text)
+        self._add_to_history(content, texts)
+
+    def _add_to_history(self, content, texts):
+        self.history.append(Content(role="user", parts=[Part.from_text(content)]))
+        self.history.append(
+            Content(role="model", parts=[Part.from_text("".join(texts))])
+        )
+
+    async def _stream_texts(self):
+        for chunk in self.CHUNKS:
+            if self.DELAY > 0:
+                await asyncio.sleep(self.DELAY)
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
 
 
 class MockChromadbCollection:
-    """Mock ChromaDB collection."""
+    """Mock ChromaDB collection.
+
+    The embedding of "id{i}" is that of any query encoded by MockEmbeddingModel plus
+    i times an orthogonal vector, so the records are ordered by similarity to any
+    query by their indices.
+    """
 
     RECORDS = set(f"id{i}" for i in range(50))
 
+    def __init__(self, version="v1", filter_pushdown=False):
+        self.metadata = {"version": version, "filter_pushdown": filter_pushdown}
+
     def _result(self, ids, include):
+        ids = [key for key in ids if key in self.RECORDS]
         result = dict(
             ids=ids,
             documents=[] if "documents" in include else None,
+            embeddings=[] if "embeddings" in include else None,
             metadatas=[] if "metadatas" in include else None,
             include=include,
         )
         for key in ids:
             if "documents" in include:
                 result["documents"].append(f"doc-{key}")
+            if "embeddings" in include:
+                i = int(key.removeprefix("id"))
+                embedding = np.array([0.1 + i, 0.2, 0.3, 0.4, 0.5 - 0.2 * i])
+                result["embeddings"].append(embedding)
             if "metadatas" in include:
                 metadata = SAMPLE_METADATA.copy()
                 metadata["short_title"] = f"Sample Metadata {key}"
@@ -98,20 +194,77 @@ class MockChromadbCollection:
         return result
 
     def query(self, *, query_embeddings, n_results, include, where=None):
-        result = self._result(list(self.RECORDS)[:n_results], include)
+        ids = sorted(self.RECORDS, key=lambda key: int(key.removeprefix("id")))
+        ids = ids[:n_results]
+        result = self._result(ids, include)
         for k in result:
             result[k] = [result[k] for _ in range(len(query_embeddings))]
+        if "distances" in include:
+            # Squared L2 distances as in the default space of ChromaDB
+            embeddings = self._result(ids, ["embeddings"])["embeddings"]
+            result["distances"] = [
+                [float(np.sum((embedding - query) ** 2)) for embedding in embeddings]
+                for query in np.asarray(query_embeddings)
+            ]
         return result
 
-    def get(self, *, ids, include, where=None):
+    def get(self, *, ids=None, include, where=None, limit=None, offset=None):
+        if ids is None:
+            ids = sorted(self.RECORDS, key=lambda key: int(key.removeprefix("id")))
+            ids = ids[offset or 0 :][:limit]
         return self._result(ids, include)
 
+    def count(self):
+        return len(self.RECORDS)
+
+
+class MockChromadbSectionsCollection:
+    """Mock ChromaDB collection of trial sections.
+
+    The "criteria" section has the same embedding as any query encoded by
+    MockEmbeddingModel, followed by "outcomes" in similarity.
+    """
+
+    EMBEDDINGS = {
+        "details": [1.0, 0.0, 0.0, 0.0, 0.0],
+        "criteria": [0.1, 0.2, 0.3, 0.4, 0.5],
+        "interventions": [0.0, 1.0, 0.0, 0.0, 0.0],
+        "outcomes": [0.5, 0.4, 0.3, 0.2, 0.1],
+        "locations": [0.0, 0.0, 1.0, 0.0, 0.0],
+    }
+
+    def __init__(self, version="v1"):
+        self.metadata = {"version": version}
+
+    def get(self, *, where, include):
+        item_id = where["trial_id"]
+        return dict(
+            ids=[f"{item_id}:{name}" for name in self.EMBEDDINGS],
+            embeddings=list(self.EMBEDDINGS.values()),
+        )
+
 
 class MockChromadbClient:
-    """Mock ChromaDB client."""
+    """Mock ChromaDB client.
+
+    The collection of trial sections only exists if `sections` is True, with the
+    version `sections_version` if given or the same version as the main collection.
+    """
+
+    def __init__(
+        self, version="v1", filter_pushdown=False, sections=False, sections_version=None
+    ):
+        self.version = version
+        self.filter_pushdown = filter_pushdown
+        self.sections = sections
+        self.sections_version = sections_version
 
     def get_collection(self, name):
-        return MockChromadbCollection()
+        if name == "veritas-trial-sections":
+            if not self.sections:
+                raise ValueError(f"Collection {name} does not exist.")
+            return MockChromadbSectionsCollection(self.sections_version or self.version)
+        return MockChromadbCollection(self.version, self.filter_pushdown)
 
 
 @pytest.fixture
@@ -130,6 +283,25 @@ def chromadb_client():
 def setup(monkeypatch):
     def _setup(init_embedding_model=True, init_chromadb_client=True):
         monkeypatch.setattr("vertexai.init", lambda: None)
+        monkeypatch.setattr(
+            "vertexai.generative_models.GenerativeModel", MockGenerativeModel
+        )
+        monkeypatch.setattr("vertexai.generative_models.ChatSession", MockChatSession)
+        monkeypatch.setattr("main.CHAT_SESSIONS", InMemoryChatSessionStore())
+        monkeypatch.setattr("main.CHAT_TIMING_STATS", ChatTimingStats())
+        monkeypatch.setattr("main.CHAT_PROMPT_STATS", ChatPromptStats())
+        monkeypatch.setattr("main.CHAT_SEMAPHORE", asyncio.Semaphore(32))
+        monkeypatch.setattr("main.EMBEDDING_CACHE", QueryEmbeddingCache("mock"))
+        monkeypatch.setattr("main.RESULT_CACHE", LRUCache(128))
+        monkeypatch.setattr("main.METADATA_CACHE", LRUCache(128))
+        monkeypatch.setattr("main.META_RESPONSE_CACHE", LRUCache(128))
+        monkeypatch.setattr("main.TRIAL_SECTIONS_CACHE", LRUCache(128))
+        monkeypatch.setattr("main.SECTION_VECTORS_CACHE", LRUCache(128))
+        monkeypatch.setattr("main.ANSWER_CACHE", AnswerCache(128))
+        monkeypatch.setattr("main.SELECTIVITY_TRACKER", SelectivityTracker())
+        monkeypatch.setattr("main.LOCAL_INDEX", None)
+        monkeypatch.setattr("main.COLLECTION_HANDLES", {})
+        monkeypatch.setattr("main.LOCAL_INDEX_LOCK", asyncio.Lock())
         if init_embedding_model:
             monkeypatch.setattr("main.EMBEDDING_MODEL", MockEmbeddingModel())
         if init_chromadb_client:
@@ -0,0 +1,195 @@
+"""Compact rendering of trial metadata for chat system instructions."""
+
+from typing import Any
+
+from localtyping import (
+    TrialMetadataInterventionType,
+    TrialMetadataMeasureOutcomeType,
+    TrialMetadataType,
+)
+
+# Fields rendered as a single "Label: value" line, in order
+SCALAR_FIELDS = [
+    ("shortTitle", "Title"),
+    ("longTitle", "Official title"),
+    ("organization", "Organization"),
+    ("sponsor", "Sponsor"),
+    ("studyType", "Study type"),
+    ("studyPhases", "Phases"),
+    ("enrollmentCount", "Enrollment"),
+    ("allocation", "Allocation"),
+    ("interventionModel", "Intervention model"),
+    ("observationalModel", "Observational model"),
+    ("primaryPurpose", "Primary purpose"),
+    ("whoMasked", "Masked"),
+    ("eligibleSex", "Sex"),
+    ("submitDate", "Submitted"),
+    ("submitDatePosted", "First posted"),
+    ("resultsDate", "Results submitted"),
+    ("resultsDatePosted", "Results posted"),
+    ("lastUpdateDatePosted", "Last update posted"),
+    ("verifyDate", "Verified"),
+]
+
+# Fields of lists of strings rendered inline, with the maximum number of items
+INLINE_LIST_FIELDS = [
+    ("conditions", "Conditions", 20),
+    ("collaborators", "Collaborators", 10),
+]
+
+# Names of the sections besides the core one; they must match the sections embedded
+# by the embedding pipeline
+SECTION_NAMES = ["details", "criteria", "interventions", "outcomes", "locations"]
+
+CRITERIA_FIELDS = [
+    ("inclusionCriteria", "Inclusion criteria"),
+    ("exclusionCriteria", "Exclusion criteria"),
+]
+
+OUTCOME_FIELDS = [
+    ("primaryMeasureOutcomes", "Primary outcomes"),
+    ("secondaryMeasureOutcomes", "Secondary outcomes"),
+    ("otherMeasureOutcomes", "Other outcomes"),
+]
+
+
+def _compact_line(text: str) -> str:
+    """Collapse all whitespace in a text into single spaces."""
+    return " ".join(text.split())
+
+
+def _compact_text(text: str) -> str:
+    """Strip each line of a text and drop blank lines."""
+    return "\n".join(line for line in map(str.strip, text.splitlines()) if line)
+
+
+def _capped(items: list[str], max_items: int) -> list[str]:
+    """Cap a list of items, noting how many were left out."""
+    if len(items) <= max_items:
+        return items
+    return [*items[:max_items], f"... and {len(items) - max_items} more"]
+
+
+def _drop_empty_parts(text: str) -> str:
+    """Drop the empty parts of a comma-separated text."""
+    return ", ".join(part for part in map(str.strip, text.split(",")) if part)
+
+
+def _format_intervention(intervention: TrialMetadataInterventionType) -> str:
+    """Format an intervention into a single line."""
+    line = f"{intervention['type']}: {intervention['name']}"
+    if intervention["description"]:
+        line += f" - {_compact_line(intervention['description'])}"
+    return line
+
+
+def _format_outcome(outcome: TrialMetadataMeasureOutcomeType) -> str:
+    """Format a measure outcome into a single line."""
+    line = outcome["measure"]
+    if outcome["timeFrame"]:
+        line += f" [{outcome['timeFrame']}]"
+    if outcome["description"]:
+        line += f": {_compact_line(outcome['description'])}"
+    return line
+
+
+def render_trial_sections(
+    metadata: TrialMetadataType, max_list_items: int = 10
+) -> dict[str, str]:
+    """Render trial metadata into compact sections for chat system instructions.
+
+    Compared with pretty-printed JSON, the rendering uses a terse "Label: value"
+    layout without quoting or indentation, drops empty fields, and caps the long
+    lists of peripheral items, i.e., references, documents, officials and locations,
+    at `max_list_items` items, noting how many items were left out. Interventions
+    and outcomes are never capped, since questions about them need the full lists.
+    The "core" section gives an overview of the trial and
+    is always present; the other sections, named as in `SECTION_NAMES`, are the ones
+    embedded by the embedding pipeline for section-level retrieval, and are left out
+    if empty.
+    """
+    fields: dict[str, Any] = dict(metadata)
+    sections: dict[str, list[str]] = {name: [] for name in ["core", *SECTION_NAMES]}
+
+    def _add_list(
+        name: str, label: str, items: list[str], capped: bool = False
+    ) -> None:
+        if len(items) > 0:
+            sections[name].append(f"{label}:")
+            if capped:
+                items = _capped(items, max_list_items)
+            sections[name].extend(f"- {item}" for item in items)
+
+    core = sections["core"]
+    for key, label in SCALAR_FIELDS:
+        if fields[key] not in (None, ""):
+            core.append(f"{label}: {fields[key]}")
+    if metadata["minAge"] > 0 or metadata["maxAge"] < 120:
+        core.append(f"Ages: {metadata['minAge']}-{metadata['maxAge']}")
+    core.append(f"Accepts healthy volunteers: {metadata['acceptsHealthy']}")
+    for key, label, max_items in INLINE_LIST_FIELDS:
+        if values := [value for value in fields[key] if value]:
+            core.append(f"{label}: {'; '.join(_capped(values, max_items))}")
+    if summary := _compact_text(metadata["summary"]):
+        core.extend(["Summary:", summary])
+    _add_list(
+        "core",
+        "References",
+        [f"PMID {ref['pmid']}: {ref['citation']}" for ref in metadata["references"]],
+        capped=True,
+    )
+    _add_list(
+        "core",
+        "Documents",
+        [document["url"] for document in metadata["documents"]],
+        capped=True,
+    )
+
+    if details := _compact_text(metadata["details"]):
+        sections["details"].extend(["Details:", details])
+    for key, label in CRITERIA_FIELDS:
+        if criteria := _compact_text(fields[key]):
+            sections["criteria"].extend([f"{label}:", criteria])
+    _add_list(
+        "interventions",
+        "Interventions",
+        list(map(_format_intervention, metadata["interventions"])),
+    )
+    for key, label in OUTCOME_FIELDS:
+        _add_list("outcomes", label, [_format_outcome(item) for item in fields[key]])
+    for key, label in [("officials", "Officials"), ("locations", "Locations")]:
+        # Officials and locations are joined by commas with empty parts for missing
+        # values by the data pipeline
+        items = [_drop_empty_parts(item) for item in fields[key]]
+        items = [item for item in items if item]
+        _add_list("locations", f"{label} ({len(items)} total)", items, capped=True)
+
+    return {name: "\n".join(lines) for name, lines in sections.items() if lines}
+
+
+def assemble_trial_context(
+    sections: dict[str, str],
+    selected: list[str] | None = None,
+    max_section_chars: int | None = None,
+) -> str:
+    """Assemble the chat context of a trial from its rendered sections.
+
+    The core section is always included. If `selected` is given, only the selected
+    sections are included besides the core, in their original order; otherwise all
+    sections are included. Each section other than the core is cut to at most
+    `max_section_chars` characters if given.
+    """
+    texts = []
+    for name, text in sections.items():
+        if name != "core":
+            if selected is not None and name not in selected:
+                continue
+            if max_section_chars is not None and len(text) > max_section_chars:
+                text = f"{text[:max_section_chars]}... (truncated)"
+        texts.append(text)
+    return "\n".join(texts)
+
+
+def render_trial_context(metadata: TrialMetadataType, max_list_items: int = 10) -> str:
+    """Render trial metadata into a compact text for chat system instructions."""
+    return assemble_trial_context(render_trial_sections(metadata, max_list_items))
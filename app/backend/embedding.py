@@ -0,0 +1,194 @@
+"""Micro-batching worker for query embeddings."""
+
+import asyncio
+import queue
+import threading
+import time
+from collections.abc import Sequence
+from concurrent.futures import Future
+from typing import Any, NamedTuple
+
+import numpy as np
+
+from localtyping import EmbeddingWorkerStatsType
+
+
+class _PendingQuery(NamedTuple):
+    queries: list[str]
+    future: Future
+    enqueued_at: float
+
+
+class EmbeddingWorker:
+    """Encode concurrent queries in small batches off the event loop.
+
+    Queries submitted via `encode` are put on a queue drained by a dedicated
+    background thread. The thread waits at most `max_wait_ms` milliseconds for up
+    to `max_batch_size` queries, encodes them with a single call to the model, then
+    resolves the future of each caller. Since the results are delivered through
+    thread-safe futures, the worker does not depend on any specific event loop.
+    """
+
+    def __init__(self, model: Any, max_batch_size: int = 16, max_wait_ms: float = 5):
+        if max_batch_size <= 0:
+            raise ValueError("Required max_batch_size > 0")
+        if max_wait_ms < 0:
+            raise ValueError("Required max_wait_ms >= 0")
+
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+
+        self._queue: queue.SimpleQueue[_PendingQuery | None] = queue.SimpleQueue()
+        self._thread: threading.Thread | None = None
+        self._closed = False
+        self._lock = threading.Lock()
+
+        # Statistics; they are only written by the worker thread
+        self._num_batches = 0
+        self._num_queries = 0
+        self._max_batch_size_seen = 0
+        self._total_wait = 0.0
+        self._max_wait_seen = 0.0
+
+    async def encode(self, query: str) -> np.ndarray:
+        """Encode a single query, batched with other concurrent queries."""
+        embeddings = await self.encode_many([query])
+        return embeddings[0]
+
+    async def encode_many(self, queries: Sequence[str]) -> np.ndarray:
+        """Encode multiple queries at once, batched with other concurrent queries.
+
+        The queries are split into chunks of at most `max_batch_size` queries, so
+        that no call to the model encodes more than `max_batch_size` queries. Raises
+        RuntimeError if the worker has been closed.
+        """
+        queries = list(queries)
+        chunks = [
+            queries[start : start + self.max_batch_size]
+            for start in range(0, max(len(queries), 1), self.max_batch_size)
+        ]
+        futures: list[Future] = [Future() for _ in chunks]
+        # Enqueue under the lock, so that no query can be enqueued behind the
+        # sentinel put by a concurrent `close` and never be resolved
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Embedding worker closed")
+            self._ensure_started()
+            enqueued_at = time.perf_counter()
+            for chunk, future in zip(chunks, futures):
+                self._queue.put(_PendingQuery(chunk, future, enqueued_at))
+        if len(futures) == 1:
+            return await asyncio.wrap_future(futures[0])
+        embeddings = await asyncio.gather(*map(asyncio.wrap_future, futures))
+        return np.concatenate(embeddings)
+
+    def close(self) -> None:
+        """Stop the worker thread after draining the pending queries.
+
+        Queries that are still pending once the thread has stopped, if any, fail with
+        RuntimeError rather than leaving their callers waiting forever.
+        """
+        with self._lock:
+            self._closed = True
+            thread, self._thread = self._thread, None
+            if thread is not None:
+                self._queue.put(None)
+        if thread is not None:
+            thread.join()
+
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None and item.future.set_running_or_notify_cancel():
+                item.future.set_exception(RuntimeError("Embedding worker closed"))
+
+    def stats(self) -> EmbeddingWorkerStatsType:
+        """Get the batch-size and queue-wait statistics of the worker."""
+        num_batches, num_queries = self._num_batches, self._num_queries
+        return {
+            "numBatches": num_batches,
+            "numQueries": num_queries,
+            "meanBatchSize": num_queries / num_batches if num_batches > 0 else 0,
+            "maxBatchSize": self._max_batch_size_seen,
+            "meanQueueWaitMs": (
+                self._total_wait / num_queries * 1000 if num_queries > 0 else 0
+            ),
+            "maxQueueWaitMs": self._max_wait_seen * 1000,
+        }
+
+    def _ensure_started(self) -> None:
+        """Start the worker thread if it is not running; the lock must be held."""
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="embedding-worker", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self) -> None:
+        """Main loop of the worker thread."""
+        carried: _PendingQuery | None = None
+        stopping = False
+        while not stopping:
+            item = carried if carried is not None else self._queue.get()
+            carried = None
+            if item is None:
+                break
+
+            # Keep collecting queries until the batch is full or the first query in
+            # the batch has waited for long enough; an entry that would overflow the
+            # batch is carried over to the next one
+            batch = [item]
+            size = len(item.queries)
+            deadline = time.perf_counter() + self.max_wait
+            while size < self.max_batch_size:
+                timeout = deadline - time.perf_counter()
+                try:
+                    item = (
+                        self._queue.get(timeout=timeout)
+                        if timeout > 0
+                        else self._queue.get_nowait()
+                    )
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                if size + len(item.queries) > self.max_batch_size:
+                    carried = item
+                    break
+                batch.append(item)
+                size += len(item.queries)
+
+            self._process(batch)
+
+    def _process(self, batch: list[_PendingQuery]) -> None:
+        """Encode a batch of queries and resolve their futures."""
+        # Callers may have been cancelled while waiting in the queue, in which case
+        # there is no need to encode their queries
+        batch = [item for item in batch if item.future.set_running_or_notify_cancel()]
+        if len(batch) == 0:
+            return
+
+        started_at = time.perf_counter()
+        queries = [query for item in batch for query in item.queries]
+        try:
+            embeddings = np.asarray(self.model.encode(queries))
+        except Exception as exc:
+            for item in batch:
+                item.future.set_exception(exc)
+        else:
+            start = 0
+            for item in batch:
+                item.future.set_result(embeddings[start : start + len(item.queries)])
+                start += len(item.queries)
+
+        self._num_batches += 1
+        self._num_queries += len(queries)
+        self._max_batch_size_seen = max(self._max_batch_size_seen, len(queries))
+        for item in batch:
+            wait = started_at - item.enqueued_at
+            self._total_wait += wait * len(item.queries)
+            self._max_wait_seen = max(self._max_wait_seen, wait)
@@ -0,0 +1,135 @@
+"""Query encoders for the backend APIs."""
+
+import logging
+from collections.abc import Sequence
+from typing import Any, NamedTuple, Protocol
+
+import numpy as np
+
+# NOTE: torch, transformers and FlagEmbedding take seconds to import, so they are
+# imported only when an encoder is loaded, which the backend does in the background
+# after it starts accepting traffic
+
+logger = logging.getLogger("uvicorn.error")
+
+# Queries encoded by both the encoder and the reference encoder in parity checks;
+# they cover the kinds of queries users search and chat with
+PARITY_QUERIES = [
+    "breast cancer",
+    "Phase 3 trials of immunotherapy for non-small cell lung cancer",
+    "type 2 diabetes in adolescents",
+    "What are the inclusion criteria?",
+    "Does the study accept healthy volunteers?",
+    "long COVID fatigue treatment",
+    "pediatric asthma inhaled corticosteroids",
+    "Alzheimer's disease amyloid antibody",
+    "How long is the follow-up period?",
+    "depression cognitive behavioral therapy randomized",
+    "HIV pre-exposure prophylaxis",
+    "Where are the study locations?",
+]
+
+
+class Encoder(Protocol):
+    def encode(self, sentences: str | list[str]) -> np.ndarray: ...
+
+
+class QuantizedEncoder:
+    """CPU query encoder with int8 dynamically quantized linear layers.
+
+    The weights of all linear layers are quantized to int8 ahead of time and their
+    activations are quantized on the fly, which speeds up inference on CPU where
+    half precision gives nothing. The encoding mirrors `FlagModel.encode` for BGE
+    models: the embedding is the normalized hidden state of the CLS token.
+    """
+
+    def __init__(self, model: Any, tokenizer: Any, max_length: int = 512):
+        import torch
+
+        self.model = torch.ao.quantization.quantize_dynamic(
+            model.eval(), {torch.nn.Linear}, dtype=torch.qint8
+        )
+        self.tokenizer = tokenizer
+        self.max_length = max_length
+
+    @classmethod
+    def from_pretrained(cls, model_name: str, **kwargs: Any) -> "QuantizedEncoder":
+        """Load and quantize a pretrained model."""
+        from transformers import AutoModel, AutoTokenizer  # type: ignore
+
+        model = AutoModel.from_pretrained(model_name)
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        return cls(model, tokenizer, **kwargs)
+
+    def encode(self, sentences: str | list[str]) -> np.ndarray:
+        """Encode a sentence into a vector or a list of sentences into a matrix."""
+        import torch
+
+        batch = [sentences] if isinstance(sentences, str) else list(sentences)
+        inputs = self.tokenizer(
+            batch,
+            padding=True,
+            truncation=True,
+            max_length=self.max_length,
+            return_tensors="pt",
+        )
+        with torch.inference_mode():
+            hidden = self.model(**inputs).last_hidden_state[:, 0]
+            embeddings = torch.nn.functional.normalize(hidden, dim=-1).numpy()
+        return embeddings[0] if isinstance(sentences, str) else embeddings
+
+
+class ParityReport(NamedTuple):
+    min_similarity: float
+    mean_similarity: float
+
+
+def check_parity(
+    encoder: Encoder, reference: Encoder, sentences: Sequence[str] = PARITY_QUERIES
+) -> ParityReport:
+    """Compare the embeddings of an encoder with those of the reference encoder."""
+    embeddings = np.asarray(encoder.encode(list(sentences)), dtype=np.float32)
+    references = np.asarray(reference.encode(list(sentences)), dtype=np.float32)
+    similarities = np.sum(embeddings * references, axis=1) / (
+        np.linalg.norm(embeddings, axis=1) * np.linalg.norm(references, axis=1)
+    )
+    return ParityReport(float(similarities.min()), float(similarities.mean()))
+
+
+def load_encoder(
+    model_name: str, backend: str = "flag", parity_threshold: float | None = 0.99
+) -> tuple[str, Encoder]:
+    """Load the query encoder of a backend, together with a name identifying it.
+
+    The "flag" backend is the reference `FlagModel`; the "int8" backend is a
+    `QuantizedEncoder`. If `parity_threshold` is given, other backends are checked
+    against the reference on `PARITY_QUERIES` and the reference is used instead if
+    the cosine similarity of any query falls below the threshold.
+    """
+    if backend not in ("flag", "int8"):
+        raise ValueError(f"Unknown embedding backend: {backend}")
+
+    from FlagEmbedding import FlagModel  # type: ignore
+
+    if backend == "flag":
+        return model_name, FlagModel(model_name, use_fp16=True)
+
+    encoder = QuantizedEncoder.from_pretrained(model_name)
+    if parity_threshold is not None:
+        reference = FlagModel(model_name, use_fp16=True)
+        report = check_parity(encoder, reference)
+        if report.min_similarity < parity_threshold:
+            logger.error(
+                f"Embedding backend {backend!r} failed the parity check with minimum "
+                f"similarity {report.min_similarity:.4f} < {parity_threshold}; "
+                "falling back to the reference encoder"
+            )
+            return model_name, reference
+        logger.info(
+            f"Embedding backend {backend!r} passed the parity check with minimum "
+            f"similarity {report.min_similarity:.4f}"
+        )
+
+    # Embeddings of different backends differ slightly, so they are told apart by
+    # the name to keep them from being mixed in the query embedding cache
+    return f"{model_name}:{backend}", encoder
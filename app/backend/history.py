@@ -0,0 +1,158 @@
+"""Token-budgeted chat history management for the backend APIs."""
+
+import math
+from typing import TYPE_CHECKING, NamedTuple
+
+from localtyping import ChatPromptStatsType
+
+if TYPE_CHECKING:
+    from vertexai.generative_models import Content  # type: ignore
+
+SUMMARY_PREFIX = "Summary of the earlier conversation:"
+SUMMARY_ACK = "Understood."
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the number of tokens in a text."""
+    # NOTE: Gemini averages about four characters per token on English text, which
+    # is accurate enough for budgeting and avoids a round-trip to the tokenizer API
+    return math.ceil(len(text) / 4)
+
+
+def get_content_text(content: "Content") -> str:
+    """Get the text of a chat content."""
+    return "".join(part.text for part in content.parts)
+
+
+def _snippet(text: str, max_chars: int) -> str:
+    """Collapse whitespace and cut a text to at most `max_chars` characters."""
+    text = " ".join(text.split())
+    return text if len(text) <= max_chars else f"{text[: max_chars - 3]}..."
+
+
+class FittedHistory(NamedTuple):
+    history: list["Content"]
+    prompt_tokens: int
+    folded_turns: int
+
+
+class HistoryManager:
+    """Keep chat prompts within a token budget with rolling truncation.
+
+    The prompt consists of the system instruction, the history and the new query.
+    The system instruction and the query are always kept, and the most recent turns
+    of the history are kept as long as the prompt fits within `token_budget`. Older
+    turns are folded into a summary turn at the start of the history, with one line
+    per turn made of snippets of the user query and the model response; the oldest
+    lines are dropped to keep the summary within `summary_max_tokens`.
+    """
+
+    def __init__(
+        self,
+        token_budget: int = 16000,
+        summary_max_tokens: int = 512,
+        snippet_chars: int = 160,
+    ):
+        if token_budget <= 0:
+            raise ValueError("Required token_budget > 0")
+        if summary_max_tokens <= 0:
+            raise ValueError("Required summary_max_tokens > 0")
+
+        self.token_budget = token_budget
+        self.summary_max_tokens = summary_max_tokens
+        self.snippet_chars = snippet_chars
+
+    def fit(
+        self, history: list["Content"], system_instruction: str, query: str
+    ) -> FittedHistory:
+        """Fit a chat history into the token budget for a new query."""
+        fixed_tokens = estimate_tokens(system_instruction) + estimate_tokens(query)
+        turn_tokens = [estimate_tokens(get_content_text(c)) for c in history]
+        if fixed_tokens + sum(turn_tokens) <= self.token_budget:
+            return FittedHistory(history, fixed_tokens + sum(turn_tokens), 0)
+
+        # Split off the summary of previously folded turns, if any
+        summary_lines: list[str] = []
+        start = 0
+        if len(history) >= 2 and get_content_text(history[0]).startswith(
+            SUMMARY_PREFIX
+        ):
+            summary_text = get_content_text(history[0]).removeprefix(SUMMARY_PREFIX)
+            summary_lines = [line for line in summary_text.split("\n") if line]
+            start = 2
+
+        # Keep the most recent turns that fit, leaving room for the summary; turns
+        # are (user, model) pairs so the history keeps alternating roles
+        available = (
+            self.token_budget
+            - fixed_tokens
+            - self.summary_max_tokens
+            - estimate_tokens(SUMMARY_PREFIX + SUMMARY_ACK)
+        )
+        keep_from = len(history)
+        used = 0
+        for i in range(len(history) - 2, start - 1, -2):
+            cost = turn_tokens[i] + turn_tokens[i + 1]
+            if used + cost > available:
+                break
+            keep_from, used = i, used + cost
+
+        # Fold the older turns into the summary
+        for i in range(start, keep_from, 2):
+            query_text = get_content_text(history[i])
+            response_text = get_content_text(history[i + 1])
+            summary_lines.append(
+                f"- User: {_snippet(query_text, self.snippet_chars)} | "
+                f"Assistant: {_snippet(response_text, self.snippet_chars)}"
+            )
+        while (
+            len(summary_lines) > 1
+            and estimate_tokens("\n".join(summary_lines)) > self.summary_max_tokens
+        ):
+            summary_lines.pop(0)
+
+        from vertexai.generative_models import Content, Part  # type: ignore
+
+        summary = "\n".join([SUMMARY_PREFIX, *summary_lines])
+        fitted = [
+            Content(role="user", parts=[Part.from_text(summary)]),
+            Content(role="model", parts=[Part.from_text(SUMMARY_ACK)]),
+            *history[keep_from:],
+        ]
+        prompt_tokens = (
+            fixed_tokens
+            + estimate_tokens(summary)
+            + estimate_tokens(SUMMARY_ACK)
+            + used
+        )
+        return FittedHistory(fitted, prompt_tokens, (keep_from - start) // 2)
+
+
+class ChatPromptStats:
+    """Statistics of the estimated prompt sizes of chats."""
+
+    def __init__(self):
+        self._num_prompts = 0
+        self._total_tokens = 0
+        self._max_tokens = 0
+        self._num_truncated = 0
+
+    def record(self, fitted: FittedHistory) -> None:
+        """Record the prompt size of a chat request."""
+        self._num_prompts += 1
+        self._total_tokens += fitted.prompt_tokens
+        self._max_tokens = max(self._max_tokens, fitted.prompt_tokens)
+        if fitted.folded_turns > 0:
+            self._num_truncated += 1
+
+    def stats(self) -> ChatPromptStatsType:
+        """Get the prompt size statistics of chats."""
+        num_prompts = self._num_prompts
+        return {
+            "numPrompts": num_prompts,
+            "meanPromptTokens": (
+                self._total_tokens / num_prompts if num_prompts > 0 else 0
+            ),
+            "maxPromptTokens": self._max_tokens,
+            "numTruncated": self._num_truncated,
+        }
@@ -0,0 +1,312 @@
+"""Local vector index for the backend APIs."""
+
+import json
+import logging
+import os
+from collections.abc import Mapping, Sequence
+from pathlib import Path
+from typing import Any
+
+import chromadb
+import chromadb.api
+import numpy as np
+
+from localtyping import APIRetrieveResponseType, TrialFilters
+from utils import dates_to_timestamps, get_collection_version, study_phases_bitmask
+
+logger = logging.getLogger("uvicorn.error")
+
+# Categorical metadata fields stored as integer codes into a vocabulary
+CATEGORICAL_FIELDS = ["study_type", "eligible_sex"]
+
+# Date fields that can be filtered on, stored as epoch milliseconds
+TIMESTAMP_FIELDS = ["last_update_date_posted", "results_date_posted"]
+
+EMBEDDINGS_FILE = "embeddings.npy"
+COLUMNS_FILE = "columns.npz"
+
+
+def _pack_strings(strings: Sequence[str]) -> tuple[np.ndarray, np.ndarray]:
+    """Pack strings into a UTF-8 byte buffer and the offsets delimiting them."""
+    encoded = [string.encode("utf-8") for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(data) for data in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+def _unpack_string(data: np.ndarray, offsets: np.ndarray, index: int) -> str:
+    """Unpack a string packed by `_pack_strings`."""
+    return data[offsets[index] : offsets[index + 1]].tobytes().decode("utf-8")
+
+
+def _metadata_timestamps(
+    metadatas: Sequence[Mapping[str, Any]], key: str
+) -> np.ndarray:
+    """Get the timestamps of a date field, preferring the derived column if stored."""
+    if len(metadatas) > 0 and f"{key}_ts" in metadatas[0]:
+        return np.array([m[f"{key}_ts"] for m in metadatas], dtype=np.int64)
+    return dates_to_timestamps([m[key] for m in metadatas])
+
+
+class LocalVectorIndex:
+    """Exact in-process vector index over a snapshot of the ChromaDB collection.
+
+    The index holds the normalized embeddings of all trials, which are memory-mapped
+    when loaded from disk, and a compact columnar table of the metadata fields that
+    can be filtered on. Queries are answered by a dot product of the embeddings with
+    the normalized query embedding, so for the normalized embeddings of the BGE model
+    the ranking is the same as the exact ranking of ChromaDB. All filters are applied
+    exactly on the columns, so no over-fetching or post-filtering is needed. ChromaDB
+    stays the source of truth: the index is tagged with the collection version it was
+    snapshotted from.
+    """
+
+    def __init__(
+        self,
+        embeddings: np.ndarray,
+        columns: Mapping[str, np.ndarray],
+        version: str | None = None,
+    ):
+        self.embeddings = embeddings
+        self.columns = dict(columns)
+        self.version = version
+
+    def __len__(self) -> int:
+        return self.embeddings.shape[0]
+
+    @classmethod
+    def from_records(
+        cls,
+        ids: Sequence[str],
+        documents: Sequence[str],
+        embeddings: Any,
+        metadatas: Sequence[Mapping[str, Any]],
+        version: str | None = None,
+    ) -> "LocalVectorIndex":
+        """Build an index from the records of the collection."""
+        vectors = np.asarray(embeddings, dtype=np.float32).reshape(len(ids), -1)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.maximum(norms, 1e-12)
+
+        columns: dict[str, np.ndarray] = {}
+        columns["ids_data"], columns["ids_offsets"] = _pack_strings(ids)
+        columns["documents_data"], columns["documents_offsets"] = _pack_strings(
+            documents
+        )
+        for key in CATEGORICAL_FIELDS:
+            vocabulary, codes = np.unique(
+                np.array([m[key] for m in metadatas], dtype=np.str_),
+                return_inverse=True,
+            )
+            columns[key] = codes.astype(np.int16)
+            columns[f"{key}_values"] = vocabulary
+        columns["accepts_healthy"] = np.array(
+            [bool(m["accepts_healthy"]) for m in metadatas], dtype=bool
+        )
+        for key in ["min_age", "max_age"]:
+            columns[key] = np.array([m[key] for m in metadatas], dtype=np.float64)
+        columns["study_phases"] = np.array(
+            [study_phases_bitmask(m["study_phases"]) for m in metadatas],
+            dtype=np.uint8,
+        )
+        for key in TIMESTAMP_FIELDS:
+            columns[f"{key}_ts"] = _metadata_timestamps(metadatas, key)
+        return cls(vectors, columns, version=version)
+
+    @classmethod
+    def from_collection(
+        cls, collection: chromadb.Collection, batch_size: int = 1000
+    ) -> "LocalVectorIndex":
+        """Snapshot the collection into an index, fetching records in batches."""
+        ids: list[str] = []
+        documents: list[str] = []
+        embeddings: list[Any] = []
+        metadatas: list[Mapping[str, Any]] = []
+        include = [
+            chromadb.api.types.IncludeEnum("documents"),
+            chromadb.api.types.IncludeEnum("embeddings"),
+            chromadb.api.types.IncludeEnum("metadatas"),
+        ]
+        for offset in range(0, collection.count(), batch_size):
+            results = collection.get(limit=batch_size, offset=offset, include=include)
+            assert (
+                results["documents"] is not None
+                and results["embeddings"] is not None
+                and results["metadatas"] is not None
+            ), "Missing documents, embeddings or metadatas in get results"
+            ids.extend(results["ids"])
+            documents.extend(results["documents"])
+            embeddings.extend(results["embeddings"])
+            metadatas.extend(results["metadatas"])
+        return cls.from_records(
+            ids,
+            documents,
+            np.asarray(embeddings, dtype=np.float32),
+            metadatas,
+            version=get_collection_version(collection),
+        )
+
+    def save(self, path: str | Path) -> None:
+        """Save the index into a directory."""
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+
+        # Write to temporary files first so that a crash midway does not leave a
+        # corrupted index behind; the columns are written last since they carry the
+        # version that marks the snapshot as complete
+        tmp_embeddings_path = path / f"{EMBEDDINGS_FILE}.tmp"
+        with tmp_embeddings_path.open("wb") as f:
+            np.save(f, np.ascontiguousarray(self.embeddings, dtype=np.float32))
+        os.replace(tmp_embeddings_path, path / EMBEDDINGS_FILE)
+        tmp_columns_path = path / f"{COLUMNS_FILE}.tmp"
+        with tmp_columns_path.open("wb") as f:
+            np.savez(f, version=np.array(json.dumps(self.version)), **self.columns)
+        os.replace(tmp_columns_path, path / COLUMNS_FILE)
+
+    @classmethod
+    def load(cls, path: str | Path, mmap: bool = True) -> "LocalVectorIndex":
+        """Load an index from a directory, memory-mapping the embeddings."""
+        path = Path(path)
+        embeddings = np.load(path / EMBEDDINGS_FILE, mmap_mode="r" if mmap else None)
+        with np.load(path / COLUMNS_FILE, allow_pickle=False) as data:
+            columns = {key: data[key] for key in data.files if key != "version"}
+            version = json.loads(str(data["version"]))
+        if len(columns["ids_offsets"]) - 1 != embeddings.shape[0]:
+            raise ValueError(f"Inconsistent local index at {path}")
+        return cls(embeddings, columns, version=version)
+
+    def filter_mask(self, filters: TrialFilters) -> np.ndarray | None:
+        """Evaluate filters into a boolean mask, or None if nothing is filtered.
+
+        The semantics are the same as those of `construct_filters` together with
+        post-filtering.
+        """
+        columns = self.columns
+        mask = np.ones(len(self), dtype=bool)
+        filtered = False
+
+        for key, value in [
+            ("study_type", filters.get("studyType")),
+            ("eligible_sex", filters.get("eligibleSex")),
+        ]:
+            if value is not None:
+                # Values outside of the vocabulary match no code and thus nothing
+                codes = np.flatnonzero(columns[f"{key}_values"] == value.upper())
+                mask &= np.isin(columns[key], codes)
+                filtered = True
+
+        # Unhealthy participants are always accepted, see construct_filters
+        if filters.get("acceptsHealthy") is False:
+            mask &= ~columns["accepts_healthy"]
+            filtered = True
+
+        if (age_range := filters.get("ageRange")) is not None:
+            min_age, max_age = age_range
+            mask &= (columns["min_age"] <= max_age) & (columns["max_age"] >= min_age)
+            filtered = True
+
+        if study_phases := filters.get("studyPhases"):
+            study_phases_mask = study_phases_bitmask(", ".join(study_phases))
+            mask &= (columns["study_phases"] & study_phases_mask) != 0
+            filtered = True
+
+        for key, date_range in [
+            ("last_update_date_posted", filters.get("lastUpdateDatePosted")),
+            ("results_date_posted", filters.get("resultsDatePosted")),
+        ]:
+            if date_range is not None:
+                date_from, date_to = date_range
+                timestamps = columns[f"{key}_ts"]
+                mask &= (timestamps >= date_from) & (timestamps <= date_to)
+                filtered = True
+
+        return mask if filtered else None
+
+    def search(
+        self, query_embedding: np.ndarray, top_k: int, filters: TrialFilters
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Search the `top_k` trials most similar to the query that pass the filters.
+
+        The indices of the trials are returned in descending order of similarity,
+        together with their cosine similarities to the query.
+        """
+        query_vector = np.asarray(query_embedding, dtype=np.float32)
+        query_vector = query_vector / max(float(np.linalg.norm(query_vector)), 1e-12)
+
+        mask = self.filter_mask(filters)
+        candidates: np.ndarray | None = None
+        if mask is None:
+            scores = self.embeddings @ query_vector
+        else:
+            candidates = np.flatnonzero(mask)
+            if len(candidates) < len(self) // 2:
+                # Selective filters touch only the embeddings of the candidates
+                scores = self.embeddings[candidates] @ query_vector
+            else:
+                scores = (self.embeddings @ query_vector)[candidates]
+
+        k = min(top_k, len(scores))
+        if k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        indices = candidates[top] if candidates is not None else top
+        return indices, scores[top]
+
+    def get_ids(self, indices: Sequence[int] | np.ndarray) -> list[str]:
+        """Get the IDs of trials by their indices."""
+        data, offsets = self.columns["ids_data"], self.columns["ids_offsets"]
+        return [_unpack_string(data, offsets, i) for i in indices]
+
+    def get_documents(self, indices: Sequence[int] | np.ndarray) -> list[str]:
+        """Get the documents of trials by their indices."""
+        data = self.columns["documents_data"]
+        offsets = self.columns["documents_offsets"]
+        return [_unpack_string(data, offsets, i) for i in indices]
+
+    def query(
+        self,
+        query_embedding: np.ndarray,
+        top_k: int,
+        filters: TrialFilters,
+        include_distances: bool = False,
+    ) -> APIRetrieveResponseType:
+        """Query the index into a retrieval response.
+
+        The distances, if included, are squared L2 distances as in the default space
+        of ChromaDB, i.e., 2 - 2 * cosine similarity between unit vectors.
+        """
+        indices, scores = self.search(query_embedding, top_k, filters)
+        response: APIRetrieveResponseType = {
+            "ids": self.get_ids(indices),
+            "documents": self.get_documents(indices),
+        }
+        if include_distances:
+            response["distances"] = (2 - 2 * scores.astype(np.float64)).tolist()
+        return response
+
+
+def open_local_index(
+    collection: chromadb.Collection, path: str | Path
+) -> LocalVectorIndex:
+    """Open the local index of the collection, snapshotting it if needed.
+
+    The snapshot saved at `path` is reused if it matches the collection version;
+    otherwise the collection is snapshotted again and saved there.
+    """
+    version = get_collection_version(collection)
+    path = Path(path)
+    if (path / COLUMNS_FILE).exists():
+        try:
+            index = LocalVectorIndex.load(path)
+        except Exception as exc:
+            logger.warning(f"Failed to load local index at {path}: {exc!r}")
+        else:
+            if index.version == version:
+                logger.info(f"Loaded local index of {len(index)} trials from {path}")
+                return index
+
+    index = LocalVectorIndex.from_collection(collection)
+    index.save(path)
+    logger.info(f"Snapshotted {len(index)} trials into local index at {path}")
+    return LocalVectorIndex.load(path)
@@ -1,9 +1,10 @@
 """Type definitions for the backend APIs."""
 
-from typing import Literal, TypeAlias
+from collections.abc import Mapping
+from typing import Any, Literal, TypeAlias
 
-from pydantic import BaseModel
-from typing_extensions import TypedDict
+from pydantic import BaseModel, Field, field_validator
+from typing_extensions import NotRequired, TypedDict
 
 ModelType: TypeAlias = Literal["gemini-1.5-flash-001", "6894888983713546240"]
 
@@ -89,15 +90,180 @@ class APIHeartbeatResponseType(TypedDict):
 class APIRetrieveResponseType(TypedDict):
     ids: list[str]
     documents: list[str]
+    metadatas: NotRequired[list[Mapping[str, Any] | None]]
+    distances: NotRequired[list[float]]
 
 
 class APIMetaResponseType(TypedDict):
     metadata: TrialMetadataType
 
 
+def _check_metadata_fields(fields: list[str] | None) -> list[str] | None:
+    """Check that metadata fields exist, dropping duplicates."""
+    if fields is None:
+        return None
+    unknown = [
+        field for field in fields if field not in TrialMetadataType.__annotations__
+    ]
+    if len(unknown) > 0:
+        raise ValueError(f"Unknown metadata fields: {unknown}")
+    return list(dict.fromkeys(fields))
+
+
+class APIMetaBatchPayloadType(BaseModel):
+    ids: list[str] = Field(max_length=100)
+    fields: list[str] | None = None
+
+    check_fields = field_validator("fields")(_check_metadata_fields)
+
+
+class APIRetrieveBatchQueryType(BaseModel):
+    query: str
+    topK: int = Field(ge=1, le=30)
+    filters: TrialFilters = Field(default_factory=lambda: TrialFilters())
+
+
+class APIRetrieveBatchPayloadType(BaseModel):
+    queries: list[APIRetrieveBatchQueryType] = Field(min_length=1, max_length=1000)
+    fields: list[str] | None = None
+    includeDistances: bool = False
+
+    check_fields = field_validator("fields")(_check_metadata_fields)
+
+
+class APIMetaBatchResponseType(TypedDict):
+    metadatas: dict[str, Mapping[str, Any]]
+    missing: list[str]
+
+
 class APIChatPayloadType(BaseModel):
     query: str
+    sessionId: str | None = Field(default=None, max_length=128)
 
 
 class APIChatResponseType(TypedDict):
     response: str
+    sessionId: str
+
+
+class EmbeddingWorkerStatsType(TypedDict):
+    numBatches: int
+    numQueries: int
+    meanBatchSize: float
+    maxBatchSize: int
+    meanQueueWaitMs: float
+    maxQueueWaitMs: float
+
+
+class QueryEmbeddingCacheStatsType(TypedDict):
+    entries: int
+    maxEntries: int
+    hits: int
+    misses: int
+    hitRatio: float
+
+
+class LRUCacheStatsType(TypedDict):
+    entries: int
+    maxEntries: int
+    weight: int
+    maxWeight: int | None
+    hits: int
+    misses: int
+    evictions: int
+    hitRatio: float
+
+
+class AnswerCacheStatsType(TypedDict):
+    entries: int
+    maxEntries: int
+    exactHits: int
+    semanticHits: int
+    misses: int
+    evictions: int
+    hitRatio: float
+
+
+class OverfetchStatsType(TypedDict):
+    numRequests: int
+    meanRounds: float
+    maxRounds: int
+    meanCandidates: float
+    numShort: int
+    trackedFilters: int
+
+
+class ChatTimingStatsType(TypedDict):
+    numResponses: int
+    numStreamed: int
+    numTimeouts: int
+    meanGenerationMs: float
+    maxGenerationMs: float
+    meanFirstTokenMs: float
+    maxFirstTokenMs: float
+
+
+class ChatPromptStatsType(TypedDict):
+    numPrompts: int
+    meanPromptTokens: float
+    maxPromptTokens: int
+    numTruncated: int
+
+
+class ChatSessionStoreStatsType(TypedDict):
+    sessions: int
+    maxSessions: int
+    created: int
+    evictions: int
+    estimatedBytes: int
+    maxBytes: int | None
+
+
+class StartupReportType(TypedDict):
+    ready: bool
+    elapsedMs: float
+    phasesMs: dict[str, float]
+    error: str | None
+    failures: int
+
+
+class SlowRequestType(TypedDict):
+    timestamp: int
+    method: str
+    path: str
+    status: int
+    durationMs: float
+    stagesMs: dict[str, float]
+    params: dict[str, str]
+    filterShape: str | None
+
+
+class SlowRequestSummaryType(TypedDict):
+    path: str
+    filterShape: str | None
+    count: int
+    meanDurationMs: float
+    maxDurationMs: float
+
+
+class APISlowRequestsResponseType(TypedDict):
+    thresholdMs: float
+    capacity: int
+    requests: list[SlowRequestType]
+    summary: list[SlowRequestSummaryType]
+
+
+class APIStatsResponseType(TypedDict):
+    embedding: EmbeddingWorkerStatsType | None
+    embeddingCache: QueryEmbeddingCacheStatsType
+    resultCache: LRUCacheStatsType
+    metadataCache: LRUCacheStatsType
+    metaResponseCache: LRUCacheStatsType
+    trialSectionsCache: LRUCacheStatsType
+    sectionVectorsCache: LRUCacheStatsType
+    answerCache: AnswerCacheStatsType
+    overfetch: OverfetchStatsType
+    chatSessions: ChatSessionStoreStatsType
+    chatTiming: ChatTimingStatsType
+    chatPrompt: ChatPromptStatsType
+    startup: StartupReportType
@@ -1,48 +1,136 @@
 """Entrypoint of the backend APIs."""
 
+import asyncio
 import json
 import logging
 import os
+import threading
 import time
-from contextlib import asynccontextmanager
+import uuid
+from collections.abc import AsyncIterator, Awaitable, Callable, Mapping, Sequence
+from contextlib import asynccontextmanager, suppress
+from typing import TYPE_CHECKING, Annotated, Any, cast
 
 import chromadb
 import chromadb.api
-import vertexai  # type: ignore
-from fastapi import FastAPI, HTTPException, Request
+import numpy as np
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.openapi.utils import get_openapi
-from fastapi.responses import JSONResponse
-from FlagEmbedding import FlagModel  # type: ignore
-from vertexai.generative_models import (  # type: ignore
-    ChatSession,
-    Content,
-    GenerativeModel,
-    Part,
-)
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 
+from cache import AnswerCache, LRUCache, QueryEmbeddingCache, hash_embedding
+from chat import (
+    ChatTimingStats,
+    generate_chat_response,
+    stream_cached_response,
+    stream_chat_response,
+)
+from context import assemble_trial_context, render_trial_sections
+from embedding import EmbeddingWorker
+from encoders import Encoder, load_encoder
+from history import ChatPromptStats, HistoryManager
+from index import LocalVectorIndex, open_local_index
 from localtyping import (
     APIChatPayloadType,
     APIChatResponseType,
     APIHeartbeatResponseType,
+    APIMetaBatchPayloadType,
+    APIMetaBatchResponseType,
     APIMetaResponseType,
+    APIRetrieveBatchPayloadType,
+    APIRetrieveBatchQueryType,
     APIRetrieveResponseType,
+    APISlowRequestsResponseType,
+    APIStatsResponseType,
     ModelType,
+    StartupReportType,
     TrialFilters,
+    TrialMetadataType,
+)
+from metrics import REGISTRY, time_stage
+from retrieval import (
+    SectionVectors,
+    SelectivityTracker,
+    batch_query,
+    fetch_section_vectors,
+    overfetch_query,
+    select_sections,
 )
+from sessions import (
+    ChatSessionStore,
+    InMemoryChatSessionStore,
+    SqliteChatSessionStore,
+)
+from startup import StartupReport
+from timing import ServerTimingMiddleware, SlowRequestLog
 from utils import (
+    METADATA_FIELD_CLEANERS,
+    canonicalize_filters,
     construct_filters,
     format_exc_details,
+    get_collection_version,
     get_metadata_from_id,
-    post_filter,
+    get_metadatas_from_ids,
+    make_retrieve_response,
+    supports_filter_pushdown,
 )
 
+if TYPE_CHECKING:
+    from vertexai.generative_models import ChatSession, Content  # type: ignore
+
 logger = logging.getLogger("uvicorn.error")
 
 FRONTEND_URL = os.getenv("FRONTEND_URL")
 CHROMADB_HOST = os.getenv("CHROMADB_HOST", "localhost")
 SERVER_ROOT_PATH = os.getenv("SERVER_ROOT_PATH", "")
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "flag")
+EMBEDDING_PARITY_CHECK = os.getenv("EMBEDDING_PARITY_CHECK", "1") == "1"
+EMBEDDING_PARITY_THRESHOLD = float(os.getenv("EMBEDDING_PARITY_THRESHOLD", 0.99))
+EMBEDDING_MAX_BATCH_SIZE = int(os.getenv("EMBEDDING_MAX_BATCH_SIZE", 16))
+EMBEDDING_MAX_WAIT_MS = float(os.getenv("EMBEDDING_MAX_WAIT_MS", 5))
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", 4096))
+EMBEDDING_CACHE_TTL = float(os.getenv("EMBEDDING_CACHE_TTL", 86400))
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH")
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", 2048))
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", 16 * 1024 * 1024))
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", 3600))
+METADATA_CACHE_SIZE = int(os.getenv("METADATA_CACHE_SIZE", 4096))
+METADATA_CACHE_TTL = float(os.getenv("METADATA_CACHE_TTL", 3600))
+METADATA_CACHE_SERIALIZED = os.getenv("METADATA_CACHE_SERIALIZED", "0") == "1"
+CHAT_CONTEXT_MAX_LIST_ITEMS = int(os.getenv("CHAT_CONTEXT_MAX_LIST_ITEMS", 10))
+CHAT_TOP_SECTIONS = int(os.getenv("CHAT_TOP_SECTIONS", 2))
+CHAT_SECTION_MAX_CHARS = int(os.getenv("CHAT_SECTION_MAX_CHARS", 0)) or None
+CHAT_ANSWER_CACHE_SIZE = int(os.getenv("CHAT_ANSWER_CACHE_SIZE", 1024))
+CHAT_ANSWER_CACHE_TTL = float(os.getenv("CHAT_ANSWER_CACHE_TTL", 86400))
+CHAT_ANSWER_CACHE_THRESHOLD = float(os.getenv("CHAT_ANSWER_CACHE_THRESHOLD", 0)) or None
+RETRIEVAL_BACKEND = os.getenv("RETRIEVAL_BACKEND", "chromadb")
+LOCAL_INDEX_PATH = os.getenv("LOCAL_INDEX_PATH", "local-index")
+LOCAL_INDEX_CHECK_INTERVAL = float(os.getenv("LOCAL_INDEX_CHECK_INTERVAL", 60))
+COLLECTION_CHECK_INTERVAL = float(os.getenv("COLLECTION_CHECK_INTERVAL", 10))
+SLOW_REQUEST_THRESHOLD_MS = float(os.getenv("SLOW_REQUEST_THRESHOLD_MS", 1000))
+SLOW_CHAT_REQUEST_THRESHOLD_MS = float(
+    os.getenv("SLOW_CHAT_REQUEST_THRESHOLD_MS", 20000)
+)
+SLOW_REQUEST_SAMPLE_RATE = float(os.getenv("SLOW_REQUEST_SAMPLE_RATE", 1))
+SLOW_REQUEST_LOG_SIZE = int(os.getenv("SLOW_REQUEST_LOG_SIZE", 200))
+OVERFETCH_MAX_CANDIDATES = int(os.getenv("OVERFETCH_MAX_CANDIDATES", 300))
+OVERFETCH_GROWTH = float(os.getenv("OVERFETCH_GROWTH", 2))
+CHAT_MAX_SESSIONS = int(os.getenv("CHAT_MAX_SESSIONS", 1000))
+CHAT_SESSION_IDLE_TTL = float(os.getenv("CHAT_SESSION_IDLE_TTL", 3600))
+CHAT_MAX_SESSION_BYTES = int(os.getenv("CHAT_MAX_SESSION_BYTES", 256 * 1024 * 1024))
+CHAT_TIMEOUT = float(os.getenv("CHAT_TIMEOUT", 60))
+CHAT_MAX_CONCURRENCY = int(os.getenv("CHAT_MAX_CONCURRENCY", 32))
+CHAT_HISTORY_TOKEN_BUDGET = int(os.getenv("CHAT_HISTORY_TOKEN_BUDGET", 16000))
+CHAT_SUMMARY_MAX_TOKENS = int(os.getenv("CHAT_SUMMARY_MAX_TOKENS", 512))
+CHAT_SESSION_BACKEND = os.getenv("CHAT_SESSION_BACKEND", "memory")
+CHAT_SESSION_SQLITE_PATH = os.getenv("CHAT_SESSION_SQLITE_PATH", "chat-sessions.db")
+WARM_UP_RETRY_INITIAL_DELAY = float(os.getenv("WARM_UP_RETRY_INITIAL_DELAY", 1))
+WARM_UP_RETRY_MAX_DELAY = float(os.getenv("WARM_UP_RETRY_MAX_DELAY", 60))
+EMBEDDING_MODEL_NAME = "BAAI/bge-small-en-v1.5"
 CHROMADB_COLLECTION_NAME = "veritas-trial-embeddings"
+CHROMADB_SECTIONS_COLLECTION_NAME = "veritas-trial-sections"
+WARM_UP_QUERY = "Phase 3 trials of immunotherapy for non-small cell lung cancer"
 GCP_PROJECT_ID = "veritastrial"
 GCP_PROJECT_LOCATION = "us-central1"
 
@@ -50,24 +138,194 @@ GH_URL = "https://raw.githubusercontent.com/VeritasTrial/ac215_VeritasTrial/main
 LOGO_URL = f"{GH_URL}/app/frontend/public/veritastrial-wide.png"
 
 # Global states for the FastAPI app
-EMBEDDING_MODEL: FlagModel | None = None
+EMBEDDING_MODEL: Encoder | None = None
+EMBEDDING_WORKER: EmbeddingWorker | None = None
+EMBEDDING_CACHE = QueryEmbeddingCache(
+    EMBEDDING_MODEL_NAME,
+    max_entries=EMBEDDING_CACHE_SIZE,
+    ttl=EMBEDDING_CACHE_TTL,
+    path=EMBEDDING_CACHE_PATH,
+)
+RESULT_CACHE: LRUCache[
+    tuple[str, int, str, tuple[str, ...] | None, bool], APIRetrieveResponseType
+] = LRUCache(
+    RESULT_CACHE_SIZE,
+    ttl=RESULT_CACHE_TTL,
+    max_weight=RESULT_CACHE_MAX_BYTES,
+    weigh=lambda response: (
+        sum(map(len, response["ids"]))
+        + sum(map(len, response["documents"]))
+        + len(json.dumps(response.get("metadatas", [])))
+        + 8 * len(response.get("distances", []))
+    ),
+)
+METADATA_CACHE: LRUCache[str, TrialMetadataType] = LRUCache(
+    METADATA_CACHE_SIZE, ttl=METADATA_CACHE_TTL
+)
+META_RESPONSE_CACHE: LRUCache[str, bytes] = LRUCache(
+    METADATA_CACHE_SIZE, ttl=METADATA_CACHE_TTL
+)
+TRIAL_SECTIONS_CACHE: LRUCache[str, dict[str, str]] = LRUCache(
+    METADATA_CACHE_SIZE, ttl=METADATA_CACHE_TTL
+)
+SECTION_VECTORS_CACHE: LRUCache[str, SectionVectors] = LRUCache(
+    METADATA_CACHE_SIZE, ttl=METADATA_CACHE_TTL
+)
+ANSWER_CACHE = AnswerCache(
+    CHAT_ANSWER_CACHE_SIZE,
+    ttl=CHAT_ANSWER_CACHE_TTL,
+    threshold=CHAT_ANSWER_CACHE_THRESHOLD,
+)
+SELECTIVITY_TRACKER = SelectivityTracker()
 CHROMADB_CLIENT: chromadb.api.ClientAPI | None = None
-CHAT_SESSIONS: dict[str, ChatSession] = {}
+COLLECTION_HANDLES: dict[str, tuple[chromadb.Collection, float]] = {}
+COLLECTION_HANDLES_CLIENT: chromadb.api.ClientAPI | None = None
+if RETRIEVAL_BACKEND not in ("chromadb", "local"):  # pragma: no cover
+    raise ValueError(f"Unknown retrieval backend: {RETRIEVAL_BACKEND}")
+LOCAL_INDEX: LocalVectorIndex | None = None
+LOCAL_INDEX_CHECKED_AT = -np.inf
+LOCAL_INDEX_LOCK = asyncio.Lock()
+CHAT_SESSIONS: ChatSessionStore
+if CHAT_SESSION_BACKEND == "memory":
+    CHAT_SESSIONS = InMemoryChatSessionStore(
+        max_sessions=CHAT_MAX_SESSIONS,
+        idle_ttl=CHAT_SESSION_IDLE_TTL,
+        max_bytes=CHAT_MAX_SESSION_BYTES,
+    )
+elif CHAT_SESSION_BACKEND == "sqlite":  # pragma: no cover
+    # Shared by all workers on the same host that point to the same database file
+    CHAT_SESSIONS = SqliteChatSessionStore(
+        CHAT_SESSION_SQLITE_PATH,
+        max_sessions=CHAT_MAX_SESSIONS,
+        idle_ttl=CHAT_SESSION_IDLE_TTL,
+        max_bytes=CHAT_MAX_SESSION_BYTES,
+    )
+else:  # pragma: no cover
+    raise ValueError(f"Unknown chat session backend: {CHAT_SESSION_BACKEND}")
+CHAT_TIMING_STATS = ChatTimingStats()
+CHAT_PROMPT_STATS = ChatPromptStats()
+HISTORY_MANAGER = HistoryManager(
+    token_budget=CHAT_HISTORY_TOKEN_BUDGET, summary_max_tokens=CHAT_SUMMARY_MAX_TOKENS
+)
+CHAT_SEMAPHORE = asyncio.Semaphore(CHAT_MAX_CONCURRENCY)
+STARTUP_REPORT = StartupReport()
+SLOW_REQUEST_LOG = SlowRequestLog(
+    SLOW_REQUEST_LOG_SIZE,
+    threshold_ms=SLOW_REQUEST_THRESHOLD_MS,
+    path_thresholds_ms={"/chat": SLOW_CHAT_REQUEST_THRESHOLD_MS},
+    sample_rate=SLOW_REQUEST_SAMPLE_RATE,
+)
+ERROR_COUNTER = REGISTRY.counter(
+    "veritastrial_errors_total",
+    "Unhandled errors of serving requests by exception type.",
+    labelnames=("type",),
+)
+REGISTRY.gauge(
+    "veritastrial_chat_sessions",
+    "Chat sessions currently held by the session store.",
+    lambda: CHAT_SESSIONS.stats()["sessions"],
+)
+
+
+def init_vertexai() -> None:
+    """Initialize Vertex AI; importing the SDK alone takes seconds."""
+    import vertexai  # type: ignore
+
+    vertexai.init(project=GCP_PROJECT_ID, location=GCP_PROJECT_LOCATION)
+
+
+async def warm_up_chromadb() -> None:
+    """Connect to ChromaDB and load the local vector index if enabled."""
+    global CHROMADB_CLIENT
+    with STARTUP_REPORT.phase("chromadb"):
+        client = await asyncio.to_thread(
+            chromadb.HttpClient, host=CHROMADB_HOST, port=8000
+        )
+        await asyncio.to_thread(client.get_collection, CHROMADB_COLLECTION_NAME)
+        CHROMADB_CLIENT = client
+    if RETRIEVAL_BACKEND == "local":
+        with STARTUP_REPORT.phase("localIndex"):
+            await get_local_index()
+
+
+async def warm_up_embedding_model() -> None:
+    """Load the embedding model and warm it up."""
+    global EMBEDDING_MODEL
+    with STARTUP_REPORT.phase("embeddingModel"):
+        encoder_name, model = await asyncio.to_thread(
+            load_encoder,
+            EMBEDDING_MODEL_NAME,
+            backend=EMBEDDING_BACKEND,
+            parity_threshold=(
+                EMBEDDING_PARITY_THRESHOLD if EMBEDDING_PARITY_CHECK else None
+            ),
+        )
+        EMBEDDING_CACHE.set_model(encoder_name)
+        EMBEDDING_CACHE.load()
+        EMBEDDING_MODEL = model
+
+    # The first encoding is much slower than the others because of tokenizer and
+    # graph initialization, so pay for it here rather than in the first request
+    with STARTUP_REPORT.phase("warmUp"):
+        await get_embedding_worker().encode(WARM_UP_QUERY)
+
+
+async def warm_up_vertexai() -> None:
+    """Initialize Vertex AI."""
+    with STARTUP_REPORT.phase("vertexai"):
+        await asyncio.to_thread(init_vertexai)
+
+
+async def retry_warm_up(*steps: Callable[[], Awaitable[None]]) -> None:
+    """Run warm-up steps in order, retrying each failed step until it succeeds.
+
+    Failures such as ChromaDB not being reachable yet are usually transient, so the
+    failed step is retried with capped exponential backoff rather than leaving the
+    backend unready for the lifetime of the process.
+    """
+    for step in steps:
+        delay = WARM_UP_RETRY_INITIAL_DELAY
+        while True:
+            try:
+                await step()
+            except Exception as exc:
+                STARTUP_REPORT.record_failure(exc, retry_in=delay)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, WARM_UP_RETRY_MAX_DELAY)
+            else:
+                break
+
+
+async def warm_up() -> None:
+    """Load the heavy components of the backend in the background."""
+    await asyncio.gather(
+        retry_warm_up(warm_up_chromadb),
+        retry_warm_up(warm_up_embedding_model, warm_up_vertexai),
+    )
+    STARTUP_REPORT.mark_ready()
 
 
 @asynccontextmanager
-async def lifespan(app: FastAPI):  # pragma: no cover
+async def lifespan(app: FastAPI):
     """Context manager to handle the lifespan of the FastAPI app."""
-    global EMBEDDING_MODEL, CHROMADB_CLIENT
-    EMBEDDING_MODEL = FlagModel("BAAI/bge-small-en-v1.5", use_fp16=True)
-    CHROMADB_CLIENT = chromadb.HttpClient(host=CHROMADB_HOST, port=8000)
-    vertexai.init(project=GCP_PROJECT_ID, location=GCP_PROJECT_LOCATION)
+    global EMBEDDING_MODEL, EMBEDDING_WORKER, CHROMADB_CLIENT
+
+    # The server accepts traffic right away, e.g., /heartbeat answers, while the
+    # components are loaded in the background; /ready tells when they are all warm
+    warm_up_task = asyncio.create_task(warm_up())
 
     yield
 
+    warm_up_task.cancel()
+    with suppress(asyncio.CancelledError):
+        await warm_up_task
+    EMBEDDING_CACHE.save()
+    if EMBEDDING_WORKER is not None:
+        await asyncio.to_thread(EMBEDDING_WORKER.close)
     EMBEDDING_MODEL = None
+    EMBEDDING_WORKER = None
     CHROMADB_CLIENT = None
-    CHAT_SESSIONS.clear()
+    CHAT_SESSIONS.close()
 
 
 # Initialize the FastAPI app
@@ -78,6 +336,13 @@ app = FastAPI(
     redoc_url="/",
 )
 
+# Report the stage timings of each request and capture slow requests
+app.add_middleware(
+    ServerTimingMiddleware,
+    slow_requests=SLOW_REQUEST_LOG,
+    timing_allow_origin=FRONTEND_URL,
+)
+
 # Handle cross-origin requests from the frontend
 if FRONTEND_URL is not None:
     app.add_middleware(
@@ -105,10 +370,9 @@ def custom_openapi():  # pragma: no cover
 
 
 @app.exception_handler(Exception)
-async def custom_exception_handler(
-    request: Request, exc: Exception
-):  # pragma: no cover
+async def custom_exception_handler(request: Request, exc: Exception):
     """Custom handle for all types of exceptions."""
+    ERROR_COUNTER.inc(exc.__class__.__name__)
     response = JSONResponse(
         status_code=500,
         content={"details": format_exc_details(exc)},
@@ -120,80 +384,655 @@ async def custom_exception_handler(
     return response
 
 
+def get_embedding_worker() -> EmbeddingWorker:
+    """Get the embedding worker bound to the current embedding model."""
+    global EMBEDDING_WORKER
+    if EMBEDDING_MODEL is None:
+        raise RuntimeError("Embedding model not initialized")
+
+    # The worker is created lazily and recreated whenever the embedding model is
+    # swapped, so that queries are never encoded by a stale model; the old worker
+    # finishes its pending queries in the background rather than blocking the event
+    # loop until they are done
+    if EMBEDDING_WORKER is None or EMBEDDING_WORKER.model is not EMBEDDING_MODEL:
+        if EMBEDDING_WORKER is not None:
+            threading.Thread(
+                target=EMBEDDING_WORKER.close, name="embedding-worker-close"
+            ).start()
+        EMBEDDING_WORKER = EmbeddingWorker(
+            EMBEDDING_MODEL,
+            max_batch_size=EMBEDDING_MAX_BATCH_SIZE,
+            max_wait_ms=EMBEDDING_MAX_WAIT_MS,
+        )
+    return EMBEDDING_WORKER
+
+
+async def encode_query(embedding_worker: EmbeddingWorker, query: str) -> np.ndarray:
+    """Encode a query, reusing the cached embedding if available."""
+    with time_stage("query_embedding"):
+        query_embedding = EMBEDDING_CACHE.get(query)
+        if query_embedding is None:
+            query_embedding = await embedding_worker.encode(query)
+            EMBEDDING_CACHE.put(query, query_embedding)
+    return query_embedding
+
+
+async def encode_queries(
+    embedding_worker: EmbeddingWorker, queries: Sequence[str]
+) -> np.ndarray:
+    """Encode multiple queries at once, reusing the cached embeddings if available.
+
+    The uncached queries are encoded together, in batches of at most the batch size
+    of the embedding worker. Their
+    embeddings are not cached, so that bulk queries do not evict the embeddings of
+    interactive ones.
+    """
+    with time_stage("query_embedding"):
+        cached = [EMBEDDING_CACHE.get(query) for query in queries]
+        uncached = [i for i, embedding in enumerate(cached) if embedding is None]
+        if len(uncached) > 0:
+            encoded = await embedding_worker.encode_many([queries[i] for i in uncached])
+            for i, embedding in zip(uncached, encoded):
+                cached[i] = embedding
+    return np.stack(cast(list[np.ndarray], cached))
+
+
+def get_collection(name: str = CHROMADB_COLLECTION_NAME) -> chromadb.Collection:
+    """Get a handle of a ChromaDB collection, refreshed if it is old.
+
+    Getting a collection is a round trip to ChromaDB, which is only needed to notice
+    that the collection was rebuilt with a new version stamp. The handle is thus
+    refreshed at most every COLLECTION_CHECK_INTERVAL seconds, so that hits of the
+    caches tagged with the collection version skip ChromaDB altogether in between.
+    """
+    global COLLECTION_HANDLES_CLIENT
+    if CHROMADB_CLIENT is None:
+        raise RuntimeError("ChromaDB not reachable")
+
+    # Handles are bound to the client they were got from
+    if COLLECTION_HANDLES_CLIENT is not CHROMADB_CLIENT:
+        COLLECTION_HANDLES.clear()
+        COLLECTION_HANDLES_CLIENT = CHROMADB_CLIENT
+
+    now = time.monotonic()
+    handle = COLLECTION_HANDLES.get(name)
+    if handle is not None and now - handle[1] < COLLECTION_CHECK_INTERVAL:
+        return handle[0]
+    collection = CHROMADB_CLIENT.get_collection(name)
+    COLLECTION_HANDLES[name] = (collection, now)
+    return collection
+
+
+async def get_local_index() -> LocalVectorIndex:
+    """Get the local vector index, refreshing it if the collection was rebuilt.
+
+    The collection version is checked at most every LOCAL_INDEX_CHECK_INTERVAL
+    seconds, so that queries skip ChromaDB altogether in between. A stale index is
+    replaced off the event loop by the snapshot on disk if it is up to date, or
+    otherwise by a new snapshot of the collection.
+    """
+    global LOCAL_INDEX, LOCAL_INDEX_CHECKED_AT
+    if (
+        LOCAL_INDEX is not None
+        and time.monotonic() - LOCAL_INDEX_CHECKED_AT < LOCAL_INDEX_CHECK_INTERVAL
+    ):
+        return LOCAL_INDEX
+    if CHROMADB_CLIENT is None:
+        raise RuntimeError("ChromaDB not reachable")
+
+    # Concurrent requests wait for the same refresh rather than each snapshotting
+    async with LOCAL_INDEX_LOCK:
+        collection = CHROMADB_CLIENT.get_collection(CHROMADB_COLLECTION_NAME)
+        if LOCAL_INDEX is None or LOCAL_INDEX.version != get_collection_version(
+            collection
+        ):
+            LOCAL_INDEX = await asyncio.to_thread(
+                open_local_index, collection, LOCAL_INDEX_PATH
+            )
+        LOCAL_INDEX_CHECKED_AT = time.monotonic()
+    return LOCAL_INDEX
+
+
+def get_cached_metadata(
+    collection: chromadb.Collection, item_id: str
+) -> TrialMetadataType | None:
+    """Get cleaned metadata from a document ID, reusing the cached one if available."""
+    METADATA_CACHE.set_version(get_collection_version(collection))
+    metadata = METADATA_CACHE.get(item_id)
+    if metadata is None:
+        metadata = get_metadata_from_id(collection, item_id)
+        if metadata is not None:
+            METADATA_CACHE.put(item_id, metadata)
+    return metadata
+
+
+def get_cached_metadatas(
+    collection: chromadb.Collection,
+    item_ids: Sequence[str],
+    fields: Sequence[str] | None = None,
+) -> dict[str, Mapping[str, Any]]:
+    """Get cleaned metadata from document IDs, reusing the cached ones if available.
+
+    Uncached metadata are fetched from ChromaDB all at once. Only the given fields are
+    returned if `fields` is not None. IDs missing from the collection are missing
+    from the returned mapping as well.
+    """
+    METADATA_CACHE.set_version(get_collection_version(collection))
+    metadatas: dict[str, Mapping[str, Any]] = {}
+    fetch_ids = []
+    for item_id in item_ids:
+        cached: Mapping[str, Any] | None = METADATA_CACHE.get(item_id)
+        if cached is None:
+            fetch_ids.append(item_id)
+        elif fields is None:
+            metadatas[item_id] = cached
+        else:
+            metadatas[item_id] = {field: cached[field] for field in fields}
+
+    # Only full metadata is cached; projections are cheap to clean but would take
+    # cache entries from the full metadata needed by the other endpoints
+    fetched = get_metadatas_from_ids(collection, fetch_ids, fields)
+    if fields is None:
+        for item_id, metadata in fetched.items():
+            METADATA_CACHE.put(item_id, cast(TrialMetadataType, metadata))
+    metadatas.update(fetched)
+    return metadatas
+
+
+def get_trial_sections(
+    collection: chromadb.Collection, item_id: str
+) -> dict[str, str] | None:
+    """Get the rendered chat context sections of a trial, reusing the cached ones."""
+    TRIAL_SECTIONS_CACHE.set_version(get_collection_version(collection))
+    sections = TRIAL_SECTIONS_CACHE.get(item_id)
+    if sections is None:
+        metadata = get_cached_metadata(collection, item_id)
+        if metadata is None:
+            return None
+        sections = render_trial_sections(
+            metadata, max_list_items=CHAT_CONTEXT_MAX_LIST_ITEMS
+        )
+        TRIAL_SECTIONS_CACHE.put(item_id, sections)
+    return sections
+
+
+async def select_trial_sections(
+    collection: chromadb.Collection, item_id: str, query: str
+) -> list[str] | None:
+    """Select the sections of a trial most relevant to a chat query.
+
+    The section embeddings are precomputed by the embedding pipeline and cached. None
+    is returned if section-level retrieval is disabled or unavailable, in which case
+    the full trial context should be used.
+    """
+    if CHAT_TOP_SECTIONS <= 0 or EMBEDDING_MODEL is None or CHROMADB_CLIENT is None:
+        return None
+
+    # The sections collection is rebuilt after the main collection and stamped with
+    # the same version once complete, so the cache follows the version of the main
+    # collection; until the sections collection catches up, its sections may be
+    # missing or stale, so they are used but not cached
+    version = get_collection_version(collection)
+    SECTION_VECTORS_CACHE.set_version(version)
+    section_vectors = SECTION_VECTORS_CACHE.get(item_id)
+    if section_vectors is None:
+        # Section-level retrieval is only an optimization, so fall back to the full
+        # context if the sections are unavailable, e.g., the sections collection may
+        # not have been created yet or ChromaDB timed out
+        try:
+            sections_collection = get_collection(CHROMADB_SECTIONS_COLLECTION_NAME)
+            section_vectors = fetch_section_vectors(sections_collection, item_id)
+        except Exception as exc:
+            logger.warning(f"Section vectors unavailable for {item_id}: {exc!r}")
+            return None
+        if get_collection_version(sections_collection) == version:
+            SECTION_VECTORS_CACHE.put(item_id, section_vectors)
+    if len(section_vectors.names) == 0:
+        return None
+
+    query_embedding = await encode_query(get_embedding_worker(), query)
+    return select_sections(section_vectors, query_embedding, CHAT_TOP_SECTIONS)
+
+
+def query_local_index(
+    local_index: LocalVectorIndex,
+    query_embedding: np.ndarray,
+    top_k: int,
+    filters: TrialFilters,
+    fields: Sequence[str] | None = None,
+    include_distances: bool = False,
+) -> APIRetrieveResponseType:
+    """Query the local vector index for the items most similar to the query.
+
+    See `make_retrieve_response` for `fields` and `include_distances`; the index
+    does not hold the metadata, so they are fetched from ChromaDB if requested.
+    """
+    with time_stage("local_index_query"):
+        response = local_index.query(
+            query_embedding, top_k, filters, include_distances=include_distances
+        )
+    if fields is not None:
+        # Items missing from ChromaDB if the snapshot is stale get no metadata
+        assert CHROMADB_CLIENT is not None, "ChromaDB not reachable"
+        collection = get_collection()
+        metadatas = get_cached_metadatas(collection, response["ids"], fields)
+        response["metadatas"] = [metadatas.get(item_id) for item_id in response["ids"]]
+    return response
+
+
+def query_collection(
+    collection: chromadb.Collection,
+    query_embedding: np.ndarray,
+    top_k: int,
+    filters: TrialFilters,
+    fields: Sequence[str] | None = None,
+    include_distances: bool = False,
+) -> APIRetrieveResponseType:
+    """Query the ChromaDB collection for the items most similar to the query.
+
+    See `make_retrieve_response` for `fields` and `include_distances`.
+    """
+    # Construct the filters; all filters are pushed down to ChromaDB if the collection
+    # stores the derived columns for them, otherwise some need post-filtering
+    needs_post_filter, where = construct_filters(
+        filters, pushdown=supports_filter_pushdown(collection)
+    )
+    if not needs_post_filter:
+        # Metadatas are heavy to transfer, so they are only included if requested
+        include = [chromadb.api.types.IncludeEnum("documents")]
+        if fields is not None:
+            include.append(chromadb.api.types.IncludeEnum("metadatas"))
+        if include_distances:
+            include.append(chromadb.api.types.IncludeEnum("distances"))
+        with time_stage("chromadb_query"):
+            results = collection.query(
+                query_embeddings=[query_embedding],
+                n_results=top_k,
+                include=include,
+                where=where,
+            )
+        return make_retrieve_response(
+            results, fields=fields, include_distances=include_distances
+        )
+
+    # Post-filtering drops some of the results, so over-fetch candidates until there
+    # are enough survivors to fill top_k
+    response, report = overfetch_query(
+        collection,
+        query_embedding,
+        top_k,
+        filters,
+        where,
+        SELECTIVITY_TRACKER,
+        max_candidates=OVERFETCH_MAX_CANDIDATES,
+        growth=OVERFETCH_GROWTH,
+        fields=fields,
+        include_distances=include_distances,
+    )
+    logger.info(
+        f"Post-filtered retrieval: {report.rounds} round(s), "
+        f"{report.candidates} candidate(s), {report.survivors} survivor(s)"
+    )
+    return response
+
+
 @app.get("/heartbeat")
 async def heartbeat() -> APIHeartbeatResponseType:
     """Get the current timestamp in nanoseconds."""
     return {"timestamp": time.time_ns()}
 
 
+@app.get("/ready", response_model=StartupReportType)
+async def ready() -> StartupReportType | JSONResponse:
+    """Check if the backend is ready to serve, with the startup report."""
+    report = STARTUP_REPORT.report()
+    if not report["ready"]:
+        return JSONResponse(status_code=503, content=report)
+    return report
+
+
+@app.get("/metrics")
+async def metrics() -> Response:
+    """Get the metrics of the backend in the Prometheus text format."""
+    return Response(content=REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/debug/slow-requests")
+async def debug_slow_requests() -> APISlowRequestsResponseType:
+    """Get the captured slow requests with their stage timings.
+
+    The summary groups them by route and filter shape to tell which combinations of
+    filters cause tail latency.
+    """
+    return {
+        "thresholdMs": SLOW_REQUEST_LOG.threshold_ms,
+        "capacity": SLOW_REQUEST_LOG.capacity,
+        "requests": SLOW_REQUEST_LOG.requests(),
+        "summary": SLOW_REQUEST_LOG.summary(),
+    }
+
+
+@app.get("/stats")
+async def stats() -> APIStatsResponseType:
+    """Get runtime statistics of the backend components."""
+    return {
+        "embedding": EMBEDDING_WORKER.stats() if EMBEDDING_WORKER is not None else None,
+        "embeddingCache": EMBEDDING_CACHE.stats(),
+        "resultCache": RESULT_CACHE.stats(),
+        "metadataCache": METADATA_CACHE.stats(),
+        "metaResponseCache": META_RESPONSE_CACHE.stats(),
+        "trialSectionsCache": TRIAL_SECTIONS_CACHE.stats(),
+        "sectionVectorsCache": SECTION_VECTORS_CACHE.stats(),
+        "answerCache": ANSWER_CACHE.stats(),
+        "overfetch": SELECTIVITY_TRACKER.stats(),
+        "chatSessions": CHAT_SESSIONS.stats(),
+        "chatTiming": CHAT_TIMING_STATS.stats(),
+        "chatPrompt": CHAT_PROMPT_STATS.stats(),
+        "startup": STARTUP_REPORT.report(),
+    }
+
+
 @app.get("/retrieve")
 async def retrieve(
-    query: str, top_k: int, filters_serialized: str
+    query: str,
+    top_k: int,
+    filters_serialized: str,
+    fields: Annotated[list[str] | None, Query()] = None,
+    include_distances: bool = False,
 ) -> APIRetrieveResponseType:
-    """Retrieve items from the ChromaDB collection."""
-    if EMBEDDING_MODEL is None:
-        raise RuntimeError("Embedding model not initialized")
+    """Retrieve items from the ChromaDB collection.
+
+    The metadata of the items are included, projected to the given fields, if
+    `fields` is given, and so are their distances to the query if
+    `include_distances` is True, so that result lists need no follow-up calls.
+    """
+    embedding_worker = get_embedding_worker()
     if CHROMADB_CLIENT is None:
         raise RuntimeError("ChromaDB not reachable")
 
     if top_k <= 0 or top_k > 30:
         raise HTTPException(status_code=404, detail="Required 0 < top_k <= 30")
+    if fields is not None:
+        fields = list(dict.fromkeys(fields))
+        unknown = [field for field in fields if field not in METADATA_FIELD_CLEANERS]
+        if len(unknown) > 0:
+            raise HTTPException(
+                status_code=422, detail=f"Unknown metadata fields: {unknown}"
+            )
 
-    # Construct the filters; we will need to include the full metadata in the query
-    # results if post-filtering is needed, otherwise only documents are needed; TODO:
-    # we should avoid post-processing filters if possible
+    # Embed the query; the query is encoded off the event loop, batched together with
+    # other concurrent queries, unless cached
+    query_embedding = await encode_query(embedding_worker, query)
     filters: TrialFilters = json.loads(filters_serialized)
-    needs_post_filter, where = construct_filters(filters)
-    include = [chromadb.api.types.IncludeEnum("documents")]
-    if needs_post_filter:
-        include.append(chromadb.api.types.IncludeEnum("metadatas"))
 
-    # Embed the query and query the collection
-    query_embedding = EMBEDDING_MODEL.encode(query)
-    collection = CHROMADB_CLIENT.get_collection(CHROMADB_COLLECTION_NAME)
-    results = collection.query(
-        query_embeddings=[query_embedding],
-        n_results=top_k,
-        include=include,
-        where=where,
+    # In local mode, queries are served from the in-process snapshot of the collection
+    # which applies all filters exactly, so ChromaDB is not involved at all unless
+    # metadata are requested
+    local_index: LocalVectorIndex | None = None
+    if RETRIEVAL_BACKEND == "local":
+        local_index = await get_local_index()
+        version = local_index.version
+    else:
+        collection = get_collection()
+        version = get_collection_version(collection)
+
+    # Serve from the result cache if possible; the cache is invalidated as a whole
+    # whenever the collection is rebuilt with a new version stamp
+    RESULT_CACHE.set_version(version)
+    cache_key = (
+        hash_embedding(query_embedding),
+        top_k,
+        canonicalize_filters(filters),
+        tuple(fields) if fields is not None else None,
+        include_distances,
+    )
+    if (cached_response := RESULT_CACHE.get(cache_key)) is not None:
+        return cached_response
+
+    response: APIRetrieveResponseType
+    if local_index is not None:
+        response = query_local_index(
+            local_index,
+            query_embedding,
+            top_k,
+            filters,
+            fields=fields,
+            include_distances=include_distances,
+        )
+    else:
+        response = query_collection(
+            collection,
+            query_embedding,
+            top_k,
+            filters,
+            fields=fields,
+            include_distances=include_distances,
+        )
+
+    RESULT_CACHE.put(cache_key, response)
+    return response
+
+
+async def stream_retrieve_batch(
+    queries: Sequence[APIRetrieveBatchQueryType],
+    query_embeddings: np.ndarray,
+    local_index: LocalVectorIndex | None,
+    collection: chromadb.Collection | None,
+    fields: Sequence[str] | None = None,
+    include_distances: bool = False,
+) -> AsyncIterator[str]:
+    """Retrieve items for multiple queries, streaming the responses as NDJSON.
+
+    Each line carries the index of its query together with either the retrieval
+    response or the details of the error it failed with. Queries sharing the same
+    filters are sent to ChromaDB as a single multi-vector query, and their lines are
+    streamed as soon as the query returns, so they are not in the order of queries.
+    The local index is queried instead of the collection if given.
+    """
+    # Group the queries by their filters, since a multi-vector query can only have a
+    # single where clause
+    groups: dict[str, list[int]] = {}
+    for i, query in enumerate(queries):
+        groups.setdefault(canonicalize_filters(query.filters), []).append(i)
+
+    pushdown = collection is not None and supports_filter_pushdown(collection)
+    for indices in groups.values():
+        filters = queries[indices[0]].filters
+        try:
+            if local_index is not None:
+                responses = [
+                    query_local_index(
+                        local_index,
+                        query_embeddings[i],
+                        queries[i].topK,
+                        filters,
+                        fields=fields,
+                        include_distances=include_distances,
+                    )
+                    for i in indices
+                ]
+            else:
+                assert collection is not None, "Missing collection to query"
+                needs_post_filter, where = construct_filters(filters, pushdown=pushdown)
+                responses = batch_query(
+                    collection,
+                    query_embeddings[indices],
+                    [queries[i].topK for i in indices],
+                    filters,
+                    where,
+                    needs_post_filter,
+                    SELECTIVITY_TRACKER,
+                    max_candidates=OVERFETCH_MAX_CANDIDATES,
+                    growth=OVERFETCH_GROWTH,
+                    fields=fields,
+                    include_distances=include_distances,
+                )
+        except Exception as exc:
+            logger.exception("Failed to retrieve a batch of queries")
+            details = format_exc_details(exc)
+            for i in indices:
+                yield json.dumps({"index": i, "details": details}) + "\n"
+            continue
+
+        for i, response in zip(indices, responses):
+            yield json.dumps({"index": i, **response}) + "\n"
+
+
+@app.post("/retrieve/batch")
+async def retrieve_batch(payload: APIRetrieveBatchPayloadType) -> StreamingResponse:
+    """Retrieve items from the ChromaDB collection for multiple queries.
+
+    All queries are encoded together by the embedding worker before the
+    responses are streamed, see `stream_retrieve_batch`. Bulk queries bypass the
+    result cache.
+    """
+    embedding_worker = get_embedding_worker()
+    if CHROMADB_CLIENT is None:
+        raise RuntimeError("ChromaDB not reachable")
+
+    query_embeddings = await encode_queries(
+        embedding_worker, [query.query for query in payload.queries]
     )
 
-    # Post-filter the results if needed
-    if needs_post_filter:
-        return post_filter(results, filters)
+    # Resolve the backend before streaming, so that failures surface as errors of the
+    # whole request rather than cutting the stream short
+    local_index: LocalVectorIndex | None = None
+    collection: chromadb.Collection | None = None
+    if RETRIEVAL_BACKEND == "local":
+        local_index = await get_local_index()
+    else:
+        collection = get_collection()
 
-    # Retrieve the results as is
-    ids = results["ids"][0]
-    assert results["documents"] is not None, "Missing documents in query results"
-    return {"ids": ids, "documents": results["documents"][0]}
+    return StreamingResponse(
+        stream_retrieve_batch(
+            payload.queries,
+            query_embeddings,
+            local_index,
+            collection,
+            fields=payload.fields,
+            include_distances=payload.includeDistances,
+        ),
+        media_type="application/x-ndjson",
+    )
 
 
-@app.get("/meta/{item_id}")
-async def meta(item_id: str) -> APIMetaResponseType:
+@app.get("/meta/{item_id}", response_model=APIMetaResponseType)
+async def meta(item_id: str) -> APIMetaResponseType | Response:
     """Retrieve metadata for a specific item."""
     if CHROMADB_CLIENT is None:
         raise RuntimeError("ChromaDB not reachable")
 
-    collection = CHROMADB_CLIENT.get_collection(CHROMADB_COLLECTION_NAME)
-    metadata = get_metadata_from_id(collection, item_id)
-    if metadata is None:
-        raise HTTPException(status_code=404, detail="Trial metadata not found")
+    collection = get_collection()
+    if not METADATA_CACHE_SERIALIZED:
+        metadata = get_cached_metadata(collection, item_id)
+        if metadata is None:
+            raise HTTPException(status_code=404, detail="Trial metadata not found")
+        return {"metadata": metadata}
 
-    return {"metadata": metadata}
+    # Serve the pre-serialized response if available so that hot trials skip not
+    # only ChromaDB and metadata cleaning but also response validation and encoding
+    META_RESPONSE_CACHE.set_version(get_collection_version(collection))
+    content = META_RESPONSE_CACHE.get(item_id)
+    if content is None:
+        metadata = get_cached_metadata(collection, item_id)
+        if metadata is None:
+            raise HTTPException(status_code=404, detail="Trial metadata not found")
+        content = bytes(JSONResponse(content={"metadata": metadata}).body)
+        META_RESPONSE_CACHE.put(item_id, content)
+    return Response(content=content, media_type="application/json")
 
 
-@app.post("/chat/{model}/{item_id}")
-async def chat(
-    model: ModelType, item_id: str, payload: APIChatPayloadType
-) -> APIChatResponseType:
-    """Chat with a generative model about a specific item."""
+@app.post("/meta", response_model=APIMetaBatchResponseType)
+async def meta_batch(payload: APIMetaBatchPayloadType) -> APIMetaBatchResponseType:
+    """Retrieve metadata for a batch of items, optionally projected to some fields.
+
+    Items missing from the collection are listed as missing instead of failing the
+    whole batch.
+    """
     if CHROMADB_CLIENT is None:
         raise RuntimeError("ChromaDB not reachable")
 
-    collection = CHROMADB_CLIENT.get_collection(CHROMADB_COLLECTION_NAME)
-    metadata = get_metadata_from_id(collection, item_id)
-    if metadata is None:
+    collection = get_collection()
+    item_ids = list(dict.fromkeys(payload.ids))
+    metadatas = get_cached_metadatas(collection, item_ids, payload.fields)
+    return {
+        "metadatas": {
+            item_id: metadatas[item_id] for item_id in item_ids if item_id in metadatas
+        },
+        "missing": [item_id for item_id in item_ids if item_id not in metadatas],
+    }
+
+
+async def get_cached_answer(
+    model: ModelType, item_id: str, query: str
+) -> tuple[str | None, np.ndarray | None]:
+    """Look up the cached answer to a first-turn question about a specific item.
+
+    The cached answer is returned if any, together with the query embedding for
+    caching a new answer otherwise. The embedding is None if semantic lookups are
+    disabled or the embedding model is not initialized, in which case only exact
+    matches are looked up.
+    """
+    if CHROMADB_CLIENT is None:
+        raise RuntimeError("ChromaDB not reachable")
+
+    # Answers are derived from the trial metadata, so the cache follows the version
+    # of the collection like the other caches
+    collection = get_collection()
+    ANSWER_CACHE.set_version(get_collection_version(collection))
+    query_embedding = None
+    if ANSWER_CACHE.threshold is not None and EMBEDDING_MODEL is not None:
+        query_embedding = await encode_query(get_embedding_worker(), query)
+    return ANSWER_CACHE.get(model, item_id, query, query_embedding), query_embedding
+
+
+async def save_cached_turn(session_key: str, query: str, answer: str) -> None:
+    """Save a first turn answered from the answer cache as the session history."""
+    from vertexai.generative_models import Content, Part  # type: ignore
+
+    await CHAT_SESSIONS.asave(
+        session_key,
+        [
+            Content(role="user", parts=[Part.from_text(query)]),
+            Content(role="model", parts=[Part.from_text(answer)]),
+        ],
+    )
+
+
+async def get_chat_session(
+    model: ModelType,
+    item_id: str,
+    session_key: str,
+    history: list["Content"] | None,
+    query: str,
+) -> "ChatSession":
+    """Get the chat session about a specific item for a new query.
+
+    The chat session is rebuilt on each turn from the history loaded from the session
+    store, so that any backend worker sharing the store can serve the next turn. The
+    system instruction only includes the trial sections relevant to the query, and
+    the history is truncated so that the prompt with the query fits the token budget.
+    """
+    from vertexai.generative_models import (  # type: ignore
+        ChatSession,
+        GenerativeModel,
+    )
+
+    if CHROMADB_CLIENT is None:
+        raise RuntimeError("ChromaDB not reachable")
+
+    collection = get_collection()
+    sections = get_trial_sections(collection, item_id)
+    if sections is None:
         raise HTTPException(status_code=404, detail="Trial metadata not found")
+    selected = await select_trial_sections(collection, item_id, query)
+    # Only the selected sections are ever cut, if a cap is configured at all; the full
+    # context fallback must not silently lose, e.g., eligibility criteria
+    context = assemble_trial_context(
+        sections,
+        selected=selected,
+        max_section_chars=CHAT_SECTION_MAX_CHARS if selected is not None else None,
+    )
 
     # Determine the model to use
     if model not in ("gemini-1.5-flash-001",):
@@ -204,41 +1043,137 @@ async def chat(
     else:
         model_name = model
 
-    # Initialize or retrieve the chat session
-    session_key = f"{model}-{item_id}"
-    if session_key not in CHAT_SESSIONS:
-        system_instruction = (
-            "You are assisting with a specific clinical trial. You will be given some "
-            "information of the clinical trial and asked several questions. Here is "
-            "the information of the clinical trial:\n\n"
-            f"{json.dumps(metadata, indent=2)}"
+    if history is None:
+        history = []
+        logger.info(f"Created new chat session: {session_key}")
+
+    system_instruction = (
+        "You are assisting with a specific clinical trial. You will be given some "
+        "information of the clinical trial and asked several questions. Here is "
+        f"the information of the clinical trial:\n\n{context}"
+    )
+    fitted = HISTORY_MANAGER.fit(history, system_instruction, query)
+    CHAT_PROMPT_STATS.record(fitted)
+    logger.info(
+        f"Chat prompt of {session_key}: ~{fitted.prompt_tokens} tokens, "
+        f"{fitted.folded_turns} turn(s) folded into summary, "
+        f"sections {selected if selected is not None else 'all'}"
+    )
+
+    gen_model = GenerativeModel(
+        model_name=model_name,
+        generation_config={
+            "max_output_tokens": 2048,
+            "temperature": 0.75,
+            "top_p": 0.95,
+        },
+        system_instruction=system_instruction,
+    )
+    return ChatSession(model=gen_model, history=fitted.history)
+
+
+@app.post("/chat/{model}/{item_id}")
+async def chat(
+    model: ModelType, item_id: str, payload: APIChatPayloadType
+) -> APIChatResponseType:
+    """Chat with a generative model about a specific item.
+
+    The session ID in the payload identifies the chat session of the client; a new
+    one is generated if not given, and either way it is returned in the response.
+    First-turn questions are answered from the answer cache if possible.
+    """
+    # Sessions are per client so that clients chatting about the same item do not
+    # share their histories
+    session_id = payload.sessionId or uuid.uuid4().hex
+    session_key = f"{session_id}:{model}:{item_id}"
+    history = await CHAT_SESSIONS.aload(session_key)
+
+    # Only first turns are cached since later answers depend on the conversation
+    query_embedding = None
+    if not history:
+        answer, query_embedding = await get_cached_answer(model, item_id, payload.query)
+        if answer is not None:
+            await save_cached_turn(session_key, payload.query, answer)
+            return {"response": answer, "sessionId": session_id}
+
+    with time_stage("chat_session"):
+        chat_session = await get_chat_session(
+            model, item_id, session_key, history, payload.query
         )
 
-        # Create a new chat session
-        gen_model = GenerativeModel(
-            model_name=model_name,
-            generation_config={
-                "max_output_tokens": 2048,
-                "temperature": 0.75,
-                "top_p": 0.95,
-            },
-            system_instruction=system_instruction,
+    # Generate the response; the generation is awaited so that other requests are
+    # served in the meantime, and the chat session adds the query and the response to
+    # its history once it succeeds
+    try:
+        response_text = await generate_chat_response(
+            chat_session,
+            payload.query,
+            CHAT_TIMING_STATS,
+            CHAT_SEMAPHORE,
+            timeout=CHAT_TIMEOUT,
         )
-        chat_session = ChatSession(model=gen_model, history=[])
-        CHAT_SESSIONS[session_key] = chat_session
-        logger.info(f"Created new chat session: {session_key}")
-    else:
-        chat_session = CHAT_SESSIONS[session_key]
+    except TimeoutError:
+        raise HTTPException(
+            status_code=504, detail=f"Chat response timed out after {CHAT_TIMEOUT}s"
+        )
+    await CHAT_SESSIONS.asave(session_key, chat_session.history)
+    if not history and response_text:
+        ANSWER_CACHE.put(model, item_id, payload.query, response_text, query_embedding)
 
-    # Add the user's query to the chat session
-    user_message = Content(role="user", parts=[Part.from_text(payload.query)])
-    chat_session.history.append(user_message)
+    return {"response": response_text, "sessionId": session_id}
 
-    # Generate the response and add to the chat session
-    response = chat_session.send_message(payload.query)
-    response_text = response.text.strip()
-    chat_session.history.append(
-        Content(role="model", parts=[Part.from_text(response_text)])
-    )
 
-    return {"response": response_text}
+@app.post("/chat/{model}/{item_id}/stream")
+async def chat_stream(
+    model: ModelType, item_id: str, payload: APIChatPayloadType
+) -> StreamingResponse:
+    """Chat with a generative model about a specific item, streaming the response.
+
+    The response is a stream of Server-Sent Events: data events carry chunks of the
+    generated text, and the stream ends with either a "done" event carrying the full
+    response and the session ID or an "error" event carrying the error details.
+    First-turn questions are answered from the answer cache if possible.
+    """
+    session_id = payload.sessionId or uuid.uuid4().hex
+    session_key = f"{session_id}:{model}:{item_id}"
+    history = await CHAT_SESSIONS.aload(session_key)
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+    query_embedding = None
+    if not history:
+        answer, query_embedding = await get_cached_answer(model, item_id, payload.query)
+        if answer is not None:
+            await save_cached_turn(session_key, payload.query, answer)
+            return StreamingResponse(
+                stream_cached_response(answer, session_id=session_id),
+                media_type="text/event-stream",
+                headers=headers,
+            )
+
+    with time_stage("chat_session"):
+        chat_session = await get_chat_session(
+            model, item_id, session_key, history, payload.query
+        )
+
+    async def _on_done(response_text: str) -> None:
+        await CHAT_SESSIONS.asave(session_key, chat_session.history)
+        if not history and response_text:
+            ANSWER_CACHE.put(
+                model, item_id, payload.query, response_text, query_embedding
+            )
+
+    # Relay the response as it is generated; the query and the full response are
+    # added to the chat session once the generation finishes
+    return StreamingResponse(
+        stream_chat_response(
+            chat_session,
+            payload.query,
+            CHAT_TIMING_STATS,
+            CHAT_SEMAPHORE,
+            timeout=CHAT_TIMEOUT,
+            session_id=session_id,
+            on_done=_on_done,
+        ),
+        media_type="text/event-stream",
+        headers=headers,
+    )
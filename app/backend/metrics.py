@@ -0,0 +1,260 @@
+"""Prometheus-style metrics for the backend APIs."""
+
+import math
+import time
+from bisect import bisect_left
+from collections.abc import Callable, Iterator, Sequence
+from contextvars import ContextVar
+
+# Stages range from sub-millisecond post-filtering and metadata cleaning to model
+# generations of up to a minute
+STAGE_BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+
+def _format_labels(labelnames: Sequence[str], labelvalues: Sequence[str]) -> str:
+    """Format the labels of a sample in the Prometheus text format."""
+    if len(labelnames) == 0:
+        return ""
+    pairs = []
+    for name, value in zip(labelnames, labelvalues):
+        escaped = value.replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+        pairs.append(f'{name}="{escaped}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    """Format the value of a sample in the Prometheus text format."""
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class Counter:
+    """Monotonically increasing counter, optionally labeled."""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, *labelvalues: str, amount: float = 1) -> None:
+        """Increment the counter of the given label values."""
+        if len(labelvalues) != len(self.labelnames):
+            raise ValueError(f"Required label values for {self.labelnames}")
+        self._values[labelvalues] = self._values.get(labelvalues, 0.0) + amount
+
+    def get(self, *labelvalues: str) -> float:
+        """Get the counter of the given label values."""
+        return self._values.get(labelvalues, 0.0)
+
+    def render(self) -> Iterator[str]:
+        """Render the counter in the Prometheus text format."""
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} counter"
+        for labelvalues, value in sorted(self._values.items()):
+            labels = _format_labels(self.labelnames, labelvalues)
+            yield f"{self.name}{labels} {_format_value(value)}"
+
+
+class Gauge:
+    """Gauge whose value is read from a callback when rendered."""
+
+    def __init__(self, name: str, documentation: str, func: Callable[[], float]):
+        self.name = name
+        self.documentation = documentation
+        self.func = func
+
+    def render(self) -> Iterator[str]:
+        """Render the gauge in the Prometheus text format."""
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} gauge"
+        yield f"{self.name} {_format_value(self.func())}"
+
+
+class Histogram:
+    """Histogram of observed values, optionally labeled.
+
+    Observations only bisect the bucket bounds and bump a few numbers, so they are
+    cheap enough to be made several times per request. They are not synchronized,
+    so they should all be made from the event loop thread.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = STAGE_BUCKETS,
+    ):
+        if list(buckets) != sorted(buckets) or len(set(buckets)) != len(buckets):
+            raise ValueError("Required strictly increasing buckets")
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(float(bound) for bound in buckets)
+
+        # Per label values: counts of each bucket (non-cumulative, with the last one
+        # for +Inf), and the sum of the observed values
+        self._counts: dict[tuple[str, ...], list[int]] = {}
+        self._sums: dict[tuple[str, ...], float] = {}
+
+    def observe(self, value: float, *labelvalues: str) -> None:
+        """Observe a value for the given label values."""
+        self._observe(value, labelvalues)
+
+    def _observe(self, value: float, labelvalues: tuple[str, ...]) -> None:
+        counts = self._counts.get(labelvalues)
+        if counts is None:
+            if len(labelvalues) != len(self.labelnames):
+                raise ValueError(f"Required label values for {self.labelnames}")
+            counts = self._counts[labelvalues] = [0] * (len(self.buckets) + 1)
+            self._sums[labelvalues] = 0.0
+        counts[bisect_left(self.buckets, value)] += 1
+        self._sums[labelvalues] += value
+
+    def time(self, *labelvalues: str) -> "_Timer":
+        """Time a block of code in seconds and observe it for the label values."""
+        return _Timer(self, labelvalues)
+
+    def get_count(self, *labelvalues: str) -> int:
+        """Get the number of observations for the given label values."""
+        return sum(self._counts.get(labelvalues, []))
+
+    def get_sum(self, *labelvalues: str) -> float:
+        """Get the sum of the observed values for the given label values."""
+        return self._sums.get(labelvalues, 0.0)
+
+    def render(self) -> Iterator[str]:
+        """Render the histogram in the Prometheus text format."""
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        for labelvalues, counts in sorted(self._counts.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, math.inf), counts):
+                cumulative += count
+                labels = _format_labels(
+                    (*self.labelnames, "le"), (*labelvalues, _format_value(bound))
+                )
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, labelvalues)
+            yield f"{self.name}_sum{labels} {_format_value(self._sums[labelvalues])}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class _Timer:
+    """Context manager timing a block of code into a histogram."""
+
+    __slots__ = ("_histogram", "_labelvalues", "_started_at")
+
+    def __init__(self, histogram: Histogram, labelvalues: tuple[str, ...]):
+        self._histogram = histogram
+        self._labelvalues = labelvalues
+
+    def __enter__(self) -> None:
+        self._started_at = time.perf_counter()
+
+    def __exit__(self, *exc_info: object) -> None:
+        elapsed = time.perf_counter() - self._started_at
+        self._histogram._observe(elapsed, self._labelvalues)
+
+
+class MetricsRegistry:
+    """Registry of metrics rendered together in the Prometheus text format."""
+
+    def __init__(self) -> None:
+        self._metrics: dict[str, Counter | Gauge | Histogram] = {}
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Duplicate metric: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(
+        self, name: str, documentation: str, labelnames: Sequence[str] = ()
+    ) -> Counter:
+        """Register a counter."""
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, func: Callable[[], float]) -> Gauge:
+        """Register a gauge read from a callback."""
+        return self._register(Gauge(name, documentation, func))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = STAGE_BUCKETS,
+    ) -> Histogram:
+        """Register a histogram."""
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """Render all metrics in the Prometheus text format."""
+        lines = [line for metric in self._metrics.values() for line in metric.render()]
+        return "\n".join(lines) + "\n"
+
+
+# The metrics shared by the backend modules
+REGISTRY = MetricsRegistry()
+STAGE_DURATION = REGISTRY.histogram(
+    "veritastrial_stage_duration_seconds",
+    "Time spent in each stage of serving requests.",
+    labelnames=("stage",),
+)
+
+
+# Durations of the stages of the request being served, summed by stage; it is set by
+# the middleware serving the request and None outside of requests
+REQUEST_STAGES: ContextVar[dict[str, float] | None] = ContextVar(
+    "request_stages", default=None
+)
+
+
+def record_stage(stage: str, elapsed: float) -> None:
+    """Record the duration of a stage of serving requests in seconds."""
+    STAGE_DURATION._observe(elapsed, (stage,))
+    stages = REQUEST_STAGES.get()
+    if stages is not None:
+        stages[stage] = stages.get(stage, 0.0) + elapsed
+
+
+class _StageTimer:
+    """Context manager timing a stage of serving requests."""
+
+    __slots__ = ("_stage", "_started_at")
+
+    def __init__(self, stage: str):
+        self._stage = stage
+
+    def __enter__(self) -> None:
+        self._started_at = time.perf_counter()
+
+    def __exit__(self, *exc_info: object) -> None:
+        record_stage(self._stage, time.perf_counter() - self._started_at)
+
+
+def time_stage(stage: str) -> _StageTimer:
+    """Time a stage of serving requests, see `record_stage`."""
+    return _StageTimer(stage)
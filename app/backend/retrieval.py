@@ -0,0 +1,300 @@
+"""Retrieval strategies for the backend APIs."""
+
+import math
+from collections.abc import Sequence
+from typing import NamedTuple, cast
+
+import chromadb
+import chromadb.api
+import numpy as np
+
+from localtyping import APIRetrieveResponseType, OverfetchStatsType, TrialFilters
+from metrics import time_stage
+from utils import canonicalize_filters, make_retrieve_response, post_filter_indices
+
+
+class OverfetchReport(NamedTuple):
+    rounds: int
+    candidates: int
+    survivors: int
+
+
+class SelectivityTracker:
+    """Track the observed selectivity of post-filters.
+
+    The selectivity of a filter is the fraction of candidates that survive
+    post-filtering. It is tracked per canonical filter as an exponential moving
+    average, so that later requests with the same filter can start over-fetching
+    from a good multiplier.
+    """
+
+    def __init__(
+        self,
+        initial_selectivity: float = 0.5,
+        min_selectivity: float = 0.01,
+        smoothing: float = 0.5,
+        max_filters: int = 1024,
+    ):
+        if not 0 < min_selectivity <= initial_selectivity <= 1:
+            raise ValueError("Required 0 < min_selectivity <= initial_selectivity <= 1")
+        if not 0 < smoothing <= 1:
+            raise ValueError("Required 0 < smoothing <= 1")
+
+        self.initial_selectivity = initial_selectivity
+        self.min_selectivity = min_selectivity
+        self.smoothing = smoothing
+        self.max_filters = max_filters
+        self._selectivities: dict[str, float] = {}
+
+        # Statistics
+        self._num_requests = 0
+        self._num_rounds = 0
+        self._num_candidates = 0
+        self._max_rounds = 0
+        self._num_short = 0
+
+    def estimate(self, key: str) -> float:
+        """Get the estimated selectivity of a filter."""
+        return self._selectivities.get(key, self.initial_selectivity)
+
+    def record(self, key: str, candidates: int, survivors: int) -> None:
+        """Record the observed selectivity of a filter."""
+        if candidates == 0:
+            return
+        observed = max(survivors / candidates, self.min_selectivity)
+        if key in self._selectivities:
+            previous = self._selectivities.pop(key)
+            observed = self.smoothing * observed + (1 - self.smoothing) * previous
+        elif len(self._selectivities) >= self.max_filters:
+            # Dictionaries preserve insertion order and recorded keys are reinserted,
+            # so the first key is the least recently recorded one
+            del self._selectivities[next(iter(self._selectivities))]
+        self._selectivities[key] = observed
+
+    def record_report(self, report: OverfetchReport, top_k: int) -> None:
+        """Record the statistics of an over-fetching request."""
+        self._num_requests += 1
+        self._num_rounds += report.rounds
+        self._num_candidates += report.candidates
+        self._max_rounds = max(self._max_rounds, report.rounds)
+        if report.survivors < top_k:
+            self._num_short += 1
+
+    def stats(self) -> OverfetchStatsType:
+        """Get the statistics of over-fetching requests."""
+        num_requests = self._num_requests
+        return {
+            "numRequests": num_requests,
+            "meanRounds": self._num_rounds / num_requests if num_requests > 0 else 0,
+            "maxRounds": self._max_rounds,
+            "meanCandidates": (
+                self._num_candidates / num_requests if num_requests > 0 else 0
+            ),
+            "numShort": self._num_short,
+            "trackedFilters": len(self._selectivities),
+        }
+
+
+def overfetch_query(
+    collection: chromadb.Collection,
+    query_embedding: np.ndarray,
+    top_k: int,
+    filters: TrialFilters,
+    where: chromadb.Where | None,
+    tracker: SelectivityTracker,
+    max_candidates: int = 300,
+    growth: float = 2,
+    fields: Sequence[str] | None = None,
+    include_distances: bool = False,
+) -> tuple[APIRetrieveResponseType, OverfetchReport]:
+    """Query the collection with post-filtering, over-fetching to fill top_k.
+
+    The number of candidates starts from `top_k` divided by the estimated
+    selectivity of the filters and grows geometrically by `growth` until `top_k`
+    candidates survive post-filtering, the collection is exhausted, or
+    `max_candidates` is reached. The observed selectivity is recorded in the
+    tracker so that later requests start from a good multiplier. See
+    `make_retrieve_response` for `fields` and `include_distances`.
+    """
+    if growth <= 1:
+        raise ValueError("Required growth > 1")
+
+    key = canonicalize_filters(filters)
+    max_candidates = max(max_candidates, top_k)
+    n_results = min(math.ceil(top_k / tracker.estimate(key)), max_candidates)
+    include = [
+        chromadb.api.types.IncludeEnum("documents"),
+        chromadb.api.types.IncludeEnum("metadatas"),
+    ]
+    if include_distances:
+        include.append(chromadb.api.types.IncludeEnum("distances"))
+
+    rounds = 0
+    while True:
+        rounds += 1
+        # NOTE: ChromaDB queries do not support offsets, so each round fetches all
+        # candidates from scratch; since the number of candidates grows geometrically
+        # the total work is still bounded by a constant factor of the last round
+        with time_stage("chromadb_query"):
+            results = collection.query(
+                query_embeddings=[query_embedding],
+                n_results=n_results,
+                include=include,
+                where=where,
+            )
+        with time_stage("post_filter"):
+            indices = post_filter_indices(results, filters)
+        n_returned = len(results["ids"][0])
+        survivors = n_returned if indices is None else len(indices)
+        if survivors >= top_k or n_returned < n_results or n_results >= max_candidates:
+            break
+        n_results = min(math.ceil(n_results * growth), max_candidates)
+
+    tracker.record(key, n_returned, survivors)
+    report = OverfetchReport(rounds=rounds, candidates=n_returned, survivors=survivors)
+    tracker.record_report(report, top_k)
+
+    # Only the final survivors within top_k are cleaned into the response
+    if indices is None:
+        indices = np.arange(n_returned)
+    response = make_retrieve_response(
+        results, indices[:top_k], fields=fields, include_distances=include_distances
+    )
+    return response, report
+
+
+def _select_query(results: chromadb.QueryResult, i: int) -> chromadb.QueryResult:
+    """Select the results of the i-th query of a multi-vector query."""
+    selected = {
+        key: [results[key][i]] if results[key] is not None else None  # type: ignore
+        for key in ("ids", "documents", "metadatas", "distances")
+        if key in results
+    }
+    return cast(chromadb.QueryResult, selected)
+
+
+def batch_query(
+    collection: chromadb.Collection,
+    query_embeddings: np.ndarray,
+    top_ks: Sequence[int],
+    filters: TrialFilters,
+    where: chromadb.Where | None,
+    needs_post_filter: bool,
+    tracker: SelectivityTracker,
+    max_candidates: int = 300,
+    growth: float = 2,
+    fields: Sequence[str] | None = None,
+    include_distances: bool = False,
+) -> list[APIRetrieveResponseType]:
+    """Query the collection for multiple queries sharing the same filters at once.
+
+    The queries are issued as a single multi-vector query for the largest of their
+    `top_ks`. If post-filtering is needed, the candidates are over-fetched by the
+    estimated selectivity of the filters; the queries that are still short of
+    survivors although more candidates are available are over-fetched further one
+    by one, see `overfetch_query`. See `make_retrieve_response` for `fields` and
+    `include_distances`.
+    """
+    max_top_k = max(top_ks)
+    key = canonicalize_filters(filters)
+    max_candidates = max(max_candidates, max_top_k)
+    include = [chromadb.api.types.IncludeEnum("documents")]
+    if needs_post_filter:
+        n_results = min(math.ceil(max_top_k / tracker.estimate(key)), max_candidates)
+        include.append(chromadb.api.types.IncludeEnum("metadatas"))
+    else:
+        n_results = max_top_k
+        if fields is not None:
+            include.append(chromadb.api.types.IncludeEnum("metadatas"))
+    if include_distances:
+        include.append(chromadb.api.types.IncludeEnum("distances"))
+
+    with time_stage("chromadb_query"):
+        results = collection.query(
+            query_embeddings=list(query_embeddings),
+            n_results=n_results,
+            include=include,
+            where=where,
+        )
+
+    responses = []
+    for i, top_k in enumerate(top_ks):
+        query_results = _select_query(results, i)
+        n_returned = len(query_results["ids"][0])
+        if not needs_post_filter:
+            indices = range(min(top_k, n_returned))
+            responses.append(
+                make_retrieve_response(
+                    query_results, indices, fields, include_distances
+                )
+            )
+            continue
+
+        with time_stage("post_filter"):
+            survivor_indices = post_filter_indices(query_results, filters)
+        survivors = n_returned if survivor_indices is None else len(survivor_indices)
+        if survivors < top_k and n_returned == n_results < max_candidates:
+            response, _ = overfetch_query(
+                collection,
+                query_embeddings[i],
+                top_k,
+                filters,
+                where,
+                tracker,
+                max_candidates=max_candidates,
+                growth=growth,
+                fields=fields,
+                include_distances=include_distances,
+            )
+            responses.append(response)
+            continue
+
+        tracker.record(key, n_returned, survivors)
+        report = OverfetchReport(rounds=1, candidates=n_returned, survivors=survivors)
+        tracker.record_report(report, top_k)
+        if survivor_indices is None:
+            survivor_indices = np.arange(n_returned)
+        responses.append(
+            make_retrieve_response(
+                query_results, survivor_indices[:top_k], fields, include_distances
+            )
+        )
+    return responses
+
+
+class SectionVectors(NamedTuple):
+    names: list[str]
+    vectors: np.ndarray
+
+
+def fetch_section_vectors(
+    collection: chromadb.Collection, item_id: str
+) -> SectionVectors:
+    """Fetch the normalized embeddings of the sections of a trial.
+
+    Sections are stored in their own collection with IDs of the form
+    "{item_id}:{section}" by the embedding pipeline.
+    """
+    results = collection.get(
+        where={"trial_id": item_id},
+        include=[chromadb.api.types.IncludeEnum("embeddings")],
+    )
+    assert results["embeddings"] is not None, "Missing embeddings in get results"
+    names = [section_id.split(":", 1)[1] for section_id in results["ids"]]
+    if len(names) == 0:
+        return SectionVectors([], np.empty((0, 0), dtype=np.float32))
+
+    vectors = np.asarray(results["embeddings"], dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return SectionVectors(names, vectors / np.maximum(norms, 1e-12))
+
+
+def select_sections(
+    section_vectors: SectionVectors, query_embedding: np.ndarray, top_k: int
+) -> list[str]:
+    """Select the names of the `top_k` sections most similar to the query."""
+    if len(section_vectors.names) == 0:
+        return []
+    scores = section_vectors.vectors @ np.asarray(query_embedding, dtype=np.float32)
+    top_indices = np.argsort(-scores, kind="stable")[:top_k]
+    return [section_vectors.names[i] for i in top_indices]
@@ -0,0 +1,317 @@
+"""Chat session stores for the backend APIs."""
+
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+import zlib
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from cache import LRUCache
+from localtyping import ChatSessionStoreStatsType
+
+if TYPE_CHECKING:
+    from vertexai.generative_models import Content  # type: ignore
+
+logger = logging.getLogger("uvicorn.error")
+
+
+def serialize_history(history: list["Content"]) -> bytes:
+    """Serialize a chat history compactly.
+
+    Each turn is encoded as a [role, text] pair of a JSON array which is then
+    compressed. Only text parts are kept since chats never carry other parts.
+    """
+    turns = [
+        [content.role, "".join(part.text for part in content.parts)]
+        for content in history
+    ]
+    data = json.dumps(turns, ensure_ascii=False, separators=(",", ":"))
+    return zlib.compress(data.encode("utf-8"), level=1)
+
+
+def deserialize_history(data: bytes) -> list["Content"]:
+    """Deserialize a chat history serialized by `serialize_history`."""
+    from vertexai.generative_models import Content, Part  # type: ignore
+
+    turns = json.loads(zlib.decompress(data).decode("utf-8"))
+    return [Content(role=role, parts=[Part.from_text(text)]) for role, text in turns]
+
+
+class ChatSessionStore(ABC):
+    """Store of chat session histories keyed by session key.
+
+    Stores hold serialized histories rather than live chat sessions, so that the
+    history of a session can be shared by all backend workers that use the same
+    store; chat sessions are rebuilt from the history on each turn. Sessions are
+    bounded by `max_sessions`, evicted once idle for more than `idle_ttl` seconds,
+    and the total size of the serialized histories is kept within `max_bytes`.
+
+    Stores that block on I/O set `blocking`, in which case `aload` and `asave` run
+    in a thread so that the event loop is never blocked.
+    """
+
+    blocking = False
+
+    def __init__(
+        self,
+        max_sessions: int = 1000,
+        idle_ttl: float | None = 3600,
+        max_bytes: int | None = None,
+        sweep_interval: float = 30,
+    ):
+        if max_sessions <= 0:
+            raise ValueError("Required max_sessions > 0")
+
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl if idle_ttl is not None and idle_ttl > 0 else None
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+        self._last_sweep = time.monotonic()
+        self._num_created = 0
+
+    def load(self, key: str) -> list["Content"] | None:
+        """Load the history of a session, or None if it does not exist or expired."""
+        self._maybe_sweep()
+        data = self._get(key)
+        return deserialize_history(data) if data is not None else None
+
+    def save(self, key: str, history: list["Content"]) -> None:
+        """Save the history of a session, creating the session if needed."""
+        if self._put(key, serialize_history(history)):
+            self._num_created += 1
+
+    async def aload(self, key: str) -> list["Content"] | None:
+        """Load the history of a session without blocking the event loop."""
+        if self.blocking:
+            return await asyncio.to_thread(self.load, key)
+        return self.load(key)
+
+    async def asave(self, key: str, history: list["Content"]) -> None:
+        """Save the history of a session without blocking the event loop."""
+        if self.blocking:
+            await asyncio.to_thread(self.save, key, history)
+        else:
+            self.save(key, history)
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        """Delete a session if it exists."""
+
+    @abstractmethod
+    def clear(self) -> None:
+        """Delete all sessions."""
+
+    def close(self) -> None:
+        """Release the resources held by the store."""
+
+    @abstractmethod
+    def stats(self) -> ChatSessionStoreStatsType:
+        """Get the statistics of the store."""
+
+    @abstractmethod
+    def _get(self, key: str) -> bytes | None:
+        """Get the serialized history of a session if it exists and is not idle."""
+
+    @abstractmethod
+    def _put(self, key: str, data: bytes) -> bool:
+        """Put the serialized history of a session and return whether it is new."""
+
+    @abstractmethod
+    def _sweep(self) -> None:
+        """Evict idle sessions and sessions over the limits."""
+
+    def _maybe_sweep(self) -> None:
+        """Sweep the store if the last sweep was long enough ago."""
+        now = time.monotonic()
+        if now - self._last_sweep >= self.sweep_interval:
+            self._sweep()
+            self._last_sweep = now
+
+
+class InMemoryChatSessionStore(ChatSessionStore):
+    """Chat session store in process memory.
+
+    Sessions are kept in an LRU cache, so the limits are enforced on every save.
+    This store is not shared across backend workers.
+    """
+
+    def __init__(
+        self,
+        max_sessions: int = 1000,
+        idle_ttl: float | None = 3600,
+        max_bytes: int | None = None,
+        sweep_interval: float = 30,
+    ):
+        super().__init__(max_sessions, idle_ttl, max_bytes, sweep_interval)
+        self._cache: LRUCache[str, bytes] = LRUCache(
+            max_sessions,
+            ttl=idle_ttl,
+            max_weight=max_bytes,
+            weigh=len,
+            on_evict=lambda key, _: logger.info(f"Evicted chat session: {key}"),
+        )
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    def delete(self, key: str) -> None:
+        self._cache.pop(key)
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+    def stats(self) -> ChatSessionStoreStatsType:
+        return {
+            "sessions": len(self._cache),
+            "maxSessions": self.max_sessions,
+            "created": self._num_created,
+            "evictions": self._cache.evictions,
+            "estimatedBytes": self._cache.weight,
+            "maxBytes": self.max_bytes,
+        }
+
+    def _get(self, key: str) -> bytes | None:
+        return self._cache.get(key)
+
+    def _put(self, key: str, data: bytes) -> bool:
+        is_new = key not in self._cache
+        self._cache.put(key, data)
+        return is_new
+
+    def _sweep(self) -> None:
+        self._cache.expire()
+
+
+class SqliteChatSessionStore(ChatSessionStore):
+    """Chat session store in a SQLite database in WAL mode.
+
+    All backend workers on the same host can share sessions by pointing to the same
+    database file; WAL mode lets readers proceed concurrently with the writer. The
+    limits are enforced at each sweep, so the store may briefly exceed them. The
+    counts of created sessions and evictions are per process. Writers may wait up
+    to seconds for the lock of the database, so the store is blocking.
+    """
+
+    blocking = True
+
+    def __init__(
+        self,
+        path: str | Path,
+        max_sessions: int = 1000,
+        idle_ttl: float | None = 3600,
+        max_bytes: int | None = None,
+        sweep_interval: float = 30,
+    ):
+        super().__init__(max_sessions, idle_ttl, max_bytes, sweep_interval)
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._num_evictions = 0
+
+        # The connection is shared by the threads that `aload` and `asave` run in,
+        # so it is guarded by a lock; concurrency across processes is handled by
+        # SQLite itself
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            self.path, timeout=10, isolation_level=None, check_same_thread=False
+        )
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS chat_sessions ("
+                "key TEXT PRIMARY KEY, history BLOB NOT NULL, "
+                "size INTEGER NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS chat_sessions_updated_at "
+                "ON chat_sessions (updated_at)"
+            )
+
+    def __len__(self) -> int:
+        with self._lock:
+            (count,) = self._conn.execute(
+                "SELECT COUNT(*) FROM chat_sessions"
+            ).fetchone()
+        return count
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM chat_sessions WHERE key = ?", (key,))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM chat_sessions")
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def stats(self) -> ChatSessionStoreStatsType:
+        with self._lock:
+            count, total_size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM chat_sessions"
+            ).fetchone()
+        return {
+            "sessions": count,
+            "maxSessions": self.max_sessions,
+            "created": self._num_created,
+            "evictions": self._num_evictions,
+            "estimatedBytes": total_size,
+            "maxBytes": self.max_bytes,
+        }
+
+    def _get(self, key: str) -> bytes | None:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT history FROM chat_sessions WHERE key = ? AND updated_at >= ?",
+                (key, self._idle_cutoff()),
+            ).fetchone()
+        return row[0] if row is not None else None
+
+    def _put(self, key: str, data: bytes) -> bool:
+        # Timestamps are wall-clock time since they are compared across processes
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE chat_sessions SET history = ?, size = ?, updated_at = ? "
+                "WHERE key = ?",
+                (data, len(data), time.time(), key),
+            )
+            if cursor.rowcount > 0:
+                return False
+            self._conn.execute(
+                "INSERT OR REPLACE INTO chat_sessions VALUES (?, ?, ?, ?)",
+                (key, data, len(data), time.time()),
+            )
+            return True
+
+    def _sweep(self) -> None:
+        with self._lock:
+            num_evictions = self._conn.execute(
+                "DELETE FROM chat_sessions WHERE updated_at < ?",
+                (self._idle_cutoff(),),
+            ).rowcount
+            num_evictions += self._conn.execute(
+                "DELETE FROM chat_sessions WHERE key IN (SELECT key FROM chat_sessions "
+                "ORDER BY updated_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_sessions,),
+            ).rowcount
+            if self.max_bytes is not None:
+                # Keep the most recently updated sessions that fit within the budget
+                num_evictions += self._conn.execute(
+                    "DELETE FROM chat_sessions WHERE key IN (SELECT key FROM ("
+                    "SELECT key, SUM(size) OVER (ORDER BY updated_at DESC, key) "
+                    "AS total FROM chat_sessions) WHERE total > ?)",
+                    (self.max_bytes,),
+                ).rowcount
+        if num_evictions > 0:
+            self._num_evictions += num_evictions
+            logger.info(f"Evicted {num_evictions} chat session(s)")
+
+    def _idle_cutoff(self) -> float:
+        """Get the timestamp before which sessions are considered idle."""
+        return time.time() - self.idle_ttl if self.idle_ttl is not None else -1
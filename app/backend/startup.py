@@ -0,0 +1,75 @@
+"""Staged startup of the backend APIs."""
+
+import logging
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+
+from localtyping import StartupReportType
+from utils import format_exc_details
+
+logger = logging.getLogger("uvicorn.error")
+
+
+class StartupReport:
+    """Timings of the startup phases of the backend.
+
+    The server accepts traffic as soon as the app is imported, while the slow phases
+    such as loading the embedding model run in the background. The backend is ready
+    once all phases have completed. Failed phases are retried, so a failure is only
+    reported as the last error until the backend eventually gets ready.
+    """
+
+    def __init__(self) -> None:
+        self._started_at = time.perf_counter()
+        self._phases: dict[str, float] = {}
+        self._ended_at: float | None = None
+        self._error: str | None = None
+        self._failures = 0
+
+    @property
+    def ready(self) -> bool:
+        """Whether all startup phases have completed."""
+        return self._ended_at is not None and self._error is None
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Time a startup phase; a failed phase is timed until it raised."""
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._phases[name] = time.perf_counter() - started_at
+
+    def mark_ready(self) -> None:
+        """Mark the backend as ready and log the report."""
+        self._ended_at = time.perf_counter()
+        self._error = None
+        phases = ", ".join(
+            f"{name} {elapsed * 1000:.0f}ms" for name, elapsed in self._phases.items()
+        )
+        logger.info(
+            f"Backend ready in {(self._ended_at - self._started_at) * 1000:.0f}ms "
+            f"({phases})"
+        )
+
+    def record_failure(self, exc: Exception, retry_in: float) -> None:
+        """Record a failed startup phase that is retried after `retry_in` seconds."""
+        self._failures += 1
+        self._error = format_exc_details(exc)
+        logger.error(
+            f"Backend failed to start, retrying in {retry_in:.1f}s: {self._error}"
+        )
+
+    def report(self) -> StartupReportType:
+        """Get the startup report; the elapsed time stops once ready."""
+        ended_at = self._ended_at if self._ended_at is not None else time.perf_counter()
+        return {
+            "ready": self.ready,
+            "elapsedMs": (ended_at - self._started_at) * 1000,
+            "phasesMs": {
+                name: elapsed * 1000 for name, elapsed in self._phases.items()
+            },
+            "error": self._error,
+            "failures": self._failures,
+        }
@@ -0,0 +1,297 @@
+"""Test the cache module."""
+
+import time
+
+import numpy as np
+import pytest
+
+from cache import (
+    AnswerCache,
+    LRUCache,
+    QueryEmbeddingCache,
+    hash_embedding,
+    normalize_query,
+)
+
+
+@pytest.mark.parametrize(
+    "query, expected",
+    [
+        ("Breast Cancer", "breast cancer"),
+        ("  breast \t cancer\n", "breast cancer"),
+        ("", ""),
+    ],
+)
+def test_normalize_query(query, expected):
+    """Test normalizing query text."""
+    assert normalize_query(query) == expected
+
+
+def test_query_embedding_cache_hit_miss():
+    """Test cache hits and misses with normalized keys."""
+    cache = QueryEmbeddingCache("model")
+    assert cache.get("Breast cancer") is None
+
+    embedding = np.array([0.1, 0.2, 0.3], dtype=np.float32)
+    cache.put("Breast cancer", embedding)
+    cached = cache.get("  breast   CANCER ")
+    assert cached is not None
+    assert cached.dtype == np.float32
+    np.testing.assert_allclose(cached, embedding, rtol=1e-3)
+
+    stats = cache.stats()
+    assert stats["entries"] == 1
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["hitRatio"] == 0.5
+
+
+def test_query_embedding_cache_float16_buffer():
+    """Test that embeddings are stored in a compact float16 buffer."""
+    cache = QueryEmbeddingCache("model", max_entries=8)
+    cache.put("query", np.ones(384, dtype=np.float32))
+    assert cache._buffer is not None
+    assert cache._buffer.dtype == np.float16
+    assert cache._buffer.nbytes == 8 * 384 * 2
+
+
+def test_query_embedding_cache_lru_eviction():
+    """Test that the least recently used entries are evicted first."""
+    cache = QueryEmbeddingCache("model", max_entries=2)
+    cache.put("a", np.array([1.0, 0.0]))
+    cache.put("b", np.array([0.0, 1.0]))
+    assert cache.get("a") is not None  # "b" is now the least recently used
+    cache.put("c", np.array([1.0, 1.0]))
+
+    assert len(cache) == 2
+    assert cache.get("b") is None
+    np.testing.assert_allclose(cache.get("a"), [1.0, 0.0])
+    np.testing.assert_allclose(cache.get("c"), [1.0, 1.0])
+
+
+def test_query_embedding_cache_ttl():
+    """Test that expired entries are not returned."""
+    cache = QueryEmbeddingCache("model", ttl=0.05)
+    cache.put("query", np.array([1.0, 0.0]))
+    assert cache.get("query") is not None
+    time.sleep(0.1)
+    assert cache.get("query") is None
+    assert len(cache) == 0
+
+
+def test_query_embedding_cache_set_model():
+    """Test that changing the model invalidates the cache."""
+    cache = QueryEmbeddingCache("model-a")
+    cache.put("query", np.array([1.0, 0.0]))
+    cache.set_model("model-a")
+    assert cache.get("query") is not None
+    cache.set_model("model-b")
+    assert cache.get("query") is None
+    assert cache.model_name == "model-b"
+
+
+def test_query_embedding_cache_dimension_change():
+    """Test that inserting an embedding of a different dimension resets the cache."""
+    cache = QueryEmbeddingCache("model")
+    cache.put("a", np.array([1.0, 0.0]))
+    cache.put("b", np.array([1.0, 0.0, 0.0]))
+    assert cache.get("a") is None
+    np.testing.assert_allclose(cache.get("b"), [1.0, 0.0, 0.0])
+
+
+def test_query_embedding_cache_save_load(tmp_path):
+    """Test persisting the cache to disk and loading it back."""
+    path = tmp_path / "cache.npz"
+    cache = QueryEmbeddingCache("model", max_entries=4, path=path)
+    for i in range(4):
+        cache.put(f"query {i}", np.array([float(i), 1.0]))
+    cache.save()
+    assert path.exists()
+
+    # Loading with a smaller capacity keeps the most recently used entries
+    restored = QueryEmbeddingCache("model", max_entries=2, path=path)
+    restored.load()
+    assert len(restored) == 2
+    assert restored.get("query 1") is None
+    np.testing.assert_allclose(restored.get("query 3"), [3.0, 1.0])
+
+    # Loading with a different model is ignored
+    other = QueryEmbeddingCache("other-model", path=path)
+    other.load()
+    assert len(other) == 0
+
+
+def test_query_embedding_cache_invalid_args():
+    """Test creating a cache with invalid arguments."""
+    with pytest.raises(ValueError, match="Required max_entries > 0"):
+        QueryEmbeddingCache("model", max_entries=0)
+
+
+def test_hash_embedding():
+    """Test hashing embeddings consistently with the float16 embedding cache."""
+    embedding = np.array([0.1, 0.2, 0.3], dtype=np.float32)
+    roundtrip = embedding.astype(np.float16).astype(np.float32)
+    assert hash_embedding(embedding) == hash_embedding(roundtrip)
+    assert hash_embedding(embedding) != hash_embedding(embedding + 0.1)
+
+
+def test_lru_cache_eviction():
+    """Test LRU eviction by number of entries."""
+    evicted = []
+    cache = LRUCache(2, on_evict=lambda k, v: evicted.append(k))
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1  # "b" is now the least recently used
+    cache.put("c", 3)
+
+    assert len(cache) == 2
+    assert "b" not in cache
+    assert cache.get("b") is None
+    assert evicted == ["b"]
+
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["evictions"] == 1
+    assert stats["hitRatio"] == 0.5
+
+
+def test_lru_cache_weight():
+    """Test LRU eviction by total weight."""
+    cache = LRUCache(10, max_weight=10, weigh=len)
+    cache.put("a", "xxxx")
+    cache.put("b", "xxxx")
+    assert cache.weight == 8
+    cache.put("c", "xxxx")
+    assert cache.weight == 8
+    assert "a" not in cache
+
+    # A value that never fits is not cached and does not evict anything
+    cache.put("d", "x" * 11)
+    assert "d" not in cache
+    assert len(cache) == 2
+
+    # Replacing an entry updates the weight
+    cache.put("b", "x")
+    assert cache.weight == 5
+    assert cache.pop("b") == "x"
+    assert cache.pop("b") is None
+    assert cache.weight == 4
+
+
+def test_lru_cache_ttl():
+    """Test that expired entries are not returned."""
+    cache = LRUCache(10, ttl=0.05)
+    cache.put("a", 1)
+    assert cache.get("a") == 1
+    time.sleep(0.1)
+    assert "a" not in cache
+    cache.expire()
+    assert len(cache) == 0
+    assert cache.get("a") is None
+
+
+def test_lru_cache_set_version():
+    """Test that changing the version invalidates the cache."""
+    cache = LRUCache(10)
+    cache.set_version("v1")
+    cache.put("a", 1)
+    cache.set_version("v1")
+    assert cache.get("a") == 1
+    cache.set_version("v2")
+    assert cache.get("a") is None
+    assert cache.version == "v2"
+
+
+@pytest.mark.parametrize(
+    "kwargs, match",
+    [
+        ({"max_entries": 0}, "Required max_entries > 0"),
+        ({"max_entries": 1, "max_weight": 1}, "Required weigh"),
+    ],
+)
+def test_lru_cache_invalid_args(kwargs, match):
+    """Test creating an LRU cache with invalid arguments."""
+    with pytest.raises(ValueError, match=match):
+        LRUCache(**kwargs)
+
+
+def test_answer_cache_exact():
+    """Test exact answer cache hits on normalized questions within a scope."""
+    cache = AnswerCache()
+    assert cache.get("model", "id0", "What are the criteria?") is None
+    cache.put("model", "id0", "What are the criteria?", "Answer")
+    assert cache.get("model", "id0", "  what are THE criteria? ") == "Answer"
+    assert cache.get("model", "id1", "What are the criteria?") is None
+    assert cache.get("other", "id0", "What are the criteria?") is None
+
+    stats = cache.stats()
+    assert stats["entries"] == 1
+    assert stats["exactHits"] == 1
+    assert stats["semanticHits"] == 0
+    assert stats["misses"] == 3
+    assert stats["hitRatio"] == 0.25
+
+
+def test_answer_cache_semantic():
+    """Test semantic answer cache hits above the similarity threshold."""
+    cache = AnswerCache(threshold=0.9)
+    cache.put("model", "id0", "a", "Answer a", np.array([1.0, 0.0, 0.0]))
+    cache.put("model", "id0", "b", "Answer b", np.array([0.0, 2.0, 0.0]))
+    cache.put("model", "id0", "c", "Answer c")  # Only matched exactly
+
+    # Embeddings are compared by cosine similarity, so the scale does not matter
+    assert cache.get("model", "id0", "x", np.array([0.0, 3.0, 0.5])) == "Answer b"
+    assert cache.get("model", "id0", "x", np.array([1.0, 1.0, 0.0])) is None
+    assert cache.get("model", "id1", "x", np.array([1.0, 0.0, 0.0])) is None
+    assert cache.get("model", "id0", "x") is None
+    stats = cache.stats()
+    assert stats["semanticHits"] == 1
+    assert stats["misses"] == 3
+
+
+def test_answer_cache_contrasting_questions():
+    """Test that questions differing by contrasting words never share answers."""
+    embedding = np.array([1.0, 0.0])  # Stub embeddings as similar as can be
+    cache = AnswerCache()
+    cache.put("model", "id0", "What are the inclusion criteria?", "A", embedding)
+    assert cache.get("model", "id0", "What are the criteria?", embedding) is None
+
+    cache = AnswerCache(threshold=0.95)
+    cache.put("model", "id0", "What are the inclusion criteria?", "A", embedding)
+    assert (
+        cache.get("model", "id0", "What are the exclusion criteria?", embedding) is None
+    )
+    assert cache.get("model", "id0", "Who is not eligible?", embedding) is None
+    assert cache.get("model", "id0", "Which inclusion criteria?", embedding) == "A"
+    stats = cache.stats()
+    assert stats["semanticHits"] == 1
+    assert stats["misses"] == 2
+
+
+def test_answer_cache_eviction():
+    """Test that answers are evicted in LRU order and once expired."""
+    cache = AnswerCache(max_entries=2, ttl=0.05)
+    cache.put("model", "id0", "a", "A", np.array([1.0, 0.0]))
+    cache.put("model", "id0", "b", "B", np.array([0.0, 1.0]))
+    assert cache.get("model", "id0", "a") == "A"  # "b" is now the least recent
+    cache.put("model", "id1", "c", "C")
+    assert len(cache) == 2
+    assert cache.get("model", "id0", "x", np.array([0.0, 1.0])) is None
+
+    time.sleep(0.1)
+    assert cache.get("model", "id0", "a") is None
+    assert cache.get("model", "id1", "x", np.array([1.0, 0.0])) is None
+    assert cache.stats()["evictions"] == 2
+
+
+def test_answer_cache_set_version():
+    """Test that changing the version invalidates the answer cache."""
+    cache = AnswerCache()
+    cache.set_version("v1")
+    cache.put("model", "id0", "a", "A", np.array([1.0, 0.0]))
+    cache.set_version("v1")
+    assert cache.get("model", "id0", "a") == "A"
+    cache.set_version("v2")
+    assert cache.get("model", "id0", "x", np.array([1.0, 0.0])) is None
+    assert len(cache) == 0
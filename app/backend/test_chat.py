@@ -0,0 +1,155 @@
+"""Test the chat module."""
+
+import asyncio
+import json
+
+import pytest
+
+from chat import (
+    ChatTimingStats,
+    format_sse,
+    generate_chat_response,
+    stream_cached_response,
+    stream_chat_response,
+)
+from conftest import MockChatSession, MockGenerativeModel
+
+
+@pytest.mark.parametrize(
+    "data, event, expected",
+    [
+        ({"text": "a\nb"}, None, 'data: {"text": "a\\nb"}\n\n'),
+        ({"response": "ab"}, "done", 'event: done\ndata: {"response": "ab"}\n\n'),
+    ],
+)
+def test_format_sse(data, event, expected):
+    """Test formatting Server-Sent Events."""
+    assert format_sse(data, event=event) == expected
+
+
+def test_chat_timing_stats():
+    """Test recording chat timings."""
+    timing_stats = ChatTimingStats()
+    assert timing_stats.stats()["meanGenerationMs"] == 0
+    timing_stats.record(1.0)
+    timing_stats.record(3.0, first_token_time=0.5)
+    timing_stats.record_timeout()
+
+    stats = timing_stats.stats()
+    assert stats["numResponses"] == 2
+    assert stats["numStreamed"] == 1
+    assert stats["numTimeouts"] == 1
+    assert stats["meanGenerationMs"] == 2000
+    assert stats["maxGenerationMs"] == 3000
+    assert stats["meanFirstTokenMs"] == 500
+    assert stats["maxFirstTokenMs"] == 500
+
+
+async def _collect(events):
+    """Helper function to collect all events of an async iterator."""
+    return [event async for event in events]
+
+
+def test_generate_chat_response(monkeypatch):
+    """Test generating a chat response."""
+    monkeypatch.setattr(MockChatSession, "CHUNKS", ["a", "b", "c "])
+    chat_session = MockChatSession(MockGenerativeModel("model"))
+    timing_stats = ChatTimingStats()
+
+    async def _generate():
+        semaphore = asyncio.Semaphore(1)
+        return await generate_chat_response(
+            chat_session, "query", timing_stats, semaphore, timeout=1
+        )
+
+    assert asyncio.run(_generate()) == "abc"
+    assert timing_stats.stats()["numResponses"] == 1
+
+
+def test_generate_chat_response_timeout(monkeypatch):
+    """Test that generating a chat response times out."""
+    monkeypatch.setattr(MockChatSession, "DELAY", 0.1)
+    chat_session = MockChatSession(MockGenerativeModel("model"))
+    timing_stats = ChatTimingStats()
+
+    async def _generate():
+        semaphore = asyncio.Semaphore(1)
+        return await generate_chat_response(
+            chat_session, "query", timing_stats, semaphore, timeout=0.05
+        )
+
+    with pytest.raises(TimeoutError):
+        asyncio.run(_generate())
+    assert timing_stats.stats()["numTimeouts"] == 1
+    assert timing_stats.stats()["numResponses"] == 0
+
+
+def test_stream_chat_response(monkeypatch):
+    """Test streaming a chat response chunk by chunk."""
+    monkeypatch.setattr(MockChatSession, "CHUNKS", ["a", "b", "c "])
+    chat_session = MockChatSession(MockGenerativeModel("model"))
+    timing_stats = ChatTimingStats()
+    done = []
+
+    async def _on_done(response_text):
+        done.append(response_text)
+
+    async def _stream():
+        semaphore = asyncio.Semaphore(1)
+        events = await _collect(
+            stream_chat_response(
+                chat_session,
+                "query",
+                timing_stats,
+                semaphore,
+                session_id="s",
+                on_done=_on_done,
+            )
+        )
+        assert not semaphore.locked()  # The slot is released at the end
+        return events
+
+    events = asyncio.run(_stream())
+    assert [json.loads(e.split("data: ")[1]) for e in events] == [
+        {"text": "a"},
+        {"text": "b"},
+        {"text": "c "},
+        {"response": "abc", "sessionId": "s"},
+    ]
+    assert events[-1].startswith("event: done")
+    assert [c.parts[0].text for c in chat_session.history] == ["query", "abc "]
+    assert done == ["abc"]
+    assert timing_stats.stats()["numStreamed"] == 1
+
+
+def test_stream_cached_response():
+    """Test streaming a cached response."""
+    events = asyncio.run(_collect(stream_cached_response("abc", session_id="s")))
+    assert events == [
+        format_sse({"text": "abc"}),
+        format_sse({"response": "abc", "sessionId": "s"}, event="done"),
+    ]
+
+
+def test_stream_chat_response_timeout(monkeypatch):
+    """Test that streaming a chat response times out midway."""
+    monkeypatch.setattr(MockChatSession, "DELAY", 0.04)
+    chat_session = MockChatSession(MockGenerativeModel("model"))
+    timing_stats = ChatTimingStats()
+
+    async def _stream():
+        semaphore = asyncio.Semaphore(1)
+        events = await _collect(
+            stream_chat_response(
+                chat_session, "query", timing_stats, semaphore, timeout=0.1
+            )
+        )
+        assert not semaphore.locked()
+        return events
+
+    events = asyncio.run(_stream())
+    assert events[0] == format_sse({"text": "Dummy "})
+    assert events[-1].startswith("event: error")
+    assert "timed out" in events[-1]
+    assert len(chat_session.history) == 0
+    assert timing_stats.stats()["numTimeouts"] == 1
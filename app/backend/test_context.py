@@ -0,0 +1,100 @@
+"""Test the context module."""
+
+import json
+
+from conftest import SAMPLE_METADATA
+from context import assemble_trial_context, render_trial_context, render_trial_sections
+from utils import _clean_metadata
+
+
+def _make_metadata(**overrides):
+    """Helper function to make cleaned metadata with some fields overridden."""
+    metadata = _clean_metadata(SAMPLE_METADATA)
+    metadata.update(overrides)
+    return metadata
+
+
+def test_render_trial_context():
+    """Test rendering trial metadata compactly."""
+    metadata = _make_metadata()
+    context = render_trial_context(metadata)
+    assert "Title: Sample Metadata\n" in context
+    assert "Conditions: Condition 1; Condition 2\n" in context
+    assert "- Measure 1 [6 months]: Description 1\n" in context
+    assert "- PMID dummy-id1: Citation 1\n" in context
+    assert len(context) < len(json.dumps(metadata, indent=2))
+
+
+def test_render_trial_context_drops_empty_fields():
+    """Test that empty fields are not rendered."""
+    metadata = _make_metadata(
+        details="", collaborators=[], secondaryMeasureOutcomes=[], minAge=0, maxAge=120
+    )
+    context = render_trial_context(metadata)
+    assert "Observational model" not in context  # Empty in the sample metadata
+    assert "Details" not in context
+    assert "Collaborators" not in context
+    assert "Secondary outcomes" not in context
+    assert "Ages" not in context
+
+
+def test_render_trial_context_caps_lists():
+    """Test that long lists are capped with counts."""
+    locations = [f"Hospital {i}, City {i}, , , Country" for i in range(25)]
+    context = render_trial_context(
+        _make_metadata(locations=locations), max_list_items=5
+    )
+    assert "Locations (25 total):\n- Hospital 0, City 0, Country\n" in context
+    assert "Hospital 4" in context and "Hospital 5" not in context
+    assert "- ... and 20 more" in context
+
+
+def test_render_trial_context_keeps_outcomes():
+    """Test that outcomes and interventions are never capped."""
+    outcomes = [
+        {"measure": f"Measure {i}", "description": "", "timeFrame": ""}
+        for i in range(15)
+    ]
+    interventions = [
+        {"type": "DRUG", "name": f"Drug {i}", "description": ""} for i in range(15)
+    ]
+    context = render_trial_context(
+        _make_metadata(primaryMeasureOutcomes=outcomes, interventions=interventions),
+        max_list_items=10,
+    )
+    assert "- Measure 10\n" in context
+    assert "- Measure 14\n" in context
+    assert "- DRUG: Drug 14\n" in context
+    assert "more" not in context
+
+
+def test_render_trial_context_compacts_texts():
+    """Test that blank lines and surrounding whitespace are removed from texts."""
+    context = render_trial_context(
+        _make_metadata(inclusionCriteria="\n\n  * Adults  \n\n\n  * Consent\n")
+    )
+    assert "Inclusion criteria:\n* Adults\n* Consent\n" in context
+
+
+def test_render_trial_sections():
+    """Test rendering trial metadata into sections and assembling them."""
+    sections = render_trial_sections(_make_metadata(details=""))
+    assert list(sections) == [
+        "core",
+        "criteria",
+        "interventions",
+        "outcomes",
+        "locations",
+    ]
+    assert sections["core"].startswith("Title: Sample Metadata\n")
+    assert sections["criteria"].startswith("Inclusion criteria:\n")
+
+    context = assemble_trial_context(sections, selected=["outcomes"])
+    assert context == f"{sections['core']}\n{sections['outcomes']}"
+    assert assemble_trial_context(sections) == render_trial_context(
+        _make_metadata(details="")
+    )
+
+    context = assemble_trial_context(sections, max_section_chars=10)
+    assert f"{sections['criteria'][:10]}... (truncated)" in context
+    assert sections["core"] in context  # The core section is never cut
@@ -0,0 +1,168 @@
+"""Test the embedding module."""
+
+import asyncio
+import time
+
+import numpy as np
+import pytest
+
+from conftest import MockEmbeddingModel
+from embedding import EmbeddingWorker
+
+
+class FailingEmbeddingModel:
+    """Embedding model that always fails."""
+
+    def encode(self, sentences):
+        raise ValueError("Encoding failed")
+
+
+def _run_queries(worker, n_queries, concurrency):
+    """Run queries through the worker with bounded concurrency."""
+
+    async def _main():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def _one(i):
+            async with semaphore:
+                return await worker.encode(f"query {i}")
+
+        return await asyncio.gather(*(_one(i) for i in range(n_queries)))
+
+    return asyncio.run(_main())
+
+
+def test_embedding_worker_results():
+    """Test that each caller receives its own embedding."""
+    worker = EmbeddingWorker(MockEmbeddingModel(), max_batch_size=4, max_wait_ms=5)
+    try:
+        embeddings = _run_queries(worker, n_queries=10, concurrency=10)
+    finally:
+        worker.close()
+
+    assert len(embeddings) == 10
+    for embedding in embeddings:
+        np.testing.assert_allclose(embedding, [0.1, 0.2, 0.3, 0.4, 0.5])
+
+
+@pytest.mark.parametrize("max_batch_size", [1, 4, 16])
+def test_embedding_worker_batch_size(max_batch_size):
+    """Test that concurrent queries are batched within the maximum batch size."""
+    worker = EmbeddingWorker(
+        MockEmbeddingModel(delay=0.01), max_batch_size=max_batch_size, max_wait_ms=20
+    )
+    try:
+        _run_queries(worker, n_queries=32, concurrency=32)
+    finally:
+        worker.close()
+
+    stats = worker.stats()
+    assert stats["numQueries"] == 32
+    assert stats["maxBatchSize"] <= max_batch_size
+    assert stats["numBatches"] >= 32 // max_batch_size
+    if max_batch_size > 1:
+        assert stats["maxBatchSize"] > 1
+        assert stats["numBatches"] < 32
+    assert stats["meanQueueWaitMs"] > 0
+
+
+class LengthEmbeddingModel:
+    """Embedding model encoding each sentence by its length, recording the calls."""
+
+    def __init__(self):
+        self.calls = []
+
+    def encode(self, sentences):
+        self.calls.append(list(sentences))
+        return np.array([[len(sentence), 1.0] for sentence in sentences])
+
+
+def test_embedding_worker_encode_many():
+    """Test that multiple queries are encoded in chunks of at most the batch size."""
+    model = LengthEmbeddingModel()
+    worker = EmbeddingWorker(model, max_batch_size=4, max_wait_ms=20)
+    queries = [f"query {'x' * i}" for i in range(50)]
+
+    async def _main():
+        return await asyncio.gather(
+            worker.encode_many(queries), worker.encode("single")
+        )
+
+    try:
+        embeddings, embedding = asyncio.run(_main())
+    finally:
+        worker.close()
+
+    np.testing.assert_allclose(embeddings[:, 0], [len(query) for query in queries])
+    np.testing.assert_allclose(embedding, [len("single"), 1.0])
+    assert sum(len(call) for call in model.calls) == 51
+    assert max(len(call) for call in model.calls) <= 4
+    assert len(model.calls) <= 14
+    assert worker.stats()["numQueries"] == 51
+    assert worker.stats()["maxBatchSize"] <= 4
+
+
+def test_embedding_worker_exception():
+    """Test that encoding errors are propagated to the callers."""
+    worker = EmbeddingWorker(FailingEmbeddingModel())
+    try:
+        with pytest.raises(ValueError, match="Encoding failed"):
+            _run_queries(worker, n_queries=3, concurrency=3)
+    finally:
+        worker.close()
+
+
+def test_embedding_worker_close_concurrent():
+    """Test that queries racing with close are either resolved or fail."""
+    worker = EmbeddingWorker(MockEmbeddingModel(delay=0.01), max_batch_size=4)
+
+    async def _main():
+        async def _one(i):
+            await asyncio.sleep(i * 0.001)
+            return await worker.encode(f"query {i}")
+
+        tasks = [asyncio.create_task(_one(i)) for i in range(50)]
+        await asyncio.sleep(0.02)
+        await asyncio.to_thread(worker.close)
+        return await asyncio.wait_for(
+            asyncio.gather(*tasks, return_exceptions=True), timeout=5
+        )
+
+    results = asyncio.run(_main())
+    errors = [result for result in results if isinstance(result, Exception)]
+    assert 0 < len(errors) < len(results)
+    for error in errors:
+        assert isinstance(error, RuntimeError)
+        assert "Embedding worker closed" in str(error)
+
+    # The worker is not restarted once closed
+    with pytest.raises(RuntimeError, match="Embedding worker closed"):
+        asyncio.run(worker.encode("query"))
+
+
+@pytest.mark.parametrize(
+    "kwargs", [{"max_batch_size": 0}, {"max_batch_size": 1, "max_wait_ms": -1}]
+)
+def test_embedding_worker_invalid_args(kwargs):
+    """Test creating an embedding worker with invalid arguments."""
+    with pytest.raises(ValueError, match="Required"):
+        EmbeddingWorker(MockEmbeddingModel(), **kwargs)
+
+
+def test_embedding_worker_throughput():
+    """Load test that throughput rises with the number of concurrent callers."""
+    n_queries = 64
+    throughputs = {}
+    for concurrency in [1, 8, 32]:
+        worker = EmbeddingWorker(
+            MockEmbeddingModel(delay=0.01), max_batch_size=32, max_wait_ms=2
+        )
+        try:
+            start = time.perf_counter()
+            _run_queries(worker, n_queries=n_queries, concurrency=concurrency)
+            throughputs[concurrency] = n_queries / (time.perf_counter() - start)
+        finally:
+            worker.close()
+
+    assert throughputs[8] > 2 * throughputs[1]
+    assert throughputs[32] > throughputs[8]
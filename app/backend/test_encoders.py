@@ -0,0 +1,104 @@
+"""Test the encoders module."""
+
+import numpy as np
+import pytest
+import torch
+from transformers import BertConfig, BertModel, BertTokenizerFast  # type: ignore
+
+import encoders
+from encoders import PARITY_QUERIES, QuantizedEncoder, check_parity, load_encoder
+
+
+@pytest.fixture(scope="module")
+def tiny_bert(tmp_path_factory):
+    """Return a tiny randomly initialized BERT model and its tokenizer."""
+    words = sorted({w for q in PARITY_QUERIES for w in q.lower().split()})
+    vocab_path = tmp_path_factory.mktemp("tiny-bert") / "vocab.txt"
+    vocab_path.write_text(
+        "\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]", *words])
+    )
+    tokenizer = BertTokenizerFast(vocab_file=str(vocab_path))
+
+    torch.manual_seed(0)
+    config = BertConfig(
+        vocab_size=tokenizer.vocab_size,
+        hidden_size=64,
+        num_hidden_layers=2,
+        num_attention_heads=2,
+        intermediate_size=128,
+    )
+    return BertModel(config).eval(), tokenizer
+
+
+class ReferenceEncoder:
+    """Full-precision encoder pooling the same way as FlagModel for BGE models."""
+
+    def __init__(self, model, tokenizer):
+        self.model = model
+        self.tokenizer = tokenizer
+
+    def encode(self, sentences):
+        inputs = self.tokenizer(sentences, padding=True, return_tensors="pt")
+        with torch.inference_mode():
+            hidden = self.model(**inputs).last_hidden_state[:, 0]
+        return torch.nn.functional.normalize(hidden, dim=-1).numpy()
+
+
+def test_quantized_encoder(tiny_bert):
+    """Test encoding with the quantized encoder."""
+    model, tokenizer = tiny_bert
+    encoder = QuantizedEncoder(model, tokenizer)
+    assert any(
+        isinstance(module, torch.ao.nn.quantized.dynamic.Linear)
+        for module in encoder.model.modules()
+    )
+    assert isinstance(model.encoder.layer[0].output.dense, torch.nn.Linear)
+
+    embedding = encoder.encode("breast cancer")
+    assert embedding.shape == (64,)
+    embeddings = encoder.encode(["breast cancer", "hiv pre-exposure prophylaxis"])
+    assert embeddings.shape == (2, 64)
+    np.testing.assert_allclose(np.linalg.norm(embeddings, axis=1), 1, rtol=1e-5)
+
+    # Activations are quantized per batch, so batching changes the embedding of a
+    # query only slightly
+    assert embeddings[0] @ embedding > 0.999
+
+
+def test_check_parity(tiny_bert):
+    """Test the parity check of the quantized encoder against full precision."""
+    model, tokenizer = tiny_bert
+    reference = ReferenceEncoder(model, tokenizer)
+    report = check_parity(QuantizedEncoder(model, tokenizer), reference)
+    assert 0.95 < report.min_similarity <= report.mean_similarity <= 1 + 1e-6
+
+    report = check_parity(reference, reference)
+    assert report.min_similarity == pytest.approx(1, abs=1e-6)
+
+
+@pytest.mark.parametrize("similarity", [0.999, 0.5])
+def test_load_encoder(tiny_bert, monkeypatch, similarity):
+    """Test loading encoders with a fallback when the parity check fails."""
+    model, tokenizer = tiny_bert
+    quantized = QuantizedEncoder(model, tokenizer)
+    reference = ReferenceEncoder(model, tokenizer)
+    monkeypatch.setattr("FlagEmbedding.FlagModel", lambda *args, **kwargs: reference)
+    monkeypatch.setattr(
+        QuantizedEncoder, "from_pretrained", classmethod(lambda cls, name: quantized)
+    )
+    monkeypatch.setattr(
+        "encoders.check_parity",
+        lambda *args: encoders.ParityReport(similarity, similarity),
+    )
+
+    assert load_encoder("model", backend="flag") == ("model", reference)
+    assert load_encoder("model", backend="int8", parity_threshold=None) == (
+        "model:int8",
+        quantized,
+    )
+    if similarity >= 0.99:
+        assert load_encoder("model", backend="int8") == ("model:int8", quantized)
+    else:
+        assert load_encoder("model", backend="int8") == ("model", reference)
+    with pytest.raises(ValueError, match="Unknown embedding backend"):
+        load_encoder("model", backend="onnx")
@@ -0,0 +1,90 @@
+"""Test the history module."""
+
+from vertexai.generative_models import Content, Part  # type: ignore
+
+from history import (
+    SUMMARY_ACK,
+    SUMMARY_PREFIX,
+    ChatPromptStats,
+    FittedHistory,
+    HistoryManager,
+    estimate_tokens,
+    get_content_text,
+)
+
+
+def _make_history(n_turns, chars=400):
+    """Helper function to make a chat history of (user, model) turns."""
+    history = []
+    for i in range(n_turns):
+        history.append(Content(role="user", parts=[Part.from_text(f"Q{i} " * chars)]))
+        history.append(Content(role="model", parts=[Part.from_text(f"A{i} " * chars)]))
+    return history
+
+
+def test_estimate_tokens():
+    """Test estimating the number of tokens."""
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("abcd") == 1
+    assert estimate_tokens("abcde") == 2
+
+
+def test_history_manager_within_budget():
+    """Test that a history within the budget is kept as is."""
+    manager = HistoryManager(token_budget=10000)
+    history = _make_history(2, chars=10)
+    fitted = manager.fit(history, "system", "query")
+    assert fitted.history is history
+    assert fitted.folded_turns == 0
+    assert fitted.prompt_tokens == (
+        estimate_tokens("system")
+        + estimate_tokens("query")
+        + sum(estimate_tokens(get_content_text(c)) for c in history)
+    )
+
+
+def test_history_manager_truncation():
+    """Test that older turns are folded into a summary turn."""
+    manager = HistoryManager(token_budget=2000, summary_max_tokens=200)
+    history = _make_history(10)  # About 400 tokens per message
+    fitted = manager.fit(history, "system", "query")
+
+    assert fitted.prompt_tokens <= 2000
+    assert fitted.folded_turns == 8
+    assert [c.role for c in fitted.history] == ["user", "model"] * 3
+    summary = get_content_text(fitted.history[0])
+    assert summary.startswith(SUMMARY_PREFIX)
+    assert get_content_text(fitted.history[1]) == SUMMARY_ACK
+    assert estimate_tokens(summary) <= 200 + estimate_tokens(SUMMARY_PREFIX)
+    assert fitted.history[2:] == history[-4:]  # The most recent turns are kept
+    assert "Q7" in summary and "Q0" not in summary  # The oldest lines are dropped
+
+
+def test_history_manager_rolling_truncation():
+    """Test that the prompt stays within the budget over a long conversation."""
+    manager = HistoryManager(token_budget=2000, summary_max_tokens=200)
+    history = []
+    for i in range(20):
+        fitted = manager.fit(history, "system", "query")
+        assert fitted.prompt_tokens <= 2000
+        assert sum(SUMMARY_PREFIX in get_content_text(c) for c in fitted.history) <= 1
+        history = fitted.history + _make_history(1, chars=100 + i)
+
+    # The summary stays bounded however many turns are folded into it
+    summary = get_content_text(history[0])
+    assert summary.startswith(SUMMARY_PREFIX)
+    assert estimate_tokens(summary) <= 200 + estimate_tokens(SUMMARY_PREFIX)
+
+
+def test_chat_prompt_stats():
+    """Test recording chat prompt sizes."""
+    prompt_stats = ChatPromptStats()
+    assert prompt_stats.stats()["meanPromptTokens"] == 0
+    prompt_stats.record(FittedHistory([], 100, 0))
+    prompt_stats.record(FittedHistory([], 300, 2))
+
+    stats = prompt_stats.stats()
+    assert stats["numPrompts"] == 2
+    assert stats["meanPromptTokens"] == 200
+    assert stats["maxPromptTokens"] == 300
+    assert stats["numTruncated"] == 1
@@ -0,0 +1,166 @@
+"""Test the index module."""
+
+from datetime import datetime, timezone
+
+import numpy as np
+import pytest
+
+from conftest import SAMPLE_METADATA, MockChromadbCollection
+from index import LocalVectorIndex, open_local_index
+
+STUDY_PHASES = ["NA", "PHASE1", "PHASE1, PHASE2", "PHASE2", "PHASE3", "PHASE4"]
+
+
+def _make_records(n_records=200, dim=8, seed=42):
+    """Helper function to make records with random embeddings and metadata."""
+    rng = np.random.default_rng(seed)
+    ids = [f"NCT{i:08d}" for i in range(n_records)]
+    documents = [f"Trial {i}" for i in range(n_records)]
+    embeddings = rng.normal(size=(n_records, dim))
+    epoch_days = rng.integers(10957, 20089, size=(n_records, 2))  # 2000 ~ 2025
+    dates = np.datetime_as_string(epoch_days.astype("datetime64[D]"))
+    metadatas = []
+    for i in range(n_records):
+        metadata = SAMPLE_METADATA.copy()
+        metadata["study_type"] = ["INTERVENTIONAL", "OBSERVATIONAL"][i % 2]
+        metadata["eligible_sex"] = ["ALL", "FEMALE", "MALE"][i % 3]
+        metadata["accepts_healthy"] = bool(rng.random() < 0.3)
+        metadata["min_age"] = int(rng.integers(0, 40))
+        metadata["max_age"] = metadata["min_age"] + int(rng.integers(0, 60))
+        metadata["study_phases"] = STUDY_PHASES[rng.integers(len(STUDY_PHASES))]
+        metadata["last_update_date_posted"] = str(dates[i, 0])
+        metadata["results_date_posted"] = "" if i % 7 == 0 else str(dates[i, 1])
+        metadatas.append(metadata)
+    return ids, documents, embeddings, metadatas
+
+
+def _timestamp(date):
+    """Helper function to convert a date into epoch milliseconds."""
+    try:
+        parsed = datetime.strptime(date, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+    except ValueError:
+        return None
+    return parsed.timestamp() * 1000
+
+
+def _accept(metadata, filters):
+    """Helper function to check if metadata passes the filters one by one."""
+    if "studyType" in filters:
+        if metadata["study_type"] != filters["studyType"].upper():
+            return False
+    if filters.get("acceptsHealthy") is False and metadata["accepts_healthy"]:
+        return False
+    if "eligibleSex" in filters:
+        if metadata["eligible_sex"] != filters["eligibleSex"].upper():
+            return False
+    if "ageRange" in filters:
+        min_age, max_age = filters["ageRange"]
+        if metadata["min_age"] > max_age or metadata["max_age"] < min_age:
+            return False
+    if filters.get("studyPhases"):
+        phases = metadata["study_phases"].split(", ")
+        if not any(phase in filters["studyPhases"] for phase in phases):
+            return False
+    for key, filter_key in [
+        ("last_update_date_posted", "lastUpdateDatePosted"),
+        ("results_date_posted", "resultsDatePosted"),
+    ]:
+        if filter_key in filters:
+            timestamp = _timestamp(metadata[key])
+            date_from, date_to = filters[filter_key]
+            if timestamp is None or not date_from <= timestamp <= date_to:
+                return False
+    return True
+
+
+@pytest.mark.parametrize(
+    "filters",
+    [
+        {},
+        {"studyType": "observational"},
+        {"acceptsHealthy": False},
+        {"acceptsHealthy": True},
+        {"eligibleSex": "female", "ageRange": [18, 30]},
+        {"studyType": "unknown"},
+        {"studyPhases": ["PHASE1", "PHASE4"]},
+        {"studyPhases": []},
+        {"lastUpdateDatePosted": [1262304000000, 1577836800000]},
+        {
+            "studyType": "interventional",
+            "studyPhases": ["PHASE2"],
+            "resultsDatePosted": [946684800000, 1704067200000],
+        },
+    ],
+)
+@pytest.mark.parametrize("top_k", [1, 10, 500])
+def test_local_index_search(filters, top_k):
+    """Test that the local index ranks and filters the same as brute force."""
+    ids, documents, embeddings, metadatas = _make_records()
+    index = LocalVectorIndex.from_records(ids, documents, embeddings, metadatas)
+    query = np.random.default_rng(0).normal(size=8)
+
+    normalized = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+    scores = normalized @ (query / np.linalg.norm(query))
+    accepted = [i for i in range(len(ids)) if _accept(metadatas[i], filters)]
+    expected = sorted(accepted, key=lambda i: -scores[i])[:top_k]
+
+    indices, similarities = index.search(query, top_k, filters)
+    assert indices.tolist() == expected
+    np.testing.assert_allclose(similarities, scores[expected], atol=1e-6)
+    assert index.query(query, top_k, filters) == {
+        "ids": [ids[i] for i in expected],
+        "documents": [documents[i] for i in expected],
+    }
+
+    # Squared L2 distances between unit vectors as in ChromaDB
+    response = index.query(query, top_k, filters, include_distances=True)
+    unit_query = query / np.linalg.norm(query)
+    np.testing.assert_allclose(
+        response["distances"],
+        [np.sum((normalized[i] - unit_query) ** 2) for i in expected],
+        atol=1e-5,
+    )
+
+
+def test_local_index_save_load(tmp_path):
+    """Test saving a local index and loading it memory-mapped."""
+    ids, documents, embeddings, metadatas = _make_records()
+    ids[0], documents[0] = "NCT-ünïcode", "Trial with ünïcode"
+    index = LocalVectorIndex.from_records(
+        ids, documents, embeddings, metadatas, version="v1"
+    )
+    index.save(tmp_path)
+
+    loaded = LocalVectorIndex.load(tmp_path)
+    assert isinstance(loaded.embeddings, np.memmap)
+    assert loaded.version == "v1"
+    assert len(loaded) == len(ids)
+    assert loaded.get_ids([0, 1]) == ids[:2]
+    assert loaded.get_documents([0]) == documents[:1]
+
+    query = np.ones(8)
+    filters = {"studyPhases": ["PHASE2"], "eligibleSex": "male"}
+    assert loaded.query(query, 5, filters) == index.query(query, 5, filters)
+
+
+def test_open_local_index(tmp_path, monkeypatch):
+    """Test that the snapshot on disk is reused until the collection version changes."""
+    index = open_local_index(MockChromadbCollection(version="v1"), tmp_path)
+    assert index.version == "v1"
+    assert len(index) == len(MockChromadbCollection.RECORDS)
+    assert index.query(np.array([0.1, 0.2, 0.3, 0.4, 0.5]), 3, {}) == {
+        "ids": ["id0", "id1", "id2"],
+        "documents": ["doc-id0", "doc-id1", "doc-id2"],
+    }
+
+    def _from_collection(collection, batch_size=1000):
+        raise AssertionError("Unexpected snapshot")
+
+    with monkeypatch.context() as m:
+        m.setattr(LocalVectorIndex, "from_collection", _from_collection)
+        index = open_local_index(MockChromadbCollection(version="v1"), tmp_path)
+        assert index.version == "v1"
+
+    index = open_local_index(MockChromadbCollection(version="v2"), tmp_path)
+    assert index.version == "v2"
+    assert LocalVectorIndex.load(tmp_path).version == "v2"
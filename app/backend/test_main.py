@@ -1,12 +1,28 @@
 """Test the main module."""
 
+import asyncio
 import json
+import threading
+import time
 from urllib.parse import quote
 
+import httpx
 import pytest
 from fastapi.testclient import TestClient
 
+import main
+from conftest import (
+    SAMPLE_METADATA,
+    MockChatSession,
+    MockChromadbClient,
+    MockChromadbCollection,
+    MockChromadbSectionsCollection,
+    MockEmbeddingModel,
+)
+from history import SUMMARY_PREFIX, HistoryManager
 from main import app
+from metrics import STAGE_DURATION
+from startup import StartupReport
 
 client = TestClient(app)
 
@@ -19,6 +35,265 @@ def test_heartbeat():
     assert "timestamp" in response_json
 
 
+@pytest.mark.parametrize("fail", [False, True])
+def test_ready(setup, monkeypatch, fail):
+    """Test that the components are warmed up in the background until ready."""
+    setup(init_embedding_model=False, init_chromadb_client=False)
+
+    def _load_encoder(model_name, backend, parity_threshold):
+        time.sleep(0.2)
+        if fail:
+            raise OSError("Model not found")
+        return "mock", MockEmbeddingModel(delay=0.1)
+
+    monkeypatch.setattr("main.STARTUP_REPORT", StartupReport())
+    monkeypatch.setattr("main.load_encoder", _load_encoder)
+    monkeypatch.setattr("main.init_vertexai", lambda: None)
+    monkeypatch.setattr("chromadb.HttpClient", lambda host, port: MockChromadbClient())
+
+    with TestClient(app) as lifespan_client:
+        # The server answers while the components are still loading
+        assert lifespan_client.get("/heartbeat").status_code == 200
+        response = lifespan_client.get("/ready")
+        assert response.status_code == 503
+        assert response.json()["ready"] is False
+
+        deadline = time.monotonic() + 5
+        while response.status_code == 503 and response.json()["error"] is None:
+            assert time.monotonic() < deadline, "Backend never got ready"
+            time.sleep(0.05)
+            response = lifespan_client.get("/ready")
+
+        report = response.json()
+        stats = lifespan_client.get("/stats").json()["startup"]
+        assert report.keys() == stats.keys()
+        if fail:
+            # The failed phase is retried in the background, so the backend stays
+            # unready with the last error reported
+            assert response.status_code == 503
+            assert report["ready"] is False
+            assert "OSError: Model not found" in report["error"]
+            assert report["failures"] >= 1
+            assert report["phasesMs"]["embeddingModel"] >= 200
+            return
+
+        assert report == stats
+        assert response.status_code == 200
+        assert report["ready"] is True
+        assert report["error"] is None
+        assert report["phasesMs"].keys() == {
+            "chromadb",
+            "embeddingModel",
+            "warmUp",
+            "vertexai",
+        }
+        assert report["phasesMs"]["embeddingModel"] >= 200
+        assert report["phasesMs"]["warmUp"] >= 100
+        assert report["elapsedMs"] >= 300
+
+        # The warm-up query has gone through the embedding worker already
+        response = lifespan_client.get(
+            "/retrieve", params={"query": "Q", "top_k": 3, "filters_serialized": "{}"}
+        )
+        assert response.status_code == 200
+        assert lifespan_client.get("/stats").json()["embedding"]["numQueries"] == 2
+
+
+def test_ready_retry(setup, monkeypatch):
+    """Test that failed warm-up phases are retried until the backend is ready."""
+    setup(init_embedding_model=False, init_chromadb_client=False)
+    attempts = []
+
+    def _http_client(host, port):
+        attempts.append(time.monotonic())
+        if len(attempts) == 1:
+            raise ConnectionError("ChromaDB not reachable yet")
+        return MockChromadbClient()
+
+    monkeypatch.setattr("main.STARTUP_REPORT", StartupReport())
+    monkeypatch.setattr("main.WARM_UP_RETRY_INITIAL_DELAY", 0.1)
+    monkeypatch.setattr(
+        "main.load_encoder", lambda *args, **kwargs: ("mock", MockEmbeddingModel())
+    )
+    monkeypatch.setattr("main.init_vertexai", lambda: None)
+    monkeypatch.setattr("chromadb.HttpClient", _http_client)
+
+    with TestClient(app) as lifespan_client:
+        deadline = time.monotonic() + 5
+        while (response := lifespan_client.get("/ready")).status_code == 503:
+            assert time.monotonic() < deadline, "Backend never got ready"
+            time.sleep(0.05)
+
+        report = response.json()
+        assert report["ready"] is True
+        assert report["error"] is None
+        assert report["failures"] == 1
+        assert len(attempts) == 2
+        assert attempts[1] - attempts[0] >= 0.1
+
+
+def test_metrics(setup, monkeypatch):
+    """Test the /metrics endpoint."""
+    setup()
+    stages = [
+        "query_embedding",
+        "chromadb_query",
+        "post_filter",
+        "metadata_fetch",
+        "clean_metadata",
+        "chat_session",
+        "chat_generation",
+    ]
+    counts = {stage: STAGE_DURATION.get_count(stage) for stage in stages}
+    num_errors = main.ERROR_COUNTER.get("RuntimeError")
+
+    filters_serialized = json.dumps({"studyPhases": ["PHASE1"]})
+    client.get(
+        "/retrieve",
+        params={"query": "Q", "top_k": 3, "filters_serialized": filters_serialized},
+    )
+    client.post("/chat/gemini-1.5-flash-001/id0", json={"query": "Dummy query"})
+    for stage in stages:
+        assert STAGE_DURATION.get_count(stage) > counts[stage], stage
+
+    # Unhandled errors are counted by type
+    monkeypatch.setattr("main.CHROMADB_CLIENT", None)
+    error_client = TestClient(app, raise_server_exceptions=False)
+    assert error_client.get("/meta/id0").status_code == 500
+    assert main.ERROR_COUNTER.get("RuntimeError") == num_errors + 1
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    lines = response.text.splitlines()
+    assert "# TYPE veritastrial_stage_duration_seconds histogram" in lines
+    assert (
+        f'veritastrial_errors_total{{type="RuntimeError"}} {num_errors + 1!r}' in lines
+    )
+    assert "veritastrial_chat_sessions 1.0" in lines
+    for stage in stages:
+        count = STAGE_DURATION.get_count(stage)
+        assert (
+            f'veritastrial_stage_duration_seconds_count{{stage="{stage}"}} {count}'
+            in lines
+        )
+
+
+def test_server_timing(setup, monkeypatch):
+    """Test the Server-Timing headers and capturing slow requests."""
+    setup()
+    monkeypatch.setattr(main.SLOW_REQUEST_LOG, "threshold_ms", 0)
+    monkeypatch.setattr(main.SLOW_REQUEST_LOG, "path_thresholds_ms", {"/chat": 0})
+    main.SLOW_REQUEST_LOG.clear()
+
+    filters_serialized = json.dumps({"studyPhases": ["PHASE1"]})
+    response = client.get(
+        "/retrieve",
+        params={
+            "query": "Secret",
+            "top_k": 3,
+            "filters_serialized": filters_serialized,
+        },
+    )
+    server_timing = response.headers["server-timing"].split(", ")
+    names = [entry.split(";")[0] for entry in server_timing]
+    assert names == ["embed", "chroma", "filter", "total"]
+    assert all(entry.split(";")[1].startswith("dur=") for entry in server_timing)
+
+    response = client.get("/meta/id0")
+    assert "meta;dur=" in response.headers["server-timing"]
+    assert "clean;dur=" in response.headers["server-timing"]
+
+    # The generation of streamed responses comes after the headers, so it is only in
+    # the slow request log
+    response = client.post(
+        "/chat/gemini-1.5-flash-001/id0/stream", json={"query": "Dummy query"}
+    )
+    assert "session;dur=" in response.headers["server-timing"]
+    assert "llm;dur=" not in response.headers["server-timing"]
+
+    response = client.get("/debug/slow-requests")
+    assert response.status_code == 200
+    response_json = response.json()
+    assert response_json["thresholdMs"] == 0
+    chat_request, meta_request, retrieve_request = response_json["requests"]
+    assert chat_request["path"] == "/chat/{model}/{item_id}/stream"
+    assert chat_request["method"] == "POST"
+    assert chat_request["params"] == {
+        "model": "gemini-1.5-flash-001",
+        "item_id": "id0",
+    }
+    assert "chat_generation" in chat_request["stagesMs"]
+    assert meta_request["path"] == "/meta/{item_id}"
+    assert meta_request["filterShape"] is None
+    assert retrieve_request["path"] == "/retrieve"
+    assert retrieve_request["status"] == 200
+    assert retrieve_request["params"] == {"query": "<6 chars>", "top_k": "3"}
+    assert retrieve_request["filterShape"] == "studyPhases[1]"
+    assert retrieve_request["stagesMs"].keys() == {
+        "query_embedding",
+        "chromadb_query",
+        "post_filter",
+    }
+    assert retrieve_request["durationMs"] >= sum(retrieve_request["stagesMs"].values())
+    assert {
+        (group["path"], group["filterShape"]) for group in response_json["summary"]
+    } == {
+        ("/chat/{model}/{item_id}/stream", None),
+        ("/meta/{item_id}", None),
+        ("/retrieve", "studyPhases[1]"),
+    }
+    main.SLOW_REQUEST_LOG.clear()
+
+
+def test_stats(setup):
+    """Test the /stats endpoint."""
+    setup()
+    filters_serialized = quote(json.dumps({}))
+    client.get(f"/retrieve?query=Dummy&top_k=3&filters_serialized={filters_serialized}")
+    response = client.get("/stats")
+    assert response.status_code == 200
+    response_json = response.json()
+    assert response_json["embedding"]["numQueries"] >= 1
+    assert response_json["embedding"]["numBatches"] >= 1
+    assert response_json["embeddingCache"]["misses"] == 1
+
+
+def test_embedding_worker_swap(setup, monkeypatch):
+    """Test that swapping the embedding model does not wait for the old worker."""
+    setup()
+    old_worker = main.get_embedding_worker()
+    closed = threading.Event()
+
+    def _close():
+        time.sleep(0.5)
+        closed.set()
+
+    monkeypatch.setattr(old_worker, "close", _close)
+    monkeypatch.setattr("main.EMBEDDING_MODEL", MockEmbeddingModel())
+    start = time.monotonic()
+    new_worker = main.get_embedding_worker()
+    assert time.monotonic() - start < 0.25
+    assert new_worker is not old_worker
+    assert new_worker.model is main.EMBEDDING_MODEL
+    assert closed.wait(timeout=5)
+
+
+def test_retrieve_embedding_cache(setup):
+    """Test that repeated /retrieve queries reuse the cached embedding."""
+    setup()
+    filters_serialized = quote(json.dumps({}))
+    for query in ["Dummy", "  dummy ", "DUMMY"]:
+        response = client.get(
+            f"/retrieve?query={quote(query)}&top_k=3"
+            f"&filters_serialized={filters_serialized}"
+        )
+        assert response.status_code == 200
+    stats = client.get("/stats").json()["embeddingCache"]
+    assert stats["misses"] == 1
+    assert stats["hits"] == 2
+
+
 @pytest.mark.parametrize("top_k", [1, 3, 5])
 def test_retrieve(top_k, setup):
     """Test the /retrieve endpoint."""
@@ -35,6 +310,280 @@ def test_retrieve(top_k, setup):
     assert len(response_json["documents"]) == top_k
 
 
+@pytest.mark.parametrize("filter_pushdown", [True, False])
+def test_retrieve_filter_pushdown(setup, monkeypatch, filter_pushdown):
+    """Test the /retrieve endpoint with filters that may need post-filtering."""
+    setup()
+    monkeypatch.setattr(
+        "main.CHROMADB_CLIENT", MockChromadbClient(filter_pushdown=filter_pushdown)
+    )
+    filters_serialized = quote(json.dumps({"studyPhases": ["PHASE1"]}))
+    response = client.get(
+        f"/retrieve?query=Dummy&top_k=3&filters_serialized={filters_serialized}"
+    )
+    assert response.status_code == 200
+    response_json = response.json()
+
+    # With filter pushdown the mock collection returns top_k results as is, otherwise
+    # the mock sample metadata in phase "NA" are all post-filtered out, even after
+    # over-fetching all records in the collection
+    assert len(response_json["ids"]) == (3 if filter_pushdown else 0)
+    stats = client.get("/stats").json()["overfetch"]
+    assert stats["numRequests"] == (0 if filter_pushdown else 1)
+    assert stats["numShort"] == (0 if filter_pushdown else 1)
+
+
+def test_retrieve_result_cache(setup, monkeypatch):
+    """Test that /retrieve responses are cached per collection version."""
+    setup()
+    filters_serialized = quote(json.dumps({"studyType": "interventional"}))
+    url = f"/retrieve?query=Dummy&top_k=3&filters_serialized={filters_serialized}"
+
+    responses = [client.get(url).json() for _ in range(2)]
+    assert responses[0] == responses[1]
+    stats = client.get("/stats").json()["resultCache"]
+    assert stats["misses"] == 1
+    assert stats["hits"] == 1
+
+    # A rebuilt collection with a new version stamp invalidates the cache
+    monkeypatch.setattr("main.CHROMADB_CLIENT", MockChromadbClient(version="v2"))
+    client.get(url)
+    stats = client.get("/stats").json()["resultCache"]
+    assert stats["misses"] == 2
+    assert stats["entries"] == 1
+
+
+def test_retrieve_local_index(setup, monkeypatch, tmp_path):
+    """Test the /retrieve endpoint served from the local vector index."""
+    setup()
+    monkeypatch.setattr("main.RETRIEVAL_BACKEND", "local")
+    monkeypatch.setattr("main.LOCAL_INDEX_PATH", str(tmp_path))
+    monkeypatch.setattr("main.LOCAL_INDEX_CHECK_INTERVAL", 60)
+
+    def _query(*args, **kwargs):
+        raise AssertionError("Unexpected ChromaDB query")
+
+    monkeypatch.setattr("conftest.MockChromadbCollection.query", _query)
+    params = {"query": "Dummy query", "top_k": 3, "filters_serialized": "{}"}
+    response = client.get("/retrieve", params=params)
+    assert response.status_code == 200
+    assert response.json() == {
+        "ids": ["id0", "id1", "id2"],
+        "documents": ["doc-id0", "doc-id1", "doc-id2"],
+    }
+    assert main.LOCAL_INDEX.version == "v1"
+
+    filters = json.dumps({"studyType": "observational"})
+    response = client.get("/retrieve", params={**params, "filters_serialized": filters})
+    assert response.json() == {"ids": [], "documents": []}
+
+    # The index is refreshed once the check interval has passed and the collection
+    # has been rebuilt in the meantime
+    monkeypatch.setattr("main.CHROMADB_CLIENT", MockChromadbClient(version="v2"))
+    client.get("/retrieve", params=params)
+    assert main.LOCAL_INDEX.version == "v1"
+    monkeypatch.setattr("main.LOCAL_INDEX_CHECK_INTERVAL", 0)
+    client.get("/retrieve", params=params)
+    assert main.LOCAL_INDEX.version == "v2"
+
+
+@pytest.mark.parametrize(
+    "backend, filters",
+    [
+        ("chromadb", {}),
+        ("chromadb", {"studyPhases": ["NA"]}),
+        ("local", {}),
+    ],
+)
+def test_retrieve_fields(setup, monkeypatch, tmp_path, backend, filters):
+    """Test the /retrieve endpoint with metadata fields and distances."""
+    setup()
+    monkeypatch.setattr("main.RETRIEVAL_BACKEND", backend)
+    monkeypatch.setattr("main.LOCAL_INDEX_PATH", str(tmp_path))
+    fields = ["shortTitle", "studyPhases", "conditions"]
+    params = {
+        "query": "Dummy query",
+        "top_k": 3,
+        "filters_serialized": json.dumps(filters),
+        "fields": fields,
+        "include_distances": True,
+    }
+    response = client.get("/retrieve", params=params)
+    assert response.status_code == 200
+    response_json = response.json()
+    assert len(response_json["ids"]) == 3
+    for item_id, metadata in zip(response_json["ids"], response_json["metadatas"]):
+        full_metadata = client.get(f"/meta/{item_id}").json()["metadata"]
+        assert metadata == {field: full_metadata[field] for field in fields}
+    distances = response_json["distances"]
+    assert len(distances) == 3
+    assert distances == sorted(distances)
+
+    # Responses with and without the fields are cached separately
+    response_json = client.get(
+        "/retrieve", params={**params, "fields": [], "include_distances": False}
+    ).json()
+    assert set(response_json) == {"ids", "documents"}
+    assert client.get("/stats").json()["resultCache"]["entries"] == 2
+
+
+def test_retrieve_invalid_fields(setup):
+    """Test the /retrieve endpoint with unknown metadata fields."""
+    setup()
+    params = {"query": "Dummy", "top_k": 3, "filters_serialized": "{}"}
+    response = client.get("/retrieve", params={**params, "fields": ["nonexistent"]})
+    assert response.status_code == 422
+    assert "nonexistent" in response.text
+
+
+def _parse_ndjson(text):
+    """Parse the lines of an NDJSON response, ordered by their query indices."""
+    lines = [json.loads(line) for line in text.splitlines()]
+    return sorted(lines, key=lambda line: line["index"])
+
+
+def test_retrieve_batch(setup):
+    """Test the /retrieve/batch endpoint."""
+    setup()
+    client.get(
+        "/retrieve", params={"query": "A", "top_k": 1, "filters_serialized": "{}"}
+    )
+    queries = [
+        {"query": "A", "topK": 2},
+        {"query": "B", "topK": 3, "filters": {"studyType": "interventional"}},
+        {"query": "C", "topK": 1, "filters": {}},
+        {"query": "D", "topK": 4, "filters": {"studyType": "interventional"}},
+    ]
+    worker_stats = main.get_embedding_worker().stats()
+    num_queries = STAGE_DURATION.get_count("chromadb_query")
+    response = client.post("/retrieve/batch", json={"queries": queries})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+
+    # The uncached queries are encoded with a single call, and the queries with the
+    # same filters are sent to ChromaDB as a single query
+    stats = main.get_embedding_worker().stats()
+    assert stats["numBatches"] == worker_stats["numBatches"] + 1
+    assert stats["numQueries"] == worker_stats["numQueries"] + 3
+    assert STAGE_DURATION.get_count("chromadb_query") == num_queries + 2
+
+    lines = _parse_ndjson(response.text)
+    assert [line["index"] for line in lines] == [0, 1, 2, 3]
+    for line, query in zip(lines, queries):
+        assert line["ids"] == [f"id{i}" for i in range(query["topK"])]
+        assert line["documents"] == [f"doc-{key}" for key in line["ids"]]
+
+    # Bulk queries neither use nor populate the caches of interactive queries
+    stats = client.get("/stats").json()
+    assert stats["embeddingCache"]["entries"] == 1
+    assert stats["resultCache"]["entries"] == 1
+
+
+def test_retrieve_batch_post_filter(setup):
+    """Test the /retrieve/batch endpoint with filters that need post-filtering."""
+    setup()
+    queries = [
+        {"query": "A", "topK": 3, "filters": {"studyPhases": ["NA"]}},
+        {"query": "B", "topK": 3, "filters": {"studyPhases": ["PHASE1"]}},
+    ]
+    response = client.post(
+        "/retrieve/batch",
+        json={
+            "queries": queries,
+            "fields": ["shortTitle", "studyPhases"],
+            "includeDistances": True,
+        },
+    )
+    assert response.status_code == 200
+    lines = _parse_ndjson(response.text)
+
+    # The mock sample metadata are all in phase "NA"
+    assert lines[0]["ids"] == ["id0", "id1", "id2"]
+    assert lines[0]["metadatas"] == [
+        {"shortTitle": f"Sample Metadata {key}", "studyPhases": "NA"}
+        for key in lines[0]["ids"]
+    ]
+    assert lines[0]["distances"] == sorted(lines[0]["distances"])
+    assert lines[1]["ids"] == []
+    assert client.get("/stats").json()["overfetch"]["numRequests"] == 2
+
+
+def test_retrieve_batch_local_index(setup, monkeypatch, tmp_path):
+    """Test the /retrieve/batch endpoint served from the local vector index."""
+    setup()
+    monkeypatch.setattr("main.RETRIEVAL_BACKEND", "local")
+    monkeypatch.setattr("main.LOCAL_INDEX_PATH", str(tmp_path))
+
+    def _query(*args, **kwargs):
+        raise AssertionError("Unexpected ChromaDB query")
+
+    monkeypatch.setattr("conftest.MockChromadbCollection.query", _query)
+    queries = [
+        {"query": "A", "topK": 2},
+        {"query": "B", "topK": 3, "filters": {"studyType": "observational"}},
+    ]
+    response = client.post("/retrieve/batch", json={"queries": queries})
+    assert response.status_code == 200
+    assert _parse_ndjson(response.text) == [
+        {"index": 0, "ids": ["id0", "id1"], "documents": ["doc-id0", "doc-id1"]},
+        {"index": 1, "ids": [], "documents": []},
+    ]
+
+
+def test_retrieve_batch_error(setup, monkeypatch):
+    """Test that failed groups of queries stream their errors."""
+    setup()
+
+    def _query(self, *, query_embeddings, n_results, include, where=None):
+        if where is not None:
+            raise ValueError("Dummy error")
+        return original_query(
+            self,
+            query_embeddings=query_embeddings,
+            n_results=n_results,
+            include=include,
+        )
+
+    original_query = MockChromadbCollection.query
+    monkeypatch.setattr("conftest.MockChromadbCollection.query", _query)
+    queries = [
+        {"query": "A", "topK": 2, "filters": {"studyType": "interventional"}},
+        {"query": "B", "topK": 2},
+    ]
+    response = client.post("/retrieve/batch", json={"queries": queries})
+    assert response.status_code == 200
+    lines = _parse_ndjson(response.text)
+    assert "Dummy error" in lines[0]["details"]
+    assert lines[1]["ids"] == ["id0", "id1"]
+
+
+@pytest.mark.parametrize(
+    "payload",
+    [
+        {"queries": []},
+        {"queries": [{"query": "A", "topK": 0}]},
+        {"queries": [{"query": "A", "topK": 31}]},
+        {"queries": [{"query": "A", "topK": 3}], "fields": ["nonexistent"]},
+        {"queries": [{"query": "A", "topK": 3}] * 1001},
+    ],
+)
+def test_retrieve_batch_invalid(setup, payload):
+    """Test the /retrieve/batch endpoint with invalid payloads."""
+    setup()
+    assert client.post("/retrieve/batch", json=payload).status_code == 422
+
+
+@pytest.mark.parametrize("init_embedding_model", [True, False])
+def test_retrieve_batch_partial_setup(setup, init_embedding_model):
+    """Test the /retrieve/batch endpoint with partial setup."""
+    setup(init_embedding_model=init_embedding_model, init_chromadb_client=False)
+    match = "ChromaDB not reachable"
+    if not init_embedding_model:
+        match = "Embedding model not initialized"
+    with pytest.raises(RuntimeError, match=match):
+        client.post("/retrieve/batch", json={"queries": [{"query": "A", "topK": 3}]})
+
+
 @pytest.mark.parametrize("top_k", [0, 31])
 def test_retrieve_invalid_top_k(top_k, setup):
     """Test the /retrieve endpoint with invalid top_k."""
@@ -86,6 +635,131 @@ def test_meta(item_id, setup):
     assert response_json["metadata"]["shortTitle"] == f"Sample Metadata {item_id}"
 
 
+@pytest.mark.parametrize("serialized", [True, False])
+def test_meta_cache(setup, monkeypatch, serialized):
+    """Test that /meta/{item_id} responses reuse cached metadata."""
+    setup()
+    monkeypatch.setattr("main.METADATA_CACHE_SERIALIZED", serialized)
+    responses = [client.get("/meta/id0") for _ in range(3)]
+    for response in responses:
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/json"
+    assert responses[0].json() == responses[1].json() == responses[2].json()
+    assert responses[0].json()["metadata"]["shortTitle"] == "Sample Metadata id0"
+
+    stats = client.get("/stats").json()
+    if serialized:
+        assert stats["metaResponseCache"]["hits"] == 2
+        assert stats["metadataCache"]["misses"] == 1
+        assert stats["metadataCache"]["hits"] == 0
+    else:
+        assert stats["metaResponseCache"]["entries"] == 0
+        assert stats["metadataCache"]["hits"] == 2
+
+    # A rebuilt collection with a new version stamp invalidates the cache
+    monkeypatch.setattr("main.CHROMADB_CLIENT", MockChromadbClient(version="v2"))
+    assert client.get("/meta/id0").status_code == 200
+    stats = client.get("/stats").json()
+    assert stats["metadataCache"]["misses"] == 2
+
+
+@pytest.mark.parametrize("serialized", [True, False])
+def test_meta_collection_handle(setup, monkeypatch, serialized):
+    """Test that warm /meta/{item_id} requests do not touch ChromaDB at all."""
+    setup()
+    monkeypatch.setattr("main.METADATA_CACHE_SERIALIZED", serialized)
+    chromadb_client = MockChromadbClient()
+    monkeypatch.setattr("main.CHROMADB_CLIENT", chromadb_client)
+    names = []
+    original_get_collection = chromadb_client.get_collection
+
+    def _get_collection(name):
+        names.append(name)
+        return original_get_collection(name)
+
+    monkeypatch.setattr(chromadb_client, "get_collection", _get_collection)
+    assert client.get("/meta/id0").status_code == 200
+    assert len(names) == 1
+    for _ in range(3):
+        assert client.get("/meta/id0").status_code == 200
+    assert len(names) == 1
+
+    # The handle is refreshed once the check interval has passed, noticing a
+    # rebuilt collection by its version stamp
+    chromadb_client.version = "v2"
+    monkeypatch.setattr("main.COLLECTION_CHECK_INTERVAL", 0)
+    assert client.get("/meta/id0").status_code == 200
+    assert len(names) == 2
+    stats = client.get("/stats").json()
+    assert stats["metadataCache"]["misses"] == 2
+
+
+def test_meta_missing(setup):
+    """Test the /meta/{item_id} endpoint with an item missing from the collection."""
+    setup()
+    response = client.get("/meta/nonexistent")
+    assert response.status_code == 404
+
+
+def test_meta_batch(setup):
+    """Test the /meta endpoint for a batch of items."""
+    setup()
+    item_ids = ["id2", "nonexistent", "id0", "id2"]
+    num_fetches = STAGE_DURATION.get_count("metadata_fetch")
+    response = client.post("/meta", json={"ids": item_ids})
+    assert STAGE_DURATION.get_count("metadata_fetch") == num_fetches + 1
+    assert response.status_code == 200
+    response_json = response.json()
+    assert list(response_json["metadatas"]) == ["id2", "id0"]
+    assert response_json["missing"] == ["nonexistent"]
+    for item_id, metadata in response_json["metadatas"].items():
+        assert metadata == client.get(f"/meta/{item_id}").json()["metadata"]
+
+    # Fetched items are cached, so that only uncached items are fetched next time
+    stats = client.get("/stats").json()
+    assert stats["metadataCache"]["entries"] == 2
+    response = client.post("/meta", json={"ids": ["id0", "id1"]})
+    assert list(response.json()["metadatas"]) == ["id0", "id1"]
+    stats = client.get("/stats").json()
+    assert stats["metadataCache"]["entries"] == 3
+
+
+def test_meta_batch_fields(setup):
+    """Test the /meta endpoint for a batch of items projected to some fields."""
+    setup()
+    fields = ["shortTitle", "lastUpdateDatePosted", "conditions"]
+    client.get("/meta/id0")  # Cached full metadata are projected as well
+    response = client.post("/meta", json={"ids": ["id0", "id1"], "fields": fields})
+    assert response.status_code == 200
+    metadatas = response.json()["metadatas"]
+    assert list(metadatas) == ["id0", "id1"]
+    for item_id, metadata in metadatas.items():
+        assert list(metadata) == fields
+        full_metadata = client.get(f"/meta/{item_id}").json()["metadata"]
+        assert metadata == {field: full_metadata[field] for field in fields}
+
+
+@pytest.mark.parametrize(
+    "payload",
+    [
+        {"ids": ["id0"], "fields": ["shortTitle", "nonexistent"]},
+        {"ids": [f"id{i}" for i in range(101)]},
+        {"fields": ["shortTitle"]},
+    ],
+)
+def test_meta_batch_invalid(setup, payload):
+    """Test the /meta endpoint with invalid payloads."""
+    setup()
+    assert client.post("/meta", json=payload).status_code == 422
+
+
+def test_meta_batch_partial_setup(setup):
+    """Test the /meta endpoint with partial setup."""
+    setup(init_chromadb_client=False)
+    with pytest.raises(RuntimeError, match="ChromaDB not reachable"):
+        client.post("/meta", json={"ids": ["id0"]})
+
+
 def test_meta_partial_setup(setup):
     """Test the /meta/{item_id} endpoint with partial setup."""
     setup(init_chromadb_client=False)
@@ -93,4 +767,399 @@ def test_meta_partial_setup(setup):
         client.get("/meta/id0")
 
 
-# TODO: Add tests for the /chat/{model}/{item_id} endpoint
+def _parse_sse(text):
+    """Helper function to parse Server-Sent Events into (event, data) pairs."""
+    events = []
+    for block in text.strip().split("\n\n"):
+        event, data = None, None
+        for line in block.split("\n"):
+            if line.startswith("event: "):
+                event = line.removeprefix("event: ")
+            elif line.startswith("data: "):
+                data = json.loads(line.removeprefix("data: "))
+        events.append((event, data))
+    return events
+
+
+def _record_chat_sessions(monkeypatch):
+    """Helper function to record the chat sessions created by the endpoints."""
+    sessions = []
+
+    class RecordingChatSession(MockChatSession):
+        def __init__(self, model, history=None):
+            super().__init__(model, history=history)
+            sessions.append(self)
+
+    monkeypatch.setattr("vertexai.generative_models.ChatSession", RecordingChatSession)
+    return sessions
+
+
+@pytest.mark.parametrize("model", ["gemini-1.5-flash-001", "6894888983713546240"])
+def test_chat(model, setup, monkeypatch):
+    """Test the /chat/{model}/{item_id} endpoint."""
+    setup()
+    sessions = _record_chat_sessions(monkeypatch)
+    payload = {"query": "Dummy query", "sessionId": "client0"}
+    response = client.post(f"/chat/{model}/id0", json=payload)
+    assert response.status_code == 200
+    assert response.json() == {
+        "response": "Dummy response text.",
+        "sessionId": "client0",
+    }
+
+    # The chat session is rebuilt from the stored history of the same client
+    chat_session = sessions[-1]
+    assert "Title: Sample Metadata id0" in chat_session.model.system_instruction
+    if model == "gemini-1.5-flash-001":
+        assert chat_session.model.model_name == model
+    else:
+        assert chat_session.model.model_name.endswith(f"/endpoints/{model}")
+    client.post(f"/chat/{model}/id0", json=payload)
+    assert len(sessions[-1].history) == 4
+    assert [c.role for c in main.CHAT_SESSIONS.load(f"client0:{model}:id0")] == [
+        "user",
+        "model",
+        "user",
+        "model",
+    ]
+    stats = client.get("/stats").json()
+    assert stats["trialSectionsCache"]["hits"] == 1  # Rendered once per trial
+    assert stats["chatTiming"]["numResponses"] == 2
+    assert stats["chatSessions"]["sessions"] == 1
+    assert stats["chatSessions"]["created"] == 1
+    assert stats["chatSessions"]["estimatedBytes"] > 0
+
+
+def test_chat_session_ids(setup):
+    """Test that clients get separate chat sessions."""
+    setup()
+    response = client.post("/chat/gemini-1.5-flash-001/id0", json={"query": "Q"})
+    session_id = response.json()["sessionId"]
+    assert len(session_id) > 0
+
+    # Clients without a session ID get a new one each time
+    response = client.post("/chat/gemini-1.5-flash-001/id0", json={"query": "Q"})
+    assert response.json()["sessionId"] != session_id
+    client.post(
+        "/chat/gemini-1.5-flash-001/id0", json={"query": "Q", "sessionId": session_id}
+    )
+    assert main.CHAT_SESSIONS.stats()["sessions"] == 2
+    history = main.CHAT_SESSIONS.load(f"{session_id}:gemini-1.5-flash-001:id0")
+    assert len(history) == 4
+
+    response = client.post(
+        "/chat/gemini-1.5-flash-001/id0", json={"query": "Q", "sessionId": "x" * 129}
+    )
+    assert response.status_code == 422
+
+
+def test_chat_history_budget(setup, monkeypatch):
+    """Test that chat prompts stay within the token budget over many turns."""
+    setup()
+    monkeypatch.setattr("conftest.MockChatSession.CHUNKS", ["Long response. " * 50])
+    payload = {"query": "Q", "sessionId": "client0"}
+    client.post("/chat/gemini-1.5-flash-001/id0", json=payload)
+    base_tokens = client.get("/stats").json()["chatPrompt"]["maxPromptTokens"]
+
+    # Leave room for about three turns besides the system instruction and summary
+    budget = base_tokens + 100 + 3 * 200
+    monkeypatch.setattr(
+        "main.HISTORY_MANAGER",
+        HistoryManager(token_budget=budget, summary_max_tokens=100),
+    )
+    for _ in range(10):
+        client.post("/chat/gemini-1.5-flash-001/id0", json=payload)
+
+    stats = client.get("/stats").json()["chatPrompt"]
+    assert stats["numPrompts"] == 11
+    assert stats["maxPromptTokens"] <= budget
+    assert stats["numTruncated"] > 0
+    history = main.CHAT_SESSIONS.load("client0:gemini-1.5-flash-001:id0")
+    assert history[0].parts[0].text.startswith(SUMMARY_PREFIX)
+
+
+def test_chat_stream(setup, monkeypatch):
+    """Test the /chat/{model}/{item_id}/stream endpoint."""
+    setup()
+    monkeypatch.setattr("conftest.MockChatSession.DELAY", 0.02)
+    response = client.post(
+        "/chat/gemini-1.5-flash-001/id0/stream",
+        json={"query": "Dummy query", "sessionId": "client0"},
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert _parse_sse(response.text) == [
+        (None, {"text": "Dummy "}),
+        (None, {"text": "response "}),
+        (None, {"text": "text."}),
+        ("done", {"response": "Dummy response text.", "sessionId": "client0"}),
+    ]
+
+    # The full response is added to the session history at the end
+    history = main.CHAT_SESSIONS.load("client0:gemini-1.5-flash-001:id0")
+    assert history[-1].role == "model"
+    assert history[-1].parts[0].text == "Dummy response text."
+
+    stats = client.get("/stats").json()["chatTiming"]
+    assert stats["numStreamed"] == 1
+    assert 0 < stats["meanFirstTokenMs"] < stats["meanGenerationMs"]
+
+
+def test_chat_stream_error(setup, monkeypatch):
+    """Test the /chat/{model}/{item_id}/stream endpoint with a failing model."""
+    setup()
+    monkeypatch.setattr(
+        "conftest.MockChatSession.CHUNKS", ["Dummy ", RuntimeError("Blocked")]
+    )
+    response = client.post(
+        "/chat/gemini-1.5-flash-001/id0/stream", json={"query": "Dummy query"}
+    )
+    assert response.status_code == 200
+    events = _parse_sse(response.text)
+    assert events[0] == (None, {"text": "Dummy "})
+    assert events[-1][0] == "error"
+    assert "RuntimeError: Blocked" in events[-1][1]["details"]
+    assert client.get("/stats").json()["chatTiming"]["numResponses"] == 0
+
+
+def test_chat_sections(setup, monkeypatch):
+    """Test that only the sections relevant to the query are in the chat context."""
+    setup()
+    monkeypatch.setattr("main.CHROMADB_CLIENT", MockChromadbClient(sections=True))
+    sessions = _record_chat_sessions(monkeypatch)
+    payload = {"query": "Q", "sessionId": "client0"}
+    for _ in range(2):
+        response = client.post("/chat/gemini-1.5-flash-001/id0", json=payload)
+        assert response.status_code == 200
+
+    system_instruction = sessions[-1].model.system_instruction
+    assert "Title: Sample Metadata id0" in system_instruction  # The core section
+    assert "Inclusion criteria:" in system_instruction
+    assert "Primary outcomes:" in system_instruction
+    assert "Locations" not in system_instruction
+    assert "Interventions:" not in system_instruction
+    assert client.get("/stats").json()["sectionVectorsCache"]["hits"] == 1
+
+
+@pytest.mark.parametrize("sections", [True, False])
+def test_chat_sections_fallback(sections, setup, monkeypatch):
+    """Test that the full context is used if section retrieval is unavailable."""
+    setup()
+    monkeypatch.setattr("main.CHROMADB_CLIENT", MockChromadbClient(sections=sections))
+    if sections:
+        monkeypatch.setattr("main.CHAT_TOP_SECTIONS", 0)
+    sessions = _record_chat_sessions(monkeypatch)
+    response = client.post("/chat/gemini-1.5-flash-001/id0", json={"query": "Q"})
+    assert response.status_code == 200
+    system_instruction = sessions[-1].model.system_instruction
+    assert "Locations (2 total):" in system_instruction
+    assert "Interventions:" in system_instruction
+
+    # A missing sections collection may be being rebuilt, so it is not cached
+    assert client.get("/stats").json()["sectionVectorsCache"]["entries"] == 0
+
+
+def test_chat_sections_rebuilding(setup, monkeypatch):
+    """Test that sections are not cached until their collection has caught up."""
+    setup()
+    chromadb_client = MockChromadbClient(
+        version="v2", sections=True, sections_version="v1"
+    )
+    monkeypatch.setattr("main.CHROMADB_CLIENT", chromadb_client)
+    monkeypatch.setattr("main.COLLECTION_CHECK_INTERVAL", 0)
+    sessions = _record_chat_sessions(monkeypatch)
+    payload = {"query": "Q", "sessionId": "client0"}
+    response = client.post("/chat/gemini-1.5-flash-001/id0", json=payload)
+    assert response.status_code == 200
+    assert "Locations" not in sessions[-1].model.system_instruction
+    assert client.get("/stats").json()["sectionVectorsCache"]["entries"] == 0
+
+    # Once the sections collection is stamped with the same version, the sections
+    # are cached again
+    chromadb_client.sections_version = None
+    response = client.post("/chat/gemini-1.5-flash-001/id0", json=payload)
+    assert response.status_code == 200
+    assert client.get("/stats").json()["sectionVectorsCache"]["entries"] == 1
+
+
+def test_chat_sections_transient_failure(setup, monkeypatch):
+    """Test that transient failures of section retrieval are not cached."""
+    setup()
+    monkeypatch.setattr("main.CHROMADB_CLIENT", MockChromadbClient(sections=True))
+    sessions = _record_chat_sessions(monkeypatch)
+    original_get = MockChromadbSectionsCollection.get
+    failures = [ConnectionError("Connection reset")]
+
+    def _get(self, *, where, include):
+        if failures:
+            raise failures.pop()
+        return original_get(self, where=where, include=include)
+
+    monkeypatch.setattr("conftest.MockChromadbSectionsCollection.get", _get)
+    for _ in range(2):
+        payload = {"query": "Q", "sessionId": "client0"}
+        response = client.post("/chat/gemini-1.5-flash-001/id0", json=payload)
+        assert response.status_code == 200
+
+    # The first turn falls back to the full context, and the next one retries
+    # rather than hitting a cached fallback
+    assert "Locations (2 total):" in sessions[0].model.system_instruction
+    stats = client.get("/stats").json()["sectionVectorsCache"]
+    assert stats["misses"] == 2
+    assert stats["entries"] == 1
+
+
+def test_chat_sections_fallback_intact(setup, monkeypatch):
+    """Test that long sections reach the full context fallback intact."""
+    setup()
+    monkeypatch.setattr("main.CHAT_SECTION_MAX_CHARS", 100)
+    criteria = "\n".join(f"Criterion {i}: adults aged 18 or older" for i in range(500))
+    monkeypatch.setitem(SAMPLE_METADATA, "inclusion_criteria", criteria)
+    sessions = _record_chat_sessions(monkeypatch)
+    response = client.post("/chat/gemini-1.5-flash-001/id0", json={"query": "Q"})
+    assert response.status_code == 200
+    system_instruction = sessions[-1].model.system_instruction
+    assert criteria in system_instruction
+    assert "(truncated)" not in system_instruction
+
+
+@pytest.mark.parametrize("stream", [True, False])
+def test_chat_answer_cache(stream, setup, monkeypatch):
+    """Test that first-turn questions are answered from the answer cache."""
+    setup()
+    monkeypatch.setattr(main.ANSWER_CACHE, "threshold", 0.95)
+    sessions = _record_chat_sessions(monkeypatch)
+    path = "/chat/gemini-1.5-flash-001/id0" + ("/stream" if stream else "")
+
+    def _post(query, session_id):
+        response = client.post(path, json={"query": query, "sessionId": session_id})
+        assert response.status_code == 200
+        if stream:
+            event, data = _parse_sse(response.text)[-1]
+            assert event == "done"
+            return data
+        return response.json()
+
+    assert _post("What are the criteria?", "client0")["response"] == (
+        "Dummy response text."
+    )
+    assert len(sessions) == 1
+
+    # Other clients asking the same or a similar question hit the cache without
+    # calling the model, and the cached turn is added to their histories
+    assert _post("what are the  criteria?", "client1") == {
+        "response": "Dummy response text.",
+        "sessionId": "client1",
+    }
+    _post("Who can join?", "client2")  # The mock embeddings are all the same
+    assert len(sessions) == 1
+    history = main.CHAT_SESSIONS.load("client2:gemini-1.5-flash-001:id0")
+    assert [c.parts[0].text for c in history] == [
+        "Who can join?",
+        "Dummy response text.",
+    ]
+
+    # Questions with contrasting meanings are not shared, however similar
+    _post("What are the exclusion criteria?", "client3")
+    assert len(sessions) == 2
+
+    # Follow-up questions are never answered from the cache
+    _post("What are the criteria?", "client0")
+    assert len(sessions) == 3
+    assert len(sessions[-1].history) == 4
+
+    # A new version of the collection invalidates the cached answers
+    monkeypatch.setattr("main.CHROMADB_CLIENT", MockChromadbClient(version="v2"))
+    _post("What are the criteria?", "client4")
+    assert len(sessions) == 4
+
+    stats = client.get("/stats").json()["answerCache"]
+    assert stats["exactHits"] == 1
+    assert stats["semanticHits"] == 1
+    assert stats["misses"] == 3
+    assert stats["entries"] == 1
+
+
+def test_chat_answer_cache_exact(setup, monkeypatch):
+    """Test that only exact questions hit the answer cache by default."""
+    setup()
+    sessions = _record_chat_sessions(monkeypatch)
+    path = "/chat/gemini-1.5-flash-001/id0"
+    for session_id, query in enumerate(
+        [
+            "What are the inclusion criteria?",
+            "What are the exclusion criteria?",  # Same mock embedding
+            "what are the  inclusion criteria?",
+        ]
+    ):
+        response = client.post(
+            path, json={"query": query, "sessionId": f"client{session_id}"}
+        )
+        assert response.status_code == 200
+
+    assert len(sessions) == 2
+    stats = client.get("/stats").json()["answerCache"]
+    assert stats["exactHits"] == 1
+    assert stats["semanticHits"] == 0
+
+
+def test_chat_timeout(setup, monkeypatch):
+    """Test the /chat/{model}/{item_id} endpoint with a model that is too slow."""
+    setup()
+    monkeypatch.setattr("main.CHAT_TIMEOUT", 0.05)
+    monkeypatch.setattr("conftest.MockChatSession.DELAY", 0.1)
+    response = client.post("/chat/gemini-1.5-flash-001/id0", json={"query": "Q"})
+    assert response.status_code == 504
+    assert client.get("/stats").json()["chatTiming"]["numTimeouts"] == 1
+
+
+def test_chat_does_not_block(setup, monkeypatch):
+    """Test that in-flight chats do not block other endpoints."""
+    setup()
+    monkeypatch.setattr("conftest.MockChatSession.DELAY", 0.2)  # 0.6s per chat
+    n_chats = 20
+
+    async def _run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as c:
+            chats = [
+                asyncio.create_task(
+                    c.post("/chat/gemini-1.5-flash-001/id0", json={"query": "Q"})
+                )
+                for _ in range(n_chats)
+            ]
+            await asyncio.sleep(0.05)  # Let all chats get in flight
+
+            # Other endpoints stay responsive while the chats are in flight
+            latencies = []
+            for i in range(5):
+                for path, params in [
+                    ("/heartbeat", {}),
+                    (
+                        "/retrieve",
+                        {"query": f"Q{i}", "top_k": 3, "filters_serialized": "{}"},
+                    ),
+                ]:
+                    started_at = time.perf_counter()
+                    response = await c.get(path, params=params)
+                    latencies.append(time.perf_counter() - started_at)
+                    assert response.status_code == 200
+            assert not any(chat.done() for chat in chats)
+
+            # The chats are generated concurrently rather than one after another
+            responses = await asyncio.gather(*chats)
+            return latencies, responses
+
+    started_at = time.perf_counter()
+    latencies, responses = asyncio.run(_run())
+    elapsed = time.perf_counter() - started_at
+    assert max(latencies) < 0.15
+    assert all(response.status_code == 200 for response in responses)
+    assert elapsed < 0.6 * n_chats / 4
+
+
+def test_chat_partial_setup(setup):
+    """Test the /chat/{model}/{item_id} endpoint with partial setup."""
+    setup(init_chromadb_client=False)
+    with pytest.raises(RuntimeError, match="ChromaDB not reachable"):
+        client.post("/chat/gemini-1.5-flash-001/id0", json={"query": "Dummy query"})
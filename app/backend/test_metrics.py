@@ -0,0 +1,64 @@
+"""Test the metrics module."""
+
+import pytest
+
+from metrics import Histogram, MetricsRegistry
+
+
+def test_metrics_registry():
+    """Test rendering metrics in the Prometheus text format."""
+    registry = MetricsRegistry()
+    errors = registry.counter("errors_total", "Errors.", labelnames=("type",))
+    registry.gauge("sessions", "Sessions.", lambda: 3)
+    durations = registry.histogram(
+        "duration_seconds", "Durations.", labelnames=("stage",), buckets=(0.1, 1)
+    )
+    errors.inc("RuntimeError")
+    errors.inc("RuntimeError")
+    errors.inc('Odd"Error\\')
+    durations.observe(0.1, "a")
+    durations.observe(0.5, "a")
+    durations.observe(5, "a")
+    with durations.time("b"):
+        pass
+
+    assert errors.get("RuntimeError") == 2
+    assert durations.get_count("a") == 3
+    assert durations.get_sum("a") == pytest.approx(5.6)
+    assert durations.get_count("b") == 1
+    assert registry.render().splitlines() == [
+        "# HELP errors_total Errors.",
+        "# TYPE errors_total counter",
+        'errors_total{type="Odd\\"Error\\\\"} 1.0',
+        'errors_total{type="RuntimeError"} 2.0',
+        "# HELP sessions Sessions.",
+        "# TYPE sessions gauge",
+        "sessions 3.0",
+        "# HELP duration_seconds Durations.",
+        "# TYPE duration_seconds histogram",
+        'duration_seconds_bucket{stage="a",le="0.1"} 1',
+        'duration_seconds_bucket{stage="a",le="1.0"} 2',
+        'duration_seconds_bucket{stage="a",le="+Inf"} 3',
+        'duration_seconds_sum{stage="a"} 5.6',
+        'duration_seconds_count{stage="a"} 3',
+        'duration_seconds_bucket{stage="b",le="0.1"} 1',
+        'duration_seconds_bucket{stage="b",le="1.0"} 1',
+        'duration_seconds_bucket{stage="b",le="+Inf"} 1',
+        f'duration_seconds_sum{{stage="b"}} {durations.get_sum("b")!r}',
+        'duration_seconds_count{stage="b"} 1',
+    ]
+
+    with pytest.raises(ValueError, match="Duplicate metric"):
+        registry.gauge("sessions", "Sessions.", lambda: 0)
+    with pytest.raises(ValueError, match="Required label values"):
+        errors.inc()
+    with pytest.raises(ValueError, match="Required label values"):
+        durations.observe(1)
+
+
+def test_histogram_buckets():
+    """Test that histogram buckets must be strictly increasing."""
+    with pytest.raises(ValueError, match="strictly increasing"):
+        Histogram("h", "H.", buckets=(1, 0.1))
+    with pytest.raises(ValueError, match="strictly increasing"):
+        Histogram("h", "H.", buckets=(0.1, 0.1))
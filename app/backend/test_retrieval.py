@@ -0,0 +1,256 @@
+"""Test the retrieval module."""
+
+import numpy as np
+import pytest
+
+from conftest import SAMPLE_METADATA, MockChromadbSectionsCollection
+from retrieval import (
+    SectionVectors,
+    SelectivityTracker,
+    batch_query,
+    fetch_section_vectors,
+    overfetch_query,
+    select_sections,
+)
+
+
+class PhasedChromadbCollection:
+    """Mock ChromaDB collection where every fifth record is in phase I."""
+
+    def __init__(self, n_records=100):
+        self.n_records = n_records
+        self.n_results_history = []
+
+    def query(self, *, query_embeddings, n_results, include, where=None):
+        self.n_results_history.append(n_results)
+        ids = [f"id{i}" for i in range(min(n_results, self.n_records))]
+        metadatas = []
+        for i in range(len(ids)):
+            metadata = SAMPLE_METADATA.copy()
+            metadata["study_phases"] = "PHASE1" if i % 5 == 0 else "PHASE2, PHASE3"
+            metadatas.append(metadata)
+        n_queries = len(query_embeddings)
+        result = dict(
+            ids=[ids] * n_queries,
+            documents=[[f"doc-{key}" for key in ids]] * n_queries,
+            metadatas=[metadatas] * n_queries,
+        )
+        if "distances" in include:
+            result["distances"] = [[i / 100 for i in range(len(ids))]] * n_queries
+        return result
+
+
+def _overfetch(collection, tracker, top_k, filters, **kwargs):
+    """Helper function to run an over-fetching query."""
+    return overfetch_query(
+        collection, np.zeros(5), top_k, filters, None, tracker, **kwargs
+    )
+
+
+def test_overfetch_query_fills_top_k():
+    """Test that over-fetching grows the candidates until top_k survive."""
+    collection = PhasedChromadbCollection()
+    tracker = SelectivityTracker(initial_selectivity=0.5)
+    response, report = _overfetch(collection, tracker, 5, {"studyPhases": ["PHASE1"]})
+
+    assert response["ids"] == ["id0", "id5", "id10", "id15", "id20"]
+    assert response["documents"] == [f"doc-{key}" for key in response["ids"]]
+    assert collection.n_results_history == [10, 20, 40]
+    assert report.rounds == 3
+    assert report.candidates == 40
+    assert report.survivors == 8
+
+
+def test_overfetch_query_fields():
+    """Test that over-fetching includes the fields and distances of the survivors."""
+    collection = PhasedChromadbCollection()
+    tracker = SelectivityTracker(initial_selectivity=0.5)
+    response, _ = _overfetch(
+        collection,
+        tracker,
+        3,
+        {"studyPhases": ["PHASE1"]},
+        fields=["studyPhases", "shortTitle"],
+        include_distances=True,
+    )
+    assert response["ids"] == ["id0", "id5", "id10"]
+    assert (
+        response["metadatas"]
+        == [{"studyPhases": "PHASE1", "shortTitle": SAMPLE_METADATA["short_title"]}] * 3
+    )
+    assert response["distances"] == [0.0, 0.05, 0.1]
+
+
+def test_overfetch_query_learns_selectivity():
+    """Test that later requests start from the observed selectivity."""
+    collection = PhasedChromadbCollection()
+    tracker = SelectivityTracker(initial_selectivity=0.5, smoothing=1)
+    filters = {"studyPhases": ["PHASE1"]}
+    _, first_report = _overfetch(collection, tracker, 5, filters)
+    assert tracker.estimate('{"studyPhases":["PHASE1"]}') == pytest.approx(0.2)
+
+    _, second_report = _overfetch(collection, tracker, 5, filters)
+    assert second_report.rounds == 1 < first_report.rounds
+    assert second_report.survivors == 5
+
+    stats = tracker.stats()
+    assert stats["numRequests"] == 2
+    assert stats["maxRounds"] == 3
+    assert stats["meanRounds"] == 2
+    assert stats["numShort"] == 0
+    assert stats["trackedFilters"] == 1
+
+
+def test_overfetch_query_max_candidates():
+    """Test that over-fetching stops at the maximum number of candidates."""
+    collection = PhasedChromadbCollection()
+    tracker = SelectivityTracker()
+    response, report = _overfetch(
+        collection, tracker, 5, {"studyPhases": ["PHASE1"]}, max_candidates=15
+    )
+    assert collection.n_results_history == [10, 15]
+    assert len(response["ids"]) == report.survivors == 3
+    assert tracker.stats()["numShort"] == 1
+
+
+def test_overfetch_query_exhausted():
+    """Test that over-fetching stops when the collection is exhausted."""
+    collection = PhasedChromadbCollection(n_records=30)
+    tracker = SelectivityTracker()
+    response, report = _overfetch(
+        collection, tracker, 5, {"studyPhases": ["PHASE4"]}, max_candidates=1000
+    )
+    assert collection.n_results_history == [10, 20, 40]
+    assert response["ids"] == []
+    assert report.candidates == 30
+
+
+def test_overfetch_query_invalid_growth():
+    """Test over-fetching with an invalid growth factor."""
+    with pytest.raises(ValueError, match="Required growth > 1"):
+        _overfetch(PhasedChromadbCollection(), SelectivityTracker(), 5, {}, growth=1)
+
+
+def test_batch_query():
+    """Test a batch query that needs no post-filtering."""
+    collection = PhasedChromadbCollection()
+    tracker = SelectivityTracker()
+    responses = batch_query(
+        collection,
+        np.zeros((2, 5)),
+        [2, 4],
+        {},
+        None,
+        False,
+        tracker,
+        fields=["studyPhases"],
+        include_distances=True,
+    )
+    assert collection.n_results_history == [4]
+    assert [response["ids"] for response in responses] == [
+        ["id0", "id1"],
+        ["id0", "id1", "id2", "id3"],
+    ]
+    assert responses[0]["metadatas"] == [
+        {"studyPhases": "PHASE1"},
+        {"studyPhases": "PHASE2, PHASE3"},
+    ]
+    assert responses[1]["distances"] == [0.0, 0.01, 0.02, 0.03]
+    assert tracker.stats()["numRequests"] == 0
+
+
+def test_batch_query_post_filter():
+    """Test that short queries of a batch fall back to over-fetching one by one."""
+    collection = PhasedChromadbCollection()
+    tracker = SelectivityTracker(initial_selectivity=0.5, smoothing=1)
+    filters = {"studyPhases": ["PHASE1"]}
+    responses = batch_query(
+        collection, np.zeros((2, 5)), [2, 3], filters, None, True, tracker
+    )
+
+    # The batch over-fetches 3 / 0.5 candidates, which fills only the first query;
+    # the second one starts over-fetching from the selectivity observed by the first
+    assert collection.n_results_history == [6, 9, 18]
+    assert [response["ids"] for response in responses] == [
+        ["id0", "id5"],
+        ["id0", "id5", "id10"],
+    ]
+    stats = tracker.stats()
+    assert stats["numRequests"] == 2
+    assert stats["numShort"] == 0
+
+
+def test_batch_query_exhausted():
+    """Test that batch queries do not over-fetch from an exhausted collection."""
+    collection = PhasedChromadbCollection(n_records=4)
+    tracker = SelectivityTracker()
+    responses = batch_query(
+        collection,
+        np.zeros((1, 5)),
+        [3],
+        {"studyPhases": ["PHASE1"]},
+        None,
+        True,
+        tracker,
+    )
+    assert collection.n_results_history == [6]
+    assert responses[0]["ids"] == ["id0"]
+    assert tracker.stats()["numShort"] == 1
+
+
+def test_selectivity_tracker_record():
+    """Test recording observed selectivities."""
+    tracker = SelectivityTracker(
+        initial_selectivity=0.5, min_selectivity=0.1, smoothing=0.5, max_filters=2
+    )
+    assert tracker.estimate("a") == 0.5
+    tracker.record("a", 10, 0)
+    assert tracker.estimate("a") == 0.1  # Clamped to the minimum
+    tracker.record("a", 10, 5)
+    assert tracker.estimate("a") == pytest.approx(0.3)
+    tracker.record("a", 0, 0)  # Ignored
+    assert tracker.estimate("a") == pytest.approx(0.3)
+
+    # The least recently recorded filter is forgotten first
+    tracker.record("b", 10, 10)
+    tracker.record("a", 10, 10)
+    tracker.record("c", 10, 10)
+    assert tracker.estimate("b") == 0.5
+    assert tracker.estimate("a") == pytest.approx(0.65)
+
+
+@pytest.mark.parametrize(
+    "kwargs, match",
+    [
+        ({"initial_selectivity": 0}, "Required 0 < min_selectivity"),
+        ({"initial_selectivity": 0.1, "min_selectivity": 0.2}, "Required 0 < min"),
+        ({"smoothing": 0}, "Required 0 < smoothing <= 1"),
+    ],
+)
+def test_selectivity_tracker_invalid_args(kwargs, match):
+    """Test creating a selectivity tracker with invalid arguments."""
+    with pytest.raises(ValueError, match=match):
+        SelectivityTracker(**kwargs)
+
+
+def test_fetch_and_select_sections():
+    """Test fetching section embeddings and selecting the most similar sections."""
+    section_vectors = fetch_section_vectors(MockChromadbSectionsCollection(), "id0")
+    assert section_vectors.names == [
+        "details",
+        "criteria",
+        "interventions",
+        "outcomes",
+        "locations",
+    ]
+    np.testing.assert_allclose(
+        np.linalg.norm(section_vectors.vectors, axis=1), 1, rtol=1e-6
+    )
+
+    query_embedding = np.array([0.1, 0.2, 0.3, 0.4, 0.5])
+    assert select_sections(section_vectors, query_embedding, 2) == [
+        "criteria",
+        "outcomes",
+    ]
+    empty = SectionVectors([], np.empty((0, 0), dtype=np.float32))
+    assert select_sections(empty, query_embedding, 2) == []
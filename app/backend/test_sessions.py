@@ -0,0 +1,166 @@
+"""Test the sessions module."""
+
+import asyncio
+import threading
+import time
+
+import pytest
+from vertexai.generative_models import Content, Part  # type: ignore
+
+from sessions import (
+    InMemoryChatSessionStore,
+    SqliteChatSessionStore,
+    deserialize_history,
+    serialize_history,
+)
+
+
+def _make_history(n_turns=1, text="x" * 10):
+    """Helper function to make a chat history with alternating roles."""
+    return [
+        Content(role=("user", "model")[i % 2], parts=[Part.from_text(text)])
+        for i in range(n_turns)
+    ]
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_store(request, tmp_path):
+    """Return a factory of chat session stores of each backend."""
+    stores = []
+
+    def _make_store(**kwargs):
+        if request.param == "memory":
+            store = InMemoryChatSessionStore(**kwargs)
+        else:
+            store = SqliteChatSessionStore(tmp_path / "sessions.db", **kwargs)
+        stores.append(store)
+        return store
+
+    yield _make_store
+    for store in stores:
+        store.close()
+
+
+def test_serialize_history():
+    """Test that serializing and deserializing a chat history roundtrips."""
+    history = [
+        Content(role="user", parts=[Part.from_text("Is it safe? 安全吗")]),
+        Content(role="model", parts=[Part.from_text('It is "safe".\n')]),
+    ]
+    restored = deserialize_history(serialize_history(history))
+    assert [c.role for c in restored] == ["user", "model"]
+    assert [c.parts[0].text for c in restored] == [
+        "Is it safe? 安全吗",
+        'It is "safe".\n',
+    ]
+    assert deserialize_history(serialize_history([])) == []
+
+    # Repetitive histories are compressed
+    long_history = _make_history(20, text="lorem ipsum " * 100)
+    assert len(serialize_history(long_history)) < 1000
+
+
+def test_chat_session_store_save_load(make_store):
+    """Test saving, loading and deleting chat histories."""
+    store = make_store(sweep_interval=0)
+    assert store.load("a") is None
+    store.save("a", _make_history(2))
+    store.save("a", _make_history(3))
+    store.save("b", _make_history(1))
+
+    history = store.load("a")
+    assert history is not None
+    assert [c.role for c in history] == ["user", "model", "user"]
+    stats = store.stats()
+    assert stats["sessions"] == 2
+    assert stats["created"] == 2
+    assert stats["estimatedBytes"] > 0
+
+    store.delete("a")
+    assert store.load("a") is None
+    store.clear()
+    assert store.load("b") is None
+    assert store.stats()["estimatedBytes"] == 0
+
+
+def test_chat_session_store_async(make_store, monkeypatch):
+    """Test that blocking stores are accessed off the event loop."""
+    store = make_store()
+    threads = []
+    original_put = store._put
+
+    def _put(key, data):
+        threads.append(threading.get_ident())
+        return original_put(key, data)
+
+    monkeypatch.setattr(store, "_put", _put)
+
+    async def _main():
+        await store.asave("a", _make_history(2))
+        return await store.aload("a"), threading.get_ident()
+
+    history, loop_thread = asyncio.run(_main())
+    assert history is not None
+    assert [c.role for c in history] == ["user", "model"]
+    assert (threads[0] != loop_thread) == isinstance(store, SqliteChatSessionStore)
+
+
+def test_chat_session_store_max_sessions(make_store):
+    """Test that the least recently updated sessions are evicted first."""
+    store = make_store(max_sessions=2, sweep_interval=0)
+    for key in ["a", "b", "c"]:
+        store.save(key, _make_history())
+        time.sleep(0.01)
+
+    assert store.load("a") is None
+    assert store.load("b") is not None
+    assert store.load("c") is not None
+    assert store.stats()["sessions"] == 2
+    assert store.stats()["evictions"] == 1
+
+
+def test_chat_session_store_idle_ttl(make_store):
+    """Test that idle sessions are evicted."""
+    store = make_store(idle_ttl=0.1, sweep_interval=0)
+    store.save("a", _make_history())
+    store.save("b", _make_history())
+    time.sleep(0.06)
+    store.save("a", _make_history(2))  # Keeps "a" active
+    time.sleep(0.06)
+    assert store.load("a") is not None
+    assert store.load("b") is None
+    assert store.stats()["sessions"] == 1
+
+
+def test_chat_session_store_max_bytes(make_store):
+    """Test that sessions are evicted to keep within the size budget."""
+    size = len(serialize_history(_make_history(1, text="a" * 100)))
+    store = make_store(max_bytes=size * 2, sweep_interval=0)
+    store.save("a", _make_history(1, text="a" * 100))
+    time.sleep(0.01)
+    store.save("b", _make_history(1, text="b" * 100))
+    time.sleep(0.01)
+    store.save("c", _make_history(1, text="c" * 100))
+
+    assert store.load("a") is None
+    assert store.load("b") is not None
+    assert store.load("c") is not None
+    assert store.stats()["estimatedBytes"] <= size * 2
+
+
+def test_sqlite_chat_session_store_shared(tmp_path):
+    """Test that SQLite stores on the same database share sessions."""
+    path = tmp_path / "sessions.db"
+    store1 = SqliteChatSessionStore(path)
+    store2 = SqliteChatSessionStore(path)
+    store1.save("a", _make_history(2))
+    history = store2.load("a")
+    assert history is not None and len(history) == 2
+
+    store2.save("a", _make_history(4))
+    history = store1.load("a")
+    assert history is not None and len(history) == 4
+    assert store1._conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+    store1.close()
+    store2.close()
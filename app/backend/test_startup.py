@@ -0,0 +1,56 @@
+"""Test the startup module."""
+
+import time
+
+import pytest
+
+from startup import StartupReport
+
+
+def test_startup_report():
+    """Test timing startup phases until ready."""
+    report = StartupReport()
+    with report.phase("a"):
+        time.sleep(0.05)
+    assert report.report()["ready"] is False
+
+    with pytest.raises(ValueError):
+        with report.phase("b"):
+            raise ValueError("Failed")
+    report.mark_ready()
+
+    result = report.report()
+    assert result["ready"] is True
+    assert result["error"] is None
+    assert result["phasesMs"].keys() == {"a", "b"}
+    assert result["phasesMs"]["a"] >= 50
+    assert result["elapsedMs"] >= result["phasesMs"]["a"] + result["phasesMs"]["b"]
+
+    # The elapsed time stops counting once ready
+    time.sleep(0.01)
+    assert report.report()["elapsedMs"] == result["elapsedMs"]
+
+
+def test_startup_report_failed():
+    """Test recording failed startup phases until ready."""
+    report = StartupReport()
+    try:
+        raise OSError("Model not found")
+    except OSError as exc:
+        report.record_failure(exc, retry_in=1)
+
+    result = report.report()
+    assert result["ready"] is False
+    assert result["error"].endswith("OSError: Model not found")
+    assert "test_startup.py" in result["error"]
+    assert result["failures"] == 1
+
+    # The elapsed time keeps counting while the failed phase is retried
+    time.sleep(0.01)
+    assert report.report()["elapsedMs"] > result["elapsedMs"]
+
+    report.mark_ready()
+    result = report.report()
+    assert result["ready"] is True
+    assert result["error"] is None
+    assert result["failures"] == 1
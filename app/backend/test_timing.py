@@ -0,0 +1,111 @@
+"""Test the timing module."""
+
+import json
+
+import pytest
+
+from timing import (
+    SlowRequestLog,
+    describe_filter_shape,
+    format_server_timing,
+    sanitize_params,
+)
+
+DAY_MS = 86400000
+
+
+def _request(path, duration_ms, filter_shape=None):
+    """Helper function to make a captured request."""
+    return {
+        "timestamp": 0,
+        "method": "GET",
+        "path": path,
+        "status": 200,
+        "durationMs": duration_ms,
+        "stagesMs": {},
+        "params": {},
+        "filterShape": filter_shape,
+    }
+
+
+def test_format_server_timing():
+    """Test formatting stage durations as Server-Timing."""
+    stages = {"query_embedding": 0.0012, "post_filter": 0.0003, "other": 0.5}
+    assert format_server_timing(stages, 0.6) == (
+        "embed;dur=1.200, filter;dur=0.300, other;dur=500.000, total;dur=600.000"
+    )
+    assert format_server_timing({}, 0.001) == "total;dur=1.000"
+
+
+@pytest.mark.parametrize(
+    "filters, expected",
+    [
+        ({}, "none"),
+        (
+            {"studyType": "interventional", "studyPhases": ["PHASE1", "PHASE2"]},
+            "studyPhases[2],studyType=interventional",
+        ),
+        (
+            {"ageRange": [18, 65], "acceptsHealthy": False},
+            "acceptsHealthy=False,ageRange",
+        ),
+        ({"resultsDatePosted": [0, 30 * DAY_MS]}, "resultsDatePosted<=30d"),
+        ({"lastUpdateDatePosted": [0, 400 * DAY_MS]}, "lastUpdateDatePosted<=5y"),
+        ({"lastUpdateDatePosted": [0, 4000 * DAY_MS]}, "lastUpdateDatePosted>5y"),
+    ],
+)
+def test_describe_filter_shape(filters, expected):
+    """Test describing the shapes of filters."""
+    assert describe_filter_shape(filters) == expected
+
+
+def test_sanitize_params():
+    """Test that user input is removed from query parameters."""
+    filters_serialized = json.dumps({"eligibleSex": "female"})
+    params, filter_shape = sanitize_params(
+        f"query=breast+cancer&top_k=10&filters_serialized={filters_serialized}&x=1"
+    )
+    assert params == {"query": "<13 chars>", "top_k": "10", "x": "<redacted>"}
+    assert filter_shape == "eligibleSex=female"
+
+    assert sanitize_params("filters_serialized=%7Binvalid") == ({}, "<invalid>")
+    assert sanitize_params("") == ({}, None)
+
+
+def test_slow_request_log(monkeypatch):
+    """Test capturing slow requests into a ring buffer."""
+    log = SlowRequestLog(3, threshold_ms=100, path_thresholds_ms={"/chat": 1000})
+    assert log.should_capture("/retrieve", 100)
+    assert not log.should_capture("/retrieve", 99)
+    assert not log.should_capture("/chat/{model}/{item_id}", 999)
+    assert log.should_capture("/chat/{model}/{item_id}", 1000)
+
+    log.sample_rate = 0.5
+    monkeypatch.setattr("random.random", lambda: 0.6)
+    assert not log.should_capture("/retrieve", 1000)
+    monkeypatch.setattr("random.random", lambda: 0.4)
+    assert log.should_capture("/retrieve", 1000)
+
+    for i, duration_ms in enumerate([150, 400, 200, 300]):
+        log.append(_request("/retrieve", duration_ms, f"shape{i % 2}"))
+    assert [r["durationMs"] for r in log.requests()] == [300, 200, 400]
+    assert log.summary() == [
+        {
+            "path": "/retrieve",
+            "filterShape": "shape1",
+            "count": 2,
+            "meanDurationMs": 350,
+            "maxDurationMs": 400,
+        },
+        {
+            "path": "/retrieve",
+            "filterShape": "shape0",
+            "count": 1,
+            "meanDurationMs": 200,
+            "maxDurationMs": 200,
+        },
+    ]
+
+    log.clear()
+    assert log.requests() == []
+    assert log.summary() == []
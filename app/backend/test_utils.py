@@ -5,7 +5,25 @@ import json
 import numpy as np
 import pytest
 
-from utils import construct_filters, format_exc_details, get_metadata_from_id
+from conftest import MockChromadbCollection
+from utils import (
+    METADATA_FIELD_CLEANERS,
+    MISSING_TIMESTAMP,
+    _clean_metadata,
+    _clean_metadata_fields,
+    canonicalize_filters,
+    compile_post_filter,
+    construct_filters,
+    dates_to_timestamps,
+    format_exc_details,
+    get_collection_version,
+    get_metadata_from_id,
+    get_metadatas_from_ids,
+    make_retrieve_response,
+    post_filter,
+    study_phases_bitmask,
+    supports_filter_pushdown,
+)
 
 
 def _snake_to_camel(snake_str):
@@ -63,6 +81,91 @@ def test_get_metadata_from_id(item_id, chromadb_client, sample_metadata):
             assert metadata[_snake_to_camel(key)] == value
 
 
+def test_get_metadata_from_id_missing(chromadb_client):
+    """Test getting metadata from an item ID missing from the collection."""
+    collection = chromadb_client.get_collection("test")
+    assert get_metadata_from_id(collection, "nonexistent") is None
+
+
+def test_clean_metadata_fields(sample_metadata):
+    """Test cleaning only some fields of metadata."""
+    metadata = _clean_metadata(sample_metadata)
+    assert list(metadata) == list(METADATA_FIELD_CLEANERS)
+    assert _clean_metadata_fields(sample_metadata, list(metadata)) == metadata
+
+    fields = ["conditions", "shortTitle", "primaryMeasureOutcomes"]
+    projected = _clean_metadata_fields(sample_metadata, fields)
+    assert list(projected) == fields
+    assert projected == {field: metadata[field] for field in fields}
+
+
+@pytest.mark.parametrize("fields", [None, ["shortTitle", "conditions"]])
+def test_get_metadatas_from_ids(chromadb_client, fields):
+    """Test getting metadata from item IDs with a single fetch."""
+    collection = chromadb_client.get_collection("test")
+    metadatas = get_metadatas_from_ids(
+        collection, ["id2", "nonexistent", "id0"], fields
+    )
+    assert list(metadatas) == ["id2", "id0"]
+    for item_id, metadata in metadatas.items():
+        full_metadata = get_metadata_from_id(collection, item_id)
+        assert list(metadata) == (fields or list(METADATA_FIELD_CLEANERS))
+        assert metadata == {field: full_metadata[field] for field in metadata}
+        assert metadata["shortTitle"] == f"Sample Metadata {item_id}"
+    assert get_metadatas_from_ids(collection, []) == {}
+
+
+@pytest.mark.parametrize(
+    "metadata, expected",
+    [({"version": "v1"}, "v1"), ({"version": 1}, "1"), (None, None)],
+)
+def test_get_collection_version(metadata, expected):
+    """Test getting the version stamp of a collection."""
+    collection = MockChromadbCollection()
+    collection.metadata = metadata
+    assert get_collection_version(collection) == expected
+
+
+@pytest.mark.parametrize(
+    "metadata, expected",
+    [
+        ({"version": "v1", "filter_pushdown": True}, True),
+        ({"version": "v1", "filter_pushdown": False}, False),
+        ({"version": "v1"}, False),
+        (None, False),
+    ],
+)
+def test_supports_filter_pushdown(metadata, expected):
+    """Test checking if a collection supports pushing down all filters."""
+    collection = MockChromadbCollection()
+    collection.metadata = metadata
+    assert supports_filter_pushdown(collection) == expected
+
+
+@pytest.mark.parametrize(
+    "filters1, filters2",
+    [
+        ({}, {"studyType": None}),
+        (
+            {"studyType": "interventional", "acceptsHealthy": False},
+            {"acceptsHealthy": False, "studyType": "interventional"},
+        ),
+        ({"studyPhases": ["PHASE1", "PHASE2"]}, {"studyPhases": ["PHASE2", "PHASE1"]}),
+        ({"ageRange": (18, 30)}, {"ageRange": [18, 30]}),
+    ],
+)
+def test_canonicalize_filters(filters1, filters2):
+    """Test that equivalent filters are canonicalized identically."""
+    assert canonicalize_filters(filters1) == canonicalize_filters(filters2)
+
+
+def test_canonicalize_filters_distinct():
+    """Test that different filters are canonicalized differently."""
+    assert canonicalize_filters({"ageRange": (18, 30)}) != canonicalize_filters(
+        {"ageRange": (30, 18)}
+    )
+
+
 @pytest.mark.parametrize(
     "filters, expected_where, expected_needs_post_filter",
     [
@@ -104,4 +207,177 @@ def test_construct_filters(filters, expected_where, expected_needs_post_filter):
     assert construct_filters(filters) == (expected_needs_post_filter, expected_where)
 
 
-# TODO: Add tests for the post_filter function
+@pytest.mark.parametrize(
+    "filters, expected_where",
+    [
+        # Filters that are pushed down regardless
+        ({"studyType": "interventional"}, {"study_type": "INTERVENTIONAL"}),
+        # Study phases
+        ({"studyPhases": ["PHASE1"]}, {"study_phase_phase1": True}),
+        (
+            {"studyPhases": ["EARLY_PHASE1", "PHASE2"]},
+            {"$or": [{"study_phase_early_phase1": True}, {"study_phase_phase2": True}]},
+        ),
+        # Dates
+        (
+            {"lastUpdateDatePosted": (0, 100)},
+            {
+                "$and": [
+                    {"last_update_date_posted_ts": {"$gte": 0}},
+                    {"last_update_date_posted_ts": {"$lte": 100}},
+                ]
+            },
+        ),
+        (
+            {"resultsDatePosted": (0, 100)},
+            {
+                "$and": [
+                    {"results_date_posted_ts": {"$gte": 0}},
+                    {"results_date_posted_ts": {"$lte": 100}},
+                ]
+            },
+        ),
+        # Mixed
+        (
+            {"eligibleSex": "female", "studyPhases": ["PHASE3"]},
+            {"$and": [{"eligible_sex": "FEMALE"}, {"study_phase_phase3": True}]},
+        ),
+    ],
+)
+def test_construct_filters_pushdown(filters, expected_where):
+    """Test constructing filters with all filters pushed down."""
+    assert construct_filters(filters, pushdown=True) == (False, expected_where)
+
+
+def _make_results(items):
+    """Helper function to make query results from (phases, dates) items."""
+    ids, documents, metadatas = [], [], []
+    for i, (study_phases, last_update_date, results_date) in enumerate(items):
+        ids.append(f"id{i}")
+        documents.append(f"doc-id{i}")
+        metadatas.append(
+            dict(
+                study_phases=study_phases,
+                last_update_date_posted=last_update_date,
+                results_date_posted=results_date,
+            )
+        )
+    return dict(ids=[ids], documents=[documents], metadatas=[metadatas])
+
+
+# Epoch milliseconds of 2020-01-01 and 2021-01-01 in UTC
+_TS_2020 = 1577836800000
+_TS_2021 = 1609459200000
+
+
+@pytest.mark.parametrize(
+    "filters, expected_ids",
+    [
+        ({}, ["id0", "id1", "id2", "id3"]),
+        ({"studyPhases": ["PHASE1"]}, ["id0", "id1"]),
+        ({"studyPhases": ["PHASE2", "NA"]}, ["id1", "id3"]),
+        ({"studyPhases": ["PHASE4"]}, []),
+        ({"studyPhases": []}, ["id0", "id1", "id2", "id3"]),
+        ({"lastUpdateDatePosted": (_TS_2020, _TS_2021)}, ["id0", "id2"]),
+        ({"resultsDatePosted": (_TS_2020, _TS_2021)}, ["id1", "id2"]),
+        (
+            {"studyPhases": ["PHASE1"], "lastUpdateDatePosted": (_TS_2020, _TS_2021)},
+            ["id0"],
+        ),
+    ],
+)
+def test_post_filter(filters, expected_ids):
+    """Test post-filtering of query results."""
+    results = _make_results(
+        [
+            ("PHASE1", "2020-01-01", ""),
+            ("PHASE1, PHASE2", "2022-03-04", "2020-06-01"),
+            ("PHASE3", "2021-01-01", "2021-01-01 (estimated)"),
+            ("NA", "", "2000-00-00"),
+        ]
+    )
+    response = post_filter(results, filters)
+    assert response["ids"] == expected_ids
+    assert response["documents"] == [f"doc-{key}" for key in expected_ids]
+
+
+def test_post_filter_derived_timestamps():
+    """Test post-filtering using derived timestamp columns when available."""
+    results = _make_results([("PHASE1", "", ""), ("PHASE1", "", "")])
+    results["metadatas"][0][0]["last_update_date_posted_ts"] = _TS_2020
+    results["metadatas"][0][1]["last_update_date_posted_ts"] = MISSING_TIMESTAMP
+    response = post_filter(results, {"lastUpdateDatePosted": (_TS_2020, _TS_2021)})
+    assert response["ids"] == ["id0"]
+
+
+@pytest.mark.parametrize("pushdown", [True, False])
+def test_construct_filters_empty_study_phases(pushdown):
+    """Test that no study phases means no study phase filter in both paths."""
+    filters = {"studyType": "interventional", "studyPhases": []}
+    assert construct_filters(filters, pushdown=pushdown) == (
+        False,
+        {"study_type": "INTERVENTIONAL"},
+    )
+    results = _make_results([("PHASE1", "", ""), ("NA", "", "")])
+    assert post_filter(results, filters)["ids"] == ["id0", "id1"]
+    assert canonicalize_filters(filters) == canonicalize_filters(
+        {"studyType": "interventional"}
+    )
+
+
+@pytest.mark.parametrize("indices", [None, [2, 0]])
+def test_make_retrieve_response(indices, sample_metadata):
+    """Test making retrieval responses with metadata fields and distances."""
+    results = dict(
+        ids=[["id0", "id1", "id2"]],
+        documents=[["doc-id0", "doc-id1", "doc-id2"]],
+        metadatas=[[sample_metadata] * 3],
+        distances=[[np.float32(0.25), np.float32(0.5), np.float32(1.0)]],
+    )
+    selected = indices if indices is not None else [0, 1, 2]
+    assert make_retrieve_response(results, indices) == {
+        "ids": [f"id{i}" for i in selected],
+        "documents": [f"doc-id{i}" for i in selected],
+    }
+
+    fields = ["studyPhases", "conditions"]
+    response = make_retrieve_response(
+        results, indices, fields=fields, include_distances=True
+    )
+    assert response["metadatas"] == [
+        _clean_metadata_fields(sample_metadata, fields) for _ in selected
+    ]
+    assert response["distances"] == [[0.25, 0.5, 1.0][i] for i in selected]
+    assert all(type(distance) is float for distance in response["distances"])
+
+
+def test_compile_post_filter_cached():
+    """Test that equivalent filters share the same compiled plan."""
+    plan1 = compile_post_filter({"studyPhases": ["PHASE1", "PHASE2"]})
+    plan2 = compile_post_filter({"studyPhases": ["PHASE2", "PHASE1"]})
+    assert plan1 is plan2
+    assert not plan1.is_trivial
+    assert compile_post_filter({"studyType": "interventional"}).is_trivial
+
+
+@pytest.mark.parametrize(
+    "study_phases, expected",
+    [("PHASE1", 0b10), ("EARLY_PHASE1, PHASE1", 0b11), ("NA", 0b100000), ("", 0)],
+)
+def test_study_phases_bitmask(study_phases, expected):
+    """Test converting study phases into bitmasks."""
+    assert study_phases_bitmask(study_phases) == expected
+
+
+def test_dates_to_timestamps():
+    """Test converting date strings into epoch milliseconds."""
+    timestamps = dates_to_timestamps(
+        ["2020-01-01", "2021-01-01 (estimated)", "", "2000-00-00", "invalid"]
+    )
+    assert timestamps.tolist() == [
+        _TS_2020,
+        _TS_2021,
+        MISSING_TIMESTAMP,
+        MISSING_TIMESTAMP,
+        MISSING_TIMESTAMP,
+    ]
@@ -0,0 +1,240 @@
+"""Per-request server timing of the backend APIs."""
+
+import json
+import math
+import random
+import time
+from collections import deque
+from typing import Any
+from urllib.parse import parse_qsl
+
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from localtyping import SlowRequestSummaryType, SlowRequestType, TrialFilters
+from metrics import REQUEST_STAGES
+
+# Short names of the stages in Server-Timing headers, as shown by browser devtools
+SERVER_TIMING_NAMES = {
+    "query_embedding": "embed",
+    "chromadb_query": "chroma",
+    "local_index_query": "index",
+    "post_filter": "filter",
+    "metadata_fetch": "meta",
+    "clean_metadata": "clean",
+    "chat_session": "session",
+    "chat_generation": "llm",
+}
+
+DATE_SPAN_BUCKETS = [(30, "<=30d"), (365, "<=1y"), (5 * 365, "<=5y"), (math.inf, ">5y")]
+
+
+def format_server_timing(stages: dict[str, float], total: float) -> str:
+    """Format stage durations and the total duration in seconds as Server-Timing."""
+    entries = [
+        f"{SERVER_TIMING_NAMES.get(stage, stage)};dur={elapsed * 1000:.3f}"
+        for stage, elapsed in stages.items()
+    ]
+    entries.append(f"total;dur={total * 1000:.3f}")
+    return ", ".join(entries)
+
+
+def describe_filter_shape(filters: TrialFilters) -> str:
+    """Describe which filters are set, abstracting away values that vary freely.
+
+    Categorical values are kept since there are only a few of them, study phases
+    are counted, and date ranges are bucketed by their spans, e.g.,
+    "eligibleSex=female,lastUpdateDatePosted<=1y,studyPhases[2]".
+    """
+    parts = []
+    values: dict[str, Any] = dict(filters)
+    for key, value in sorted(values.items()):
+        if key in ("lastUpdateDatePosted", "resultsDatePosted"):
+            date_from, date_to = value
+            span_days = (date_to - date_from) / 86400000
+            bucket = next(
+                label for days, label in DATE_SPAN_BUCKETS if span_days <= days
+            )
+            parts.append(f"{key}{bucket}")
+        elif key == "studyPhases":
+            parts.append(f"{key}[{len(value)}]")
+        elif key == "ageRange":
+            parts.append(key)
+        else:
+            parts.append(f"{key}={value}")
+    return ",".join(parts) if parts else "none"
+
+
+def sanitize_params(query_string: str) -> tuple[dict[str, str], str | None]:
+    """Sanitize query parameters of a request for logging.
+
+    Free-text queries are replaced by their lengths and serialized filters by their
+    shapes, so that no user input is kept; the shape is returned separately, or None
+    if the request has no filters.
+    """
+    params: dict[str, str] = {}
+    filter_shape = None
+    for key, value in parse_qsl(query_string):
+        if key == "query":
+            params[key] = f"<{len(value)} chars>"
+        elif key == "top_k":
+            params[key] = value[:16]
+        elif key == "filters_serialized":
+            try:
+                filter_shape = describe_filter_shape(json.loads(value))
+            except Exception:
+                filter_shape = "<invalid>"
+        else:
+            params[key] = "<redacted>"
+    return params, filter_shape
+
+
+class SlowRequestLog:
+    """Bounded ring buffer of requests slower than a threshold.
+
+    Requests are captured with probability `sample_rate` if they take at least
+    `threshold_ms` milliseconds, or the threshold of the longest matching prefix in
+    `path_thresholds_ms`, e.g., a higher threshold for chat requests that are slow
+    by nature. The oldest requests are dropped once `capacity` is reached.
+    """
+
+    def __init__(
+        self,
+        capacity: int = 200,
+        threshold_ms: float = 1000,
+        path_thresholds_ms: dict[str, float] | None = None,
+        sample_rate: float = 1.0,
+    ):
+        self.capacity = capacity
+        self.threshold_ms = threshold_ms
+        self.path_thresholds_ms = path_thresholds_ms or {}
+        self.sample_rate = sample_rate
+        self._requests: deque[SlowRequestType] = deque(maxlen=capacity)
+
+    def get_threshold_ms(self, path: str) -> float:
+        """Get the threshold of a request path in milliseconds."""
+        prefixes = [
+            prefix for prefix in self.path_thresholds_ms if path.startswith(prefix)
+        ]
+        if len(prefixes) == 0:
+            return self.threshold_ms
+        return self.path_thresholds_ms[max(prefixes, key=len)]
+
+    def should_capture(self, path: str, duration_ms: float) -> bool:
+        """Whether to capture a request of the given path and duration."""
+        return (
+            duration_ms >= self.get_threshold_ms(path)
+            and random.random() < self.sample_rate
+        )
+
+    def append(self, request: SlowRequestType) -> None:
+        """Append a captured request, dropping the oldest one if full."""
+        self._requests.append(request)
+
+    def clear(self) -> None:
+        """Drop all captured requests."""
+        self._requests.clear()
+
+    def requests(self) -> list[SlowRequestType]:
+        """Get the captured requests, the most recent first."""
+        return list(reversed(self._requests))
+
+    def summary(self) -> list[SlowRequestSummaryType]:
+        """Summarize the captured requests by route and filter shape.
+
+        The groups are sorted by their maximum durations, the slowest first.
+        """
+        groups: dict[tuple[str, str | None], list[float]] = {}
+        for request in self._requests:
+            key = (request["path"], request["filterShape"])
+            groups.setdefault(key, []).append(request["durationMs"])
+        summary: list[SlowRequestSummaryType] = [
+            {
+                "path": path,
+                "filterShape": filter_shape,
+                "count": len(durations),
+                "meanDurationMs": sum(durations) / len(durations),
+                "maxDurationMs": max(durations),
+            }
+            for (path, filter_shape), durations in groups.items()
+        ]
+        summary.sort(key=lambda group: -group["maxDurationMs"])
+        return summary
+
+
+class ServerTimingMiddleware:
+    """ASGI middleware timing the stages of serving each request.
+
+    Stages timed with `metrics.time_stage` while serving a request are reported in
+    the Server-Timing header of its response. The header is sent before the body,
+    so the generation of streamed chat responses is missing from it, but slow
+    requests are captured into the slow request log with all their stages once the
+    body has been sent.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        slow_requests: SlowRequestLog,
+        timing_allow_origin: str | None = None,
+    ):
+        self.app = app
+        self.slow_requests = slow_requests
+        self.timing_allow_origin = timing_allow_origin
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stages: dict[str, float] = {}
+        status = 500
+        started_at = time.perf_counter()
+
+        async def _send(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                elapsed = time.perf_counter() - started_at
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", format_server_timing(stages, elapsed))
+                if self.timing_allow_origin is not None:
+                    # Allow the frontend to read the timings of cross-origin requests
+                    headers.append("Timing-Allow-Origin", self.timing_allow_origin)
+            await send(message)
+
+        token = REQUEST_STAGES.set(stages)
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            REQUEST_STAGES.reset(token)
+            duration_ms = (time.perf_counter() - started_at) * 1000
+            self._capture(scope, status, duration_ms, stages)
+
+    def _capture(
+        self, scope: Scope, status: int, duration_ms: float, stages: dict[str, float]
+    ) -> None:
+        # Group requests by the path template of their route if matched, e.g.,
+        # "/meta/{item_id}", so that the summary is not split by path parameters
+        route = scope.get("route")
+        path: str = route.path if route is not None else scope["path"]
+        if not self.slow_requests.should_capture(path, duration_ms):
+            return
+
+        params, filter_shape = sanitize_params(scope["query_string"].decode("latin-1"))
+        for key, value in scope.get("path_params", {}).items():
+            params[key] = str(value)
+        self.slow_requests.append(
+            {
+                "timestamp": time.time_ns(),
+                "method": scope["method"],
+                "path": path,
+                "status": status,
+                "durationMs": duration_ms,
+                "stagesMs": {
+                    stage: elapsed * 1000 for stage, elapsed in stages.items()
+                },
+                "params": params,
+                "filterShape": filter_shape,
+            }
+        )
@@ -2,15 +2,29 @@
 
 import json
 import traceback
-from datetime import datetime
-from functools import partial
+from collections.abc import Callable, Mapping, Sequence
+from functools import lru_cache
 from pathlib import Path
-from typing import Any, Literal
+from typing import Any, TypeAlias, cast
 
 import chromadb
 import chromadb.api
+import numpy as np
 
 from localtyping import APIRetrieveResponseType, TrialFilters, TrialMetadataType
+from metrics import time_stage
+
+# Bit of each study phase in the study phase bitmasks used by post-filters
+STUDY_PHASE_BITS = {
+    phase: 1 << i
+    for i, phase in enumerate(
+        ["EARLY_PHASE1", "PHASE1", "PHASE2", "PHASE3", "PHASE4", "NA"]
+    )
+}
+
+# Timestamp for missing or malformed dates, consistent with the derived timestamp
+# columns written by the embedding model; such studies never match a date filter
+MISSING_TIMESTAMP = -(2**53)
 
 
 def format_exc_details(exc: Exception) -> str:
@@ -28,106 +42,186 @@ def format_exc_details(exc: Exception) -> str:
     return f"{tb_details}\n{exc.__class__.__name__}: {exc}"
 
 
+def _stored_json(key: str) -> Callable[[Mapping[str, Any]], Any]:
+    """Clean a field stored as JSON."""
+    return lambda metadata: json.loads(metadata[key])
+
+
+def _stored_outcomes(key: str) -> Callable[[Mapping[str, Any]], Any]:
+    """Clean a field of measure outcomes stored as JSON."""
+    return lambda metadata: [
+        dict(
+            measure=item["measure"],
+            description=item["description"],
+            timeFrame=item["time_frame"],
+        )
+        for item in json.loads(metadata[key])
+    ]
+
+
+# Cleaner of each field of the full JSON metadata from the metadata stored in
+# ChromaDB, so that fields can be cleaned individually; most fields are stored as is
+# under another key, which is looked up directly rather than through a function call
+MetadataFieldCleaner: TypeAlias = str | Callable[[Mapping[str, Any]], Any]
+METADATA_FIELD_CLEANERS: dict[str, MetadataFieldCleaner] = {
+    "shortTitle": "short_title",
+    "longTitle": "long_title",
+    "organization": "organization",
+    "submitDate": "submit_date",
+    "submitDateQc": "submit_date_qc",
+    "submitDatePosted": "submit_date_posted",
+    "resultsDate": "results_date",
+    "resultsDateQc": "results_date_qc",
+    "resultsDatePosted": "results_date_posted",
+    "lastUpdateDate": "last_update_date",
+    "lastUpdateDatePosted": "last_update_date_posted",
+    "verifyDate": "verify_date",
+    "sponsor": "sponsor",
+    "collaborators": _stored_json("collaborators"),
+    "summary": "summary",
+    "details": "details",
+    "conditions": _stored_json("conditions"),
+    "studyPhases": "study_phases",
+    "studyType": "study_type",
+    "enrollmentCount": "enrollment_count",
+    "allocation": "allocation",
+    "interventionModel": "intervention_model",
+    "observationalModel": "observational_model",
+    "primaryPurpose": "primary_purpose",
+    "whoMasked": "who_masked",
+    "interventions": lambda metadata: [
+        dict(type=item["type"], name=item["name"], description=item["description"])
+        for item in json.loads(metadata["interventions"])
+    ],
+    "primaryMeasureOutcomes": _stored_outcomes("primary_measure_outcomes"),
+    "secondaryMeasureOutcomes": _stored_outcomes("secondary_measure_outcomes"),
+    "otherMeasureOutcomes": _stored_outcomes("other_measure_outcomes"),
+    "minAge": "min_age",
+    "maxAge": "max_age",
+    "eligibleSex": "eligible_sex",
+    "acceptsHealthy": "accepts_healthy",
+    "inclusionCriteria": "inclusion_criteria",
+    "exclusionCriteria": "exclusion_criteria",
+    "officials": _stored_json("officials"),
+    "locations": _stored_json("locations"),
+    "references": lambda metadata: [
+        dict(pmid=item["pmid"], citation=item["citation"])
+        for item in json.loads(metadata["references"])
+    ],
+    "documents": lambda metadata: [
+        dict(url=item["url"], size=item["size"])
+        for item in json.loads(metadata["documents"])
+    ],
+}
+
+
 def _clean_metadata(metadata: Any) -> TrialMetadataType:
     """Clean metadata stored in ChromaDB into full JSON."""
-    return dict(
-        shortTitle=metadata["short_title"],
-        longTitle=metadata["long_title"],
-        organization=metadata["organization"],
-        submitDate=metadata["submit_date"],
-        submitDateQc=metadata["submit_date_qc"],
-        submitDatePosted=metadata["submit_date_posted"],
-        resultsDate=metadata["results_date"],
-        resultsDateQc=metadata["results_date_qc"],
-        resultsDatePosted=metadata["results_date_posted"],
-        lastUpdateDate=metadata["last_update_date"],
-        lastUpdateDatePosted=metadata["last_update_date_posted"],
-        verifyDate=metadata["verify_date"],
-        sponsor=metadata["sponsor"],
-        collaborators=json.loads(metadata["collaborators"]),
-        summary=metadata["summary"],
-        details=metadata["details"],
-        conditions=json.loads(metadata["conditions"]),
-        studyPhases=metadata["study_phases"],
-        studyType=metadata["study_type"],
-        enrollmentCount=metadata["enrollment_count"],
-        allocation=metadata["allocation"],
-        interventionModel=metadata["intervention_model"],
-        observationalModel=metadata["observational_model"],
-        primaryPurpose=metadata["primary_purpose"],
-        whoMasked=metadata["who_masked"],
-        interventions=[
-            dict(
-                type=item["type"],
-                name=item["name"],
-                description=item["description"],
-            )
-            for item in json.loads(metadata["interventions"])
-        ],
-        primaryMeasureOutcomes=[
-            dict(
-                measure=item["measure"],
-                description=item["description"],
-                timeFrame=item["time_frame"],
-            )
-            for item in json.loads(metadata["primary_measure_outcomes"])
-        ],
-        secondaryMeasureOutcomes=[
-            dict(
-                measure=item["measure"],
-                description=item["description"],
-                timeFrame=item["time_frame"],
-            )
-            for item in json.loads(metadata["secondary_measure_outcomes"])
-        ],
-        otherMeasureOutcomes=[
-            dict(
-                measure=item["measure"],
-                description=item["description"],
-                timeFrame=item["time_frame"],
-            )
-            for item in json.loads(metadata["other_measure_outcomes"])
-        ],
-        minAge=metadata["min_age"],
-        maxAge=metadata["max_age"],
-        eligibleSex=metadata["eligible_sex"],
-        acceptsHealthy=metadata["accepts_healthy"],
-        inclusionCriteria=metadata["inclusion_criteria"],
-        exclusionCriteria=metadata["exclusion_criteria"],
-        officials=json.loads(metadata["officials"]),
-        locations=json.loads(metadata["locations"]),
-        references=[
-            dict(
-                pmid=item["pmid"],
-                citation=item["citation"],
-            )
-            for item in json.loads(metadata["references"])
-        ],
-        documents=[
-            dict(
-                url=item["url"],
-                size=item["size"],
-            )
-            for item in json.loads(metadata["documents"])
-        ],
+    return cast(
+        TrialMetadataType,
+        {
+            field: metadata[clean] if isinstance(clean, str) else clean(metadata)
+            for field, clean in METADATA_FIELD_CLEANERS.items()
+        },
     )
 
 
+def _clean_metadata_fields(
+    metadata: Mapping[str, Any], fields: Sequence[str]
+) -> dict[str, Any]:
+    """Clean only the given fields of metadata stored in ChromaDB into JSON.
+
+    Fields that are not requested are skipped altogether, so that projections
+    without, e.g., the locations or outcomes do not pay for decoding them.
+    """
+    cleaned = {}
+    for field in fields:
+        clean = METADATA_FIELD_CLEANERS[field]
+        cleaned[field] = metadata[clean] if isinstance(clean, str) else clean(metadata)
+    return cleaned
+
+
+def supports_filter_pushdown(collection: chromadb.Collection) -> bool:
+    """Check if the collection stores the derived columns for pushing down filters."""
+    metadata = collection.metadata
+    return metadata is not None and bool(metadata.get("filter_pushdown", False))
+
+
+def get_collection_version(collection: chromadb.Collection) -> str | None:
+    """Get the version stamp written when the collection was (re)built."""
+    metadata = collection.metadata
+    if metadata is None:
+        return None
+    version = metadata.get("version")
+    return str(version) if version is not None else None
+
+
+def canonicalize_filters(filters: TrialFilters) -> str:
+    """Serialize filters canonically so that equivalent filters compare equal."""
+    canonical = {key: value for key, value in filters.items() if value is not None}
+    if study_phases := filters.get("studyPhases"):
+        # The order of study phases does not matter; all other list-like filters are
+        # ranges where the order does matter
+        canonical["studyPhases"] = sorted(study_phases)
+    else:
+        # No study phases means no study phase filter, see construct_filters
+        canonical.pop("studyPhases", None)
+    return json.dumps(canonical, sort_keys=True, separators=(",", ":"))
+
+
 def get_metadata_from_id(
     collection: chromadb.Collection, item_id: str
 ) -> TrialMetadataType | None:
     """Get metadata from a document ID."""
-    results = collection.get(
-        ids=[item_id], include=[chromadb.api.types.IncludeEnum("metadatas")]
-    )
+    with time_stage("metadata_fetch"):
+        results = collection.get(
+            ids=[item_id], include=[chromadb.api.types.IncludeEnum("metadatas")]
+        )
     metadatas = results["metadatas"]
-    if metadatas is None:
-        return None
-    return _clean_metadata(metadatas[0])
+    if not metadatas:
+        return None  # Missing from the collection
+    with time_stage("clean_metadata"):
+        return _clean_metadata(metadatas[0])
+
 
+def get_metadatas_from_ids(
+    collection: chromadb.Collection,
+    item_ids: Sequence[str],
+    fields: Sequence[str] | None = None,
+) -> dict[str, dict[str, Any]]:
+    """Get metadata from document IDs with a single fetch.
 
-def construct_filters(filters: TrialFilters) -> tuple[bool, chromadb.Where | None]:
-    """Construct filters for querying trials."""
+    Only the given fields are cleaned if `fields` is not None. IDs missing from the
+    collection are missing from the returned mapping as well.
+    """
+    if len(item_ids) == 0:
+        return {}
+    with time_stage("metadata_fetch"):
+        results = collection.get(
+            ids=list(item_ids), include=[chromadb.api.types.IncludeEnum("metadatas")]
+        )
+    metadatas = results["metadatas"] or []
+    with time_stage("clean_metadata"):
+        if fields is None:
+            return {
+                item_id: cast(dict[str, Any], _clean_metadata(metadata))
+                for item_id, metadata in zip(results["ids"], metadatas)
+            }
+        return {
+            item_id: _clean_metadata_fields(metadata, fields)
+            for item_id, metadata in zip(results["ids"], metadatas)
+        }
+
+
+def construct_filters(
+    filters: TrialFilters, pushdown: bool = False
+) -> tuple[bool, chromadb.Where | None]:
+    """Construct filters for querying trials.
+
+    If `pushdown` is True, the collection is assumed to store the derived timestamp
+    and study phase columns, so that all filters can be translated into the where
+    clause and no post-filtering is needed.
+    """
     processed_filters: list[chromadb.Where] = []
 
     if (study_type := filters.get("studyType")) is not None:
@@ -152,6 +246,38 @@ def construct_filters(filters: TrialFilters) -> tuple[bool, chromadb.Where | Non
         processed_filters.append({"min_age": {"$lte": max_age}})  # type: ignore
         processed_filters.append({"max_age": {"$gte": min_age}})  # type: ignore
 
+    if pushdown:
+        # NOTE: An empty list of study phases means no study phase filter at all,
+        # consistently with post-filtering and the local index
+        if study_phases := filters.get("studyPhases"):
+            # Accept the study if any of its phases is among the desired phases; each
+            # phase is stored as a separate boolean column
+            phase_filters: list[chromadb.Where] = [
+                {f"study_phase_{phase.lower()}": True} for phase in study_phases
+            ]
+            if len(phase_filters) == 1:
+                processed_filters.append(phase_filters[0])
+            else:
+                processed_filters.append({"$or": phase_filters})
+
+        if (last_update_date_filter := filters.get("lastUpdateDatePosted")) is not None:
+            date_from, date_to = last_update_date_filter
+            processed_filters.append(
+                {"last_update_date_posted_ts": {"$gte": date_from}}  # type: ignore
+            )
+            processed_filters.append(
+                {"last_update_date_posted_ts": {"$lte": date_to}}  # type: ignore
+            )
+
+        if (results_date_filter := filters.get("resultsDatePosted")) is not None:
+            date_from, date_to = results_date_filter
+            processed_filters.append(
+                {"results_date_posted_ts": {"$gte": date_from}}  # type: ignore
+            )
+            processed_filters.append(
+                {"results_date_posted_ts": {"$lte": date_to}}  # type: ignore
+            )
+
     # Construct the where clause
     where: chromadb.Where | None = None
     if len(processed_filters) == 1:
@@ -160,78 +286,185 @@ def construct_filters(filters: TrialFilters) -> tuple[bool, chromadb.Where | Non
         where = {"$and": processed_filters}
 
     # Determine if there are post-processing filters required
-    needs_post_filter = any(
-        key in filters
+    needs_post_filter = not pushdown and any(
+        filters.get(key)
         for key in ["studyPhases", "lastUpdateDatePosted", "resultsDatePosted"]
     )
 
     return needs_post_filter, where
 
 
-def post_filter(
-    results: chromadb.QueryResult, filters: TrialFilters
-) -> APIRetrieveResponseType:
-    """Post-filtering of query results."""
-    filtered_ids, filtered_documents = [], []
+class PostFilterPlan:
+    """Predicate plan compiled from trial filters that need post-filtering.
 
-    assert (
-        results["documents"] is not None and results["metadatas"] is not None
-    ), "Missing documents or metadatas required for post-filtering"
-    ids = results["ids"][0]
-    documents = results["documents"][0]
-    metadatas = results["metadatas"][0]
+    The plan evaluates over a batch of candidates at once. The study phases of the
+    candidates are turned into a column of bitmasks and their dates into columns of
+    integer epoch milliseconds, so that each filter reduces to a vectorized mask.
+    """
 
-    def _accept_by_study_phases(metadata: Any, study_phases_filter: list[str]) -> bool:
-        # If any of the study phases as in the metadata is in the desired study phases,
-        # then we accept this metadata; TODO: ChromaDB should support more flexible
-        # string matching on metadata fields, e.g., the $contains operator is currently
-        # only supported for document filters but not metadata field filters; by then we
-        # will be able to move this post-filtering logic to the database query
-        study_phases = metadata["study_phases"].split(", ")
-        return any(phase in study_phases_filter for phase in study_phases)
-
-    def _accept_by_date(
-        metadata: Any,
-        key: Literal["last_update_date_posted", "results_date_posted"],
-        date_range_filter: tuple[int, int],
-    ) -> bool:
-        # If the date field is within the desired range, then we accept this metadata;
-        # we note that some data fields in the metadata do not have the day part, but
-        # the two types we accept here both do; TODO: we should consider storing the
-        # date fields as timestamps in the database so that we can move this
-        # post-filtering logic to the database query
-        date_from_filter, date_to_filter = date_range_filter
-        date = datetime.strptime(metadata[key], "%Y-%m-%d").timestamp() * 1000
-        return date_from_filter <= date <= date_to_filter
-
-    # Construc the list of post-filtering functions
-    post_filter_funcs = []
-    if (study_phase_filter := filters.get("studyPhases")) is not None:
-        post_filter_funcs.append(
-            partial(_accept_by_study_phases, study_phases_filter=study_phase_filter)
-        )
-    if (last_update_date_filter := filters.get("lastUpdateDatePosted")) is not None:
-        post_filter_funcs.append(
-            partial(
-                _accept_by_date,
-                key="last_update_date_posted",
-                date_range_filter=last_update_date_filter,
+    def __init__(
+        self,
+        study_phases_mask: int | None = None,
+        date_ranges: Sequence[tuple[str, int, int]] = (),
+    ):
+        self.study_phases_mask = study_phases_mask
+        self.date_ranges = list(date_ranges)
+
+    @property
+    def is_trivial(self) -> bool:
+        """Whether the plan accepts all candidates."""
+        return self.study_phases_mask is None and len(self.date_ranges) == 0
+
+    def evaluate(self, metadatas: Sequence[Mapping[str, Any]]) -> np.ndarray:
+        """Evaluate the plan over candidate metadatas into a boolean mask."""
+        mask = np.ones(len(metadatas), dtype=bool)
+
+        if self.study_phases_mask is not None:
+            study_phases = np.fromiter(
+                (study_phases_bitmask(m["study_phases"]) for m in metadatas),
+                dtype=np.int64,
+                count=len(metadatas),
             )
+            mask &= (study_phases & self.study_phases_mask) != 0
+
+        for key, date_from, date_to in self.date_ranges:
+            if not mask.any():
+                break  # Nothing survives, so no need to parse more dates
+            timestamps = _get_timestamps(metadatas, key)
+            mask &= (timestamps >= date_from) & (timestamps <= date_to)
+
+        return mask
+
+
+@lru_cache(maxsize=64)
+def study_phases_bitmask(study_phases: str) -> int:
+    """Convert comma-separated study phases into a bitmask."""
+    bitmask = 0
+    for phase in study_phases.split(", "):
+        bitmask |= STUDY_PHASE_BITS.get(phase, 0)
+    return bitmask
+
+
+def dates_to_timestamps(dates: Sequence[str]) -> np.ndarray:
+    """Convert YYYY-MM-DD date strings into epoch milliseconds in UTC."""
+    # Dates may be suffixed with " (estimated)", so only the leading part counts
+    truncated = [date[:10] for date in dates]
+    try:
+        parsed = np.array(truncated, dtype="datetime64[D]")
+    except ValueError:
+        # Fall back to parsing one by one so that a single malformed date does not
+        # fail the whole batch; malformed dates are treated as missing
+        parsed = np.array([_parse_date(date) for date in truncated])
+    timestamps = parsed.astype("datetime64[ms]").astype(np.int64)
+    timestamps[np.isnat(parsed)] = MISSING_TIMESTAMP
+    return timestamps
+
+
+def _parse_date(date: str) -> np.datetime64:
+    """Parse a date string, returning NaT if it is malformed."""
+    try:
+        return np.datetime64(date, "D")
+    except ValueError:
+        return np.datetime64("NaT", "D")
+
+
+def _get_timestamps(metadatas: Sequence[Mapping[str, Any]], key: str) -> np.ndarray:
+    """Get the timestamps of a date field of candidate metadatas."""
+    # Use the derived timestamp column if the collection stores it
+    if len(metadatas) > 0 and f"{key}_ts" in metadatas[0]:
+        return np.fromiter(
+            (m[f"{key}_ts"] for m in metadatas), dtype=np.int64, count=len(metadatas)
         )
+    return dates_to_timestamps([m[key] for m in metadatas])
+
+
+def compile_post_filter(filters: TrialFilters) -> PostFilterPlan:
+    """Compile the filters that need post-filtering into a predicate plan."""
+    return _compile_post_filter(canonicalize_filters(filters))
+
+
+@lru_cache(maxsize=256)
+def _compile_post_filter(filters_canonical: str) -> PostFilterPlan:
+    """Compile canonically serialized filters into a predicate plan."""
+    filters: TrialFilters = json.loads(filters_canonical)
+
+    # If any of the study phases as in the metadata is in the desired study phases,
+    # then we accept this metadata; NOTE: this is only needed for collections built
+    # without the derived study phase columns, see construct_filters
+    study_phases_mask = None
+    if study_phases_filter := filters.get("studyPhases"):
+        study_phases_mask = study_phases_bitmask(", ".join(study_phases_filter))
+
+    # If the date field is within the desired range, then we accept this metadata; we
+    # note that some data fields in the metadata do not have the day part, but the
+    # two types we accept here both do; NOTE: this is only needed for collections
+    # built without the derived timestamp columns, see construct_filters
+    date_ranges = []
+    if (last_update_date_filter := filters.get("lastUpdateDatePosted")) is not None:
+        date_from, date_to = last_update_date_filter
+        date_ranges.append(("last_update_date_posted", date_from, date_to))
     if (results_date_filter := filters.get("resultsDatePosted")) is not None:
-        post_filter_funcs.append(
-            partial(
-                _accept_by_date,
-                key="results_date_posted",
-                date_range_filter=results_date_filter,
-            )
-        )
+        date_from, date_to = results_date_filter
+        date_ranges.append(("results_date_posted", date_from, date_to))
+
+    return PostFilterPlan(study_phases_mask, date_ranges)
+
+
+def post_filter_indices(
+    results: chromadb.QueryResult, filters: TrialFilters
+) -> np.ndarray | None:
+    """Indices of the query results accepted by post-filtering, or None if all are."""
+    assert results["metadatas"] is not None, "Missing metadatas for post-filtering"
+    metadatas = results["metadatas"][0]
+
+    # Evaluate the compiled plan over all items at once
+    plan = compile_post_filter(filters)
+    if plan.is_trivial:
+        return None
+    return np.flatnonzero(plan.evaluate(metadatas))
+
 
-    # For each item, append to the filtered list only if all post-filtering functions
-    # accept that item
-    for _id, document, metadata in zip(ids, documents, metadatas):
-        if all(func(metadata) for func in post_filter_funcs):
-            filtered_ids.append(_id)
-            filtered_documents.append(document)
+def make_retrieve_response(
+    results: chromadb.QueryResult,
+    indices: Sequence[int] | np.ndarray | None = None,
+    fields: Sequence[str] | None = None,
+    include_distances: bool = False,
+) -> APIRetrieveResponseType:
+    """Make a retrieval response from query results.
 
-    return {"ids": filtered_ids, "documents": filtered_documents}
+    Only the results at `indices` are kept, in that order, if given. The metadata of
+    the results are cleaned into the given fields if `fields` is not None, and their
+    distances to the query are included if `include_distances` is True; the query
+    must have included metadatas and distances respectively.
+    """
+    assert results["documents"] is not None, "Missing documents in query results"
+    ids = results["ids"][0]
+    documents = results["documents"][0]
+    if indices is None:
+        indices = range(len(ids))
+    response: APIRetrieveResponseType = {
+        "ids": [ids[i] for i in indices],
+        "documents": [documents[i] for i in indices],
+    }
+    if fields is not None:
+        assert results["metadatas"] is not None, "Missing metadatas in query results"
+        metadatas = results["metadatas"][0]
+        with time_stage("clean_metadata"):
+            response["metadatas"] = [
+                _clean_metadata_fields(metadatas[i], fields) for i in indices
+            ]
+    if include_distances:
+        assert results["distances"] is not None, "Missing distances in query results"
+        distances = results["distances"][0]
+        response["distances"] = [float(distances[i]) for i in indices]
+    return response
+
+
+def post_filter(
+    results: chromadb.QueryResult, filters: TrialFilters
+) -> APIRetrieveResponseType:
+    """Post-filtering of query results."""
+    assert (
+        results["documents"] is not None and results["metadatas"] is not None
+    ), "Missing documents or metadatas required for post-filtering"
+    return make_retrieve_response(results, post_filter_indices(results, filters))
@@ -15,6 +15,12 @@ import {
   WrapAPI,
 } from "./types";
 
+/**
+ * The chat session ID of this browser tab, so that chat histories are not shared
+ * with other clients chatting about the same trial.
+ */
+const CHAT_SESSION_ID = crypto.randomUUID();
+
 /**
  * Fetch the response from the given URL with the GET method.
  */
@@ -118,7 +124,10 @@ export const callChat = async (
 ): Promise<WrapAPI<APIChatResponseType>> => {
   const url = `${import.meta.env.VITE_BACKEND_URL}/chat/${model}/${id}`;
   try {
-    const response = await postResponse<APIChatPayloadType>(url, { query });
+    const response = await postResponse<APIChatPayloadType>(url, {
+      query,
+      sessionId: CHAT_SESSION_ID,
+    });
     if (!response.ok) {
       return { error: await formatNonOkResponse(response) };
     }
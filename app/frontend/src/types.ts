@@ -138,8 +138,10 @@ export interface APIMetaResponseType {
 
 export interface APIChatPayloadType {
   query: string;
+  sessionId?: string;
 }
 
 export interface APIChatResponseType {
   response: string;
+  sessionId: string;
 }
@@ -5,9 +5,11 @@ import rich
 
 from shared import (
     EMBEDDINGS_NPY_PATH,
+    SECTION_EMBEDDINGS_NPY_PATH,
     default_progress,
     get_cleaned_data,
     get_model,
+    get_study_sections,
 )
 
 
@@ -23,5 +25,18 @@ def main():
     rich.print("[bold green]->[/] Creating vector embeddings...")
     embeddings = model.encode(studies_df["summary"].to_list())
     np.save(EMBEDDINGS_NPY_PATH, embeddings)
-
     rich.print(f"[bold green]->[/] Embeddings saved to {EMBEDDINGS_NPY_PATH}")
+
+    # Encode the sections of all studies for section-level retrieval in chat; the
+    # embeddings are flattened in the order of studies then sections
+    rich.print("[bold green]->[/] Creating section embeddings...")
+    section_texts = [
+        text
+        for study in studies_df.to_dict("records")
+        for text in get_study_sections(study).values()
+    ]
+    section_embeddings = model.encode(section_texts)
+    np.save(SECTION_EMBEDDINGS_NPY_PATH, section_embeddings)
+    rich.print(
+        f"[bold green]->[/] Section embeddings saved to {SECTION_EMBEDDINGS_NPY_PATH}"
+    )
@@ -18,6 +18,7 @@ from rich.progress import (
 DATA_DIR = Path(__file__).parent / "data"
 CLEANED_JSONL_PATH = DATA_DIR / "cleaned_data.jsonl"
 EMBEDDINGS_NPY_PATH = DATA_DIR / "summary_embeddings.npy"
+SECTION_EMBEDDINGS_NPY_PATH = DATA_DIR / "section_embeddings.npy"
 
 if not DATA_DIR.exists():
     DATA_DIR.mkdir()
@@ -25,10 +26,16 @@ if not DATA_DIR.exists():
 CHROMADB_HOST = os.getenv("CHROMADB_HOST", "localhost")
 CHROMADB_PORT = os.getenv("CHROMADB_PORT", 8000)
 CHROMADB_COLLECTION_NAME = "veritas-trial-embeddings"
+CHROMADB_SECTIONS_COLLECTION_NAME = "veritas-trial-sections"
 
 BUCKET_NAME = "veritas-trial"
 BUCKET_CLEANED_JSONL_PATH = "data-pipeline/cleaned_data.jsonl"
 BUCKET_EMBEDDINGS_NPY_PATH = f"embedding-model/summary_embeddings.npy"
+BUCKET_SECTION_EMBEDDINGS_NPY_PATH = f"embedding-model/section_embeddings.npy"
+
+# Sections of each study that are embedded for section-level retrieval in chat; the
+# names must match the sections rendered by the backend
+SECTION_NAMES = ["details", "criteria", "interventions", "outcomes", "locations"]
 
 
 def default_progress():
@@ -70,3 +77,47 @@ def get_model():
     model_name = "BAAI/bge-small-en-v1.5"
     rich.print(f"[bold green]->[/] Loading {model_name!r}...")
     return FlagModel(model_name, use_fp16=True)
+
+
+def get_study_sections(study):
+    """Get the texts of the non-empty sections of a cleaned study.
+
+    The sections are ordered as in SECTION_NAMES and the order is deterministic, so
+    the section embeddings can be matched with the sections again by recomputing
+    them from the same cleaned data.
+    """
+
+    # Fields may be missing or NaN in the data frame
+    def _text(value):
+        return value.strip() if isinstance(value, str) else ""
+
+    def _items(value):
+        return value if isinstance(value, list) else []
+
+    outcomes = [
+        *_items(study.get("primary_measure_outcomes")),
+        *_items(study.get("secondary_measure_outcomes")),
+        *_items(study.get("other_measure_outcomes")),
+    ]
+    inclusion = _text(study.get("inclusion_criteria"))
+    exclusion = _text(study.get("exclusion_criteria"))
+    sections = {
+        "details": _text(study.get("details")),
+        "criteria": "\n".join(
+            [
+                *([f"Inclusion criteria:\n{inclusion}"] if inclusion else []),
+                *([f"Exclusion criteria:\n{exclusion}"] if exclusion else []),
+            ]
+        ),
+        "interventions": "\n".join(
+            f"{item['type']}: {item['name']} - {item['description']}"
+            for item in _items(study.get("interventions"))
+        ),
+        "outcomes": "\n".join(
+            f"{item['measure']}: {item['description']}" for item in outcomes
+        ),
+        "locations": "\n".join(
+            [*_items(study.get("officials")), *_items(study.get("locations"))]
+        ),
+    }
+    return {name: text for name in SECTION_NAMES if (text := sections[name].strip())}
@@ -1,4 +1,5 @@
 import json
+from datetime import datetime, timezone
 from io import BytesIO
 
 import chromadb
@@ -9,17 +10,47 @@ from google.cloud import storage
 from shared import (
     BUCKET_EMBEDDINGS_NPY_PATH,
     BUCKET_NAME,
+    BUCKET_SECTION_EMBEDDINGS_NPY_PATH,
     CHROMADB_COLLECTION_NAME,
     CHROMADB_HOST,
     CHROMADB_PORT,
+    CHROMADB_SECTIONS_COLLECTION_NAME,
     EMBEDDINGS_NPY_PATH,
+    SECTION_EMBEDDINGS_NPY_PATH,
     default_progress,
     get_cleaned_data,
+    get_study_sections,
 )
 
+# Study phases that can be filtered on; each gets a boolean metadata column so that
+# phase filters can be expressed as a ChromaDB where clause
+STUDY_PHASES = ["EARLY_PHASE1", "PHASE1", "PHASE2", "PHASE3", "PHASE4", "NA"]
+
+# Date fields that can be filtered on; each gets an extra numeric metadata column with
+# the epoch timestamp in milliseconds so that date filters can be expressed as a
+# ChromaDB where clause
+TIMESTAMP_FIELDS = ["last_update_date_posted", "results_date_posted"]
+
+# Timestamp for missing or malformed dates; it lies before any date that can be picked
+# in the frontend so such studies never match a date range filter
+MISSING_TIMESTAMP = -(2**53)
+
+
+def date_to_timestamp(date):
+    """Convert a YYYY-MM-DD date string into epoch milliseconds in UTC."""
+    try:
+        # Dates may be suffixed with " (estimated)", so only the leading part counts
+        parsed = datetime.strptime(date[:10], "%Y-%m-%d")
+    except (TypeError, ValueError):
+        return MISSING_TIMESTAMP
+    return int(parsed.replace(tzinfo=timezone.utc).timestamp() * 1000)
+
 
 def stringify_metadata(metadata):
-    """Stringify metadata so each value is either string or numeric."""
+    """Stringify metadata so each value is either string or numeric.
+
+    Derived columns for date and study phase filters are added as well.
+    """
     stringfied = {}
     for k, v in metadata.items():
         if v is None:
@@ -31,9 +62,59 @@ def stringify_metadata(metadata):
             stringfied[k] = json.dumps(v)
         else:
             stringfied[k] = v
+
+    for k in TIMESTAMP_FIELDS:
+        stringfied[f"{k}_ts"] = date_to_timestamp(metadata.get(k))
+    study_phases = (metadata.get("study_phases") or "").split(", ")
+    for phase in STUDY_PHASES:
+        stringfied[f"study_phase_{phase.lower()}"] = phase in study_phases
     return stringfied
 
 
+def load_embeddings(local_path, bucket_path):
+    """Load embeddings from local or otherwise from the bucket."""
+    if local_path.exists():
+        return np.load(local_path)
+
+    storage_client = storage.Client()
+    bucket = storage_client.bucket(BUCKET_NAME)
+    embeddings_blob = bucket.get_blob(bucket_path)
+    embeddings_stream = BytesIO()
+    embeddings_blob.download_to_file(embeddings_stream)
+    embeddings_stream.seek(0)
+    embeddings = np.load(embeddings_stream)
+    # Save the embeddings locally for possible reuse; the embed subcommand always
+    # overwrites so this is safe
+    np.save(local_path, embeddings)
+    return embeddings
+
+
+def recreate_collection(client, name):
+    """Delete a collection if it exists and create it anew without a version.
+
+    The collection should be stamped by `stamp_collection` only once all data has
+    been added, so that the backend never caches results of a partial collection
+    under the new version.
+    """
+    for collection in client.list_collections():
+        if collection.name == name:
+            client.delete_collection(name)
+            break
+    return client.create_collection(name)
+
+
+def stamp_collection(collection, version, filter_pushdown=False):
+    """Stamp a collection with its version once all data has been added.
+
+    Collections storing the derived columns for filter pushdown should be marked by
+    `filter_pushdown` so that the backend pushes all filters down to ChromaDB.
+    """
+    metadata = {"version": version}
+    if filter_pushdown:
+        metadata["filter_pushdown"] = True
+    collection.modify(metadata=metadata)
+
+
 def main(host):
     # Check ChromaDB connection in the first place to avoid unnecessary work
     client = chromadb.HttpClient(host=host or CHROMADB_HOST, port=CHROMADB_PORT)
@@ -51,31 +132,34 @@ def main(host):
         progress.update(task, advance=1)
 
         # Fetch embeddings from the bucket or reuse from local
-        task = progress.add_task("Fetching embeddings...", total=1)
-        if EMBEDDINGS_NPY_PATH.exists():
-            embeddings = np.load(EMBEDDINGS_NPY_PATH)
-        else:
-            storage_client = storage.Client()
-            bucket = storage_client.bucket(BUCKET_NAME)
-            embeddings_blob = bucket.get_blob(BUCKET_EMBEDDINGS_NPY_PATH)
-            embeddings_stream = BytesIO()
-            embeddings_blob.download_to_file(embeddings_stream)
-            embeddings_stream.seek(0)
-            embeddings = np.load(embeddings_stream)
-            # Save the embeddings locally for possible reuse; the embed subcommand
-            # always overwrites so this is safe
-            np.save(EMBEDDINGS_NPY_PATH, embeddings)
+        task = progress.add_task("Fetching embeddings...", total=2)
+        embeddings = load_embeddings(EMBEDDINGS_NPY_PATH, BUCKET_EMBEDDINGS_NPY_PATH)
+        progress.update(task, advance=1)
+        section_embeddings = load_embeddings(
+            SECTION_EMBEDDINGS_NPY_PATH, BUCKET_SECTION_EMBEDDINGS_NPY_PATH
+        )
         progress.update(task, advance=1)
 
+        # Recompute the sections in the same order as they were embedded
+        section_ids, section_texts, section_metadatas = [], [], []
+        for study in studies_df.to_dict("records"):
+            for name, text in get_study_sections(study).items():
+                section_ids.append(f"{study['id']}:{name}")
+                section_texts.append(text)
+                section_metadatas.append({"trial_id": study["id"], "section": name})
+        if len(section_ids) != len(section_embeddings):
+            rich.print(
+                f"[bold red]ERROR[/] Got {len(section_embeddings)} section embeddings "
+                f"for {len(section_ids)} sections; rerun the embed subcommand"
+            )
+            return
+
         # Insert embeddings and metadata to the vector database; we will first delete
         # the original collection if it exists to avoid conflicting data, then recreate
         # it with new data
-        task = progress.add_task("Inserting data to ChromaDB...", total=1)
-        for collection in client.list_collections():
-            if collection.name == CHROMADB_COLLECTION_NAME:
-                client.delete_collection(CHROMADB_COLLECTION_NAME)
-                break
-        collection = client.create_collection(CHROMADB_COLLECTION_NAME)
+        task = progress.add_task("Inserting data to ChromaDB...", total=2)
+        version = datetime.now(timezone.utc).isoformat()
+        collection = recreate_collection(client, CHROMADB_COLLECTION_NAME)
         collection.add(
             ids=study_ids,
             embeddings=embeddings.tolist(),
@@ -84,7 +168,32 @@ def main(host):
         )
         progress.update(task, advance=1)
 
-    rich.print(
-        f"[bold green]->[/] Data inserted to collection {CHROMADB_COLLECTION_NAME!r} "
-        "in ChromaDB."
-    )
+        # There are several sections per study so they are added in batches
+        sections_collection = recreate_collection(
+            client, CHROMADB_SECTIONS_COLLECTION_NAME
+        )
+        batch_size = client.get_max_batch_size()
+        for start in range(0, len(section_ids), batch_size):
+            end = start + batch_size
+            sections_collection.add(
+                ids=section_ids[start:end],
+                embeddings=section_embeddings[start:end].tolist(),
+                documents=section_texts[start:end],
+                metadatas=section_metadatas[start:end],
+            )
+
+        # Only now that all data is in are the collections stamped with the new
+        # version, so that the backend invalidates its caches derived from the old
+        # data without caching any partial results; the sections collection shares
+        # the version and is stamped first, so that it is complete whenever the main
+        # collection has the new version; the main collection is also marked to have
+        # the derived columns so that the backend can push down all filters
+        stamp_collection(sections_collection, version)
+        stamp_collection(collection, version, filter_pushdown=True)
+        progress.update(task, advance=1)
+
+    for name in [CHROMADB_COLLECTION_NAME, CHROMADB_SECTIONS_COLLECTION_NAME]:
+        rich.print(
+            f"[bold green]->[/] Data inserted to collection {name!r} "
+            f"(version {version!r}) in ChromaDB."
+        )